@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration for the parameter extraction service.
+
+By default runs a single preloaded worker with a thread pool. The embedding model
+and intent label embeddings are loaded once, before the worker starts, and every
+request thread shares them. Threads overlap on OpenRouter I/O and on the
+GIL-releasing numpy/torch calls during encoding, and feed the optional embedding
+micro-batcher.
+
+Set GUNICORN_WORKER_CLASS=gevent to serve from greenlets instead. Gunicorn then
+monkey-patches the worker, so the blocking `requests` calls to OpenRouter yield
+to other requests and one worker can hold GUNICORN_WORKER_CONNECTIONS calls in
+flight. The app is not preloaded in that mode: it must be imported after the
+patching, so each worker loads its own copy of the embedding model. Encoding is
+CPU-bound and blocks the worker's other greenlets while it runs.
+
+Usage:
+    gunicorn --config gunicorn_conf.py
+"""
+
+import os
+
+wsgi_app = "parameter_extraction_service:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5006')}"
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+
+if worker_class == "gevent":
+    preload_app = False
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500"))
+else:
+    preload_app = True
+    threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# LLM calls can take up to LLM_REQUEST_DEADLINE_SECONDS; leave headroom
+timeout = 120
+
+
+def post_worker_init(worker):
+    """Warms up the service in the worker process before it accepts requests."""
+    from parameter_extraction_service import warm_up_service
+
+    warm_up_service()
@@ -27,28 +27,76 @@ Notes:
       valid makes, fuel types) and logical constraints (e.g., minPrice <= maxPrice).
 
 Dependencies:
-    - Standard Library: datetime, json, logging, os, re, sys, typing
-    - Third-party: numpy, requests, dotenv, Flask
+    - Standard Library: collections, concurrent.futures, copy, dataclasses, functools, datetime, hashlib, json,
+      logging, os, re, sys, threading, time, typing
+    - Third-party: numpy, requests, urllib3, dotenv, Flask, orjson (optional),
+      pyahocorasick (optional)
     - Local: retriever.retriever (for cosine_sim, get_query_embedding, find_best_match,
       initialize_retriever)
 """
 
 # !/usr/bin/env python3
 # Standard library imports first
+import bisect
+import copy
+import functools
 import datetime
+import hashlib
 import json
 import logging
 import os
 import re
 import sys
-from typing import Any, Dict, List, Optional, Set
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import numpy as np
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Third-party imports
-from flask import Flask, jsonify, request
+from flask import Flask, current_app, g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+# orjson parses several times faster than the standard library and accepts bytes
+# directly; fall back to json if it is not installed
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps_bytes = orjson.dumps
+
+    def json_dumps_sorted_bytes(obj: Any) -> bytes:
+        """Serializes `obj` to JSON bytes with sorted keys, for hashing into cache keys."""
+        return orjson.dumps(
+            obj, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        )
+
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
+    def json_dumps_bytes(obj: Any) -> bytes:
+        """Serializes `obj` to UTF-8 JSON bytes (standard library fallback)."""
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    def json_dumps_sorted_bytes(obj: Any) -> bytes:
+        """Serializes `obj` to JSON bytes with sorted keys (standard library fallback)."""
+        return json.dumps(obj, sort_keys=True, default=str).encode("utf-8")
+
+# pyahocorasick scans for all car keywords in a single pass; is_car_related falls
+# back to a substring loop if it is not installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # Local application imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -60,6 +108,7 @@ try:
         get_query_embedding,
     )  # Assumes this function exists in retriever.py now
     from retriever.retriever import find_best_match, initialize_retriever
+    from retriever.embed_model_loader import EMBEDDING_MODEL_NAME
 except ImportError as ie:
     logging.error(
         f"Could not import from retriever package: {ie}. "
@@ -71,7 +120,7 @@ except ImportError as ie:
         """Placeholder for initialize_retriever if import fails."""
         logger.error("retriever.initialize_retriever failed to import!")
 
-    def get_query_embedding(text):
+    def get_query_embedding(text, out=None):
         """Placeholder for get_query_embedding if import fails."""
         logger.error("retriever.get_query_embedding failed to import!")
         return None
@@ -81,11 +130,13 @@ except ImportError as ie:
         logger.error("retriever.cosine_sim failed to import!")
         return 0.0
 
-    def find_best_match(text):
+    def find_best_match(text, query_embedding=None):
         """Placeholder for find_best_match if import fails."""
         logger.error("retriever.find_best_match failed to import!")
         return "error", 0.0
 
+    EMBEDDING_MODEL_NAME = None
+
 
 load_dotenv()
 
@@ -105,6 +156,62 @@ OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 FAST_MODEL = "meta-llama/llama-3.3-8b-instruct:free"
 REFINE_MODEL = "google/gemma-3-27b-it:free"
 CLARIFY_MODEL = "mistralai/mistral-7b-instruct:free"
+# Model run_llm_with_history currently tries first (differs from FAST_MODEL above)
+EXTRACTION_FAST_MODEL = "meta-llama/llama-3.1-8b-instruct:free"
+# Also send a throwaway extraction to each model on warm-up (uses API quota)
+LLM_WARMUP_MODELS = os.environ.get("LLM_WARMUP_MODELS", "false").lower() == "true"
+ERROR_BODY_LOG_LIMIT = 512  # Max bytes of an OpenRouter error body to log
+OPENROUTER_TIMEOUT_SECONDS = 45  # Timeout for a single OpenRouter call
+LLM_REQUEST_DEADLINE_SECONDS = 60  # Total time budget for all model attempts in one request
+# The full parameter JSON is ~250 tokens; the cap stops runaway generation after it
+LLM_MAX_OUTPUT_TOKENS = 384
+# Ask OpenRouter for JSON mode (response_format json_object) so the model emits the
+# bare object with no prose or Markdown fence around it. Off by default because
+# not every free model supports it.
+LLM_JSON_MODE = os.environ.get("LLM_JSON_MODE", "false").lower() == "true"
+# Conversation turns included in the extraction prompt. Extraction only needs the
+# assistant's latest question and the user's reply; older turns just add prefill tokens.
+PROMPT_HISTORY_TURNS = 2
+
+# Optional hedged extraction: the first extraction attempt sends the prompt to every
+# model in LLM_HEDGED_MODELS at once and uses the first valid JSON that comes back,
+# so worst-case latency is the slowest model rather than the sum. Off by default
+# because it spends API quota on every model for every request.
+LLM_HEDGING_ENABLED = os.environ.get("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGED_MODELS = (EXTRACTION_FAST_MODEL, CLARIFY_MODEL)
+
+# Shared session so OpenRouter calls reuse pooled keep-alive connections instead of
+# paying DNS + TCP + TLS setup on every request
+OPENROUTER_POOL_SIZE = 16
+# Transient gateway errors and failed connects are retried on a fresh pooled
+# connection with a short backoff. Read timeouts are not retried: the request was
+# sent, and resending it would double the wait. After the last retry the final
+# response is returned so its status is logged like any other failure.
+OPENROUTER_RETRY = Retry(
+    total=2,
+    read=0,
+    backoff_factor=0.2,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"HEAD", "POST"}),
+    raise_on_status=False,
+)
+_openrouter_session = requests.Session()
+_openrouter_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=OPENROUTER_POOL_SIZE,
+        max_retries=OPENROUTER_RETRY,
+    ),
+)
+_openrouter_session.headers.update(
+    {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://smartautotrader.app",
+        "X-Title": "SmartAutoTraderParameterExtraction",
+    }
+)
 VERY_LOW_CONFIDENCE_THRESHOLD = 0.2  # Task 1: Define a constant
 
 # Define thresholds for confidence levels
@@ -128,6 +235,67 @@ INTENT_LABELS = {
 }
 # Dictionary to hold precomputed embeddings for labels
 PRECOMPUTED_LABEL_EMBEDDINGS = {}
+# Label names and their L2-normalized embeddings stacked as rows (built at startup),
+# so a query is scored against every intent label with one matrix-vector product
+LABEL_NAMES: tuple = ()
+LABEL_MATRIX: Optional[np.ndarray] = None
+# Intent label embeddings are saved here after the first computation, keyed by the
+# embedding model and label descriptions, so later starts skip the forward passes
+LABEL_EMBEDDINGS_CACHE_DIR = os.environ.get(
+    "LABEL_EMBEDDINGS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+
+# Semantic cache of recent (query embedding, extracted parameters) pairs.
+# A new query whose embedding is close enough to a cached one reuses the cached
+# parameters instead of calling OpenRouter again.
+SEMANTIC_CACHE_CAPACITY = 256
+SEMANTIC_CACHE_THRESHOLD = 0.95
+# Embeddings barely move when only a number, a comparison word or a make changes
+# ("under 20k" vs "under 30k" or "over 20k"), so a hit must also mention the same
+# numbers, comparison words, transmission and makes/types/fuels
+# (see semantic_cache_signature)
+SEMANTIC_CACHE_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*k?")
+SEMANTIC_CACHE_QUALIFIER_RE = re.compile(
+    r"\b(?:under|over|below|above|less|more|at least|at most|up to|max|maximum|min"
+    r"|minimum|between|before|after|newer|older|since|manual|automatic)\b"
+)
+_semantic_cache_lock = threading.Lock()
+_semantic_cache_vectors: Optional[np.ndarray] = None  # Allocated on first store
+_semantic_cache_params: List[Optional[Dict[str, Any]]] = [None] * SEMANTIC_CACHE_CAPACITY
+_semantic_cache_signatures: List[Optional[Tuple]] = [None] * SEMANTIC_CACHE_CAPACITY
+_semantic_cache_size = 0
+_semantic_cache_next = 0  # Round-robin write pointer
+
+# LRU cache of successful run_llm_with_history results, keyed by a hash of the
+# normalized query, recent history, category, model strategy and context.
+# Entries expire after EXTRACTION_CACHE_TTL_SECONDS so prompt or model changes
+# on OpenRouter's side eventually reach repeated queries
+EXTRACTION_CACHE_MAXSIZE = 4096
+EXTRACTION_CACHE_TTL_SECONDS = float(os.environ.get("EXTRACTION_CACHE_TTL_SECONDS", "600"))
+EXTRACTION_CACHE_HISTORY_TURNS = PROMPT_HISTORY_TURNS  # Older turns never reach the prompt
+# Values are (expiry on the monotonic clock, extracted parameters)
+_extraction_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_extraction_cache_lock = threading.Lock()
+
+# Per-thread scratch buffer for query embeddings, reused across requests
+_thread_local = threading.local()
+
+# LRU cache of normalized query embeddings keyed by a hash of the query text, so a
+# repeated query skips the sentence-transformer forward pass
+QUERY_EMBEDDING_CACHE_MAXSIZE = 1024
+_query_embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_query_embedding_cache_lock = threading.Lock()
+
+# LRU cache of rendered system prompts keyed by a hash of the per-request inputs,
+# so a retried or repeated turn skips prompt assembly. Only prompts built from the
+# module's own valid lists are cached.
+PROMPT_CACHE_MAXSIZE = 1024
+_prompt_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_prompt_cache_lock = threading.Lock()
+
+# Size of the per-string LRU caches on the pure query helpers below
+QUERY_HELPER_CACHE_MAXSIZE = 4096
 
 # Lists for validating extracted parameters (moved here for potential reuse)
 VALID_MANUFACTURERS = [
@@ -174,7 +342,349 @@ VALID_VEHICLE_TYPES = [
     "MPV",
 ]
 
-negation_triggers = [
+# Lowercase -> canonical casing lookups, built once at import. They serve both as the
+# O(1) case-insensitive membership check and to keep the casing of the valid lists.
+CANONICAL_MAKE = {m.lower(): m for m in VALID_MANUFACTURERS}
+CANONICAL_FUEL_TYPE = {f.lower(): f for f in VALID_FUEL_TYPES}
+CANONICAL_VEHICLE_TYPE = {v.lower(): v for v in VALID_VEHICLE_TYPES}
+# Every lowercased valid make, fuel type and vehicle type, without duplicates. A
+# tuple so find_whole_word_items can build (and cache) one automaton over it.
+VALID_KEYWORDS_LOWER = tuple(
+    dict.fromkeys([*CANONICAL_MAKE, *CANONICAL_FUEL_TYPE, *CANONICAL_VEHICLE_TYPE])
+)
+# List parameters validated against a canonical-casing lookup
+CANONICAL_LIST_PARAMS = (
+    ("preferredMakes", CANONICAL_MAKE),
+    ("preferredFuelTypes", CANONICAL_FUEL_TYPE),
+    ("preferredVehicleTypes", CANONICAL_VEHICLE_TYPE),
+)
+
+# Keywords that mark a query as car-related, including every valid make.
+# Built once at import instead of on every is_car_related call.
+CAR_KEYWORDS = frozenset(
+    {
+        "car",
+        "vehicle",
+        "auto",
+        "automobile",
+        "sedan",
+        "suv",
+        "truck",
+        "hatchback",
+        "coupe",
+        "convertible",
+        "van",
+        "minivan",
+        "electric",
+        "hybrid",
+        "diesel",
+        "petrol",
+        "gasoline",
+        "make",
+        "model",
+        "year",
+        "price",
+        "mileage",
+        "engine",
+        "transmission",
+        "drive",
+        "buy",
+        "sell",
+        "lease",
+        "dealer",
+        "used",
+        "new",
+        "road tax",
+        "nct",
+        "insurance",
+        "mpg",
+        "kpl",
+        "automatic",
+        "manual",
+        "auto",
+        "stick shift",
+        "paddle shift",
+        "dsg",
+        "cvt",
+        "engine size",
+        "liter",
+        "litre",
+        "cc",
+        "cubic",
+        "displacement",
+        "horsepower",
+        "hp",
+        "bhp",
+        "power",
+        "torque",
+        "performance",
+        "l engine",
+        "cylinder",
+    }
+).union(CANONICAL_MAKE)
+
+
+# Greetings and small talk that mark a query without car keywords as off-topic
+OFF_TOPIC_STARTS = (
+    "hi",
+    "hello",
+    "how are you",
+    "who is",
+    "tell me a joke",
+    "hey",
+    "hey there",
+    "yo",
+    "sup",
+    "what's up",
+    "hiya",
+    "howdy",
+    "good morning",
+    "good afternoon",
+    "good evening",
+)
+# General questions that are unlikely to be car-related when no car keyword matched
+OFF_TOPIC_QUESTION_STARTS = ("what is", "what are", "where is")
+
+
+def _build_car_keyword_automaton():
+    """Builds an Aho-Corasick automaton over CAR_KEYWORDS, or returns None if unavailable."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword in CAR_KEYWORDS:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+
+CAR_KEYWORD_AUTOMATON = _build_car_keyword_automaton()
+
+# --- Scalar parameter keyword sets ---
+# A scalar value the LLM extracts is only used if the query mentions its
+# parameter type; these keywords (matched as substrings) mark each type.
+
+# Keywords related to price parameters
+PRICE_KEYWORDS = frozenset(
+    {
+        "price",
+        "budget",
+        "cost",
+        "euro",
+        "dollar",
+        "pound",
+        "spend",
+        "pay",
+        "afford",
+        "€",
+        "$",
+        "£",
+        "under",
+        "over",
+        "between",
+        "range",
+        "cheap",
+        "expensive",
+        "pricey",
+        "costly",
+        "money",
+        "funds",
+        "finances",
+        "affordable",
+        "grand",
+        "k",
+    }
+)
+
+# Keywords related to year parameters
+YEAR_KEYWORDS = frozenset(
+    {
+        "year",
+        "older",
+        "newer",
+        "age",
+        "recent",
+        "vintage",
+        "yr",
+        "model year",
+        "registration",
+        "reg",
+        "plate",
+        "built",
+        "manufactured",
+        "make",
+        "made",
+        "new",
+        "old",
+        "20",
+        "19",
+        "'",
+        "from",
+        "since",
+        "before",  # Year indicators like '20xx, '19xx
+    }
+)
+
+# Keywords related to mileage parameters
+MILEAGE_KEYWORDS = frozenset(
+    {
+        "mileage",
+        "miles",
+        "mile",
+        "km",
+        "kilometers",
+        "kilometre",
+        "odometer",
+        "clock",
+        "driven",
+        "used",
+        "low",
+        "high",
+        "distance",
+        "travelled",
+        "run",
+        "usage",
+        "wear",
+    }
+)
+
+# Keywords related to transmission parameters
+TRANSMISSION_KEYWORDS = frozenset(
+    {
+        "transmission",
+        "automatic",
+        "manual",
+        "gear",
+        "gearbox",
+        "auto",
+        "stick",
+        "cvt",
+        "dsg",
+        "paddle",
+        "shift",
+        "clutch",
+        "self-shifting",
+        "tiptronic",
+        "sequential",
+    }
+)
+
+# Keywords related to engine size parameters
+ENGINE_KEYWORDS = frozenset(
+    {
+        "engine",
+        "size",
+        "liter",
+        "litre",
+        "l engine",
+        "cc",
+        "cubic",
+        "displacement",
+        "capacity",
+        "motor",
+        "cylinder",
+        "cylinders",
+        "block",
+        "tdi",
+        "tsi",
+        "tfsi",
+        "turbo",
+        "small",
+        "big",
+        "large",
+        "displacement",
+    }
+)
+
+# Keywords related to horsepower parameters
+HP_KEYWORDS = frozenset(
+    {
+        "horsepower",
+        "hp",
+        "bhp",
+        "power",
+        "ps",
+        "kw",
+        "performance",
+        "fast",
+        "strong",
+        "quick",
+        "powerful",
+        "output",
+        "torque",
+        "acceleration",
+        "pulling power",
+        "grunt",
+    }
+)
+
+# Keyword sets by scalar parameter category
+SCALAR_KEYWORD_SETS = {
+    "price": PRICE_KEYWORDS,
+    "year": YEAR_KEYWORDS,
+    "mileage": MILEAGE_KEYWORDS,
+    "transmission": TRANSMISSION_KEYWORDS,
+    "engine": ENGINE_KEYWORDS,
+    "hp": HP_KEYWORDS,
+}
+
+# (parameter, confirmed-context key, keyword category) for each scalar parameter
+SCALAR_PARAM_TABLE = (
+    ("minPrice", "confirmedMinPrice", "price"),
+    ("maxPrice", "confirmedMaxPrice", "price"),
+    ("minYear", "confirmedMinYear", "year"),
+    ("maxYear", "confirmedMaxYear", "year"),
+    ("maxMileage", "confirmedMaxMileage", "mileage"),
+    ("transmission", "confirmedTransmission", "transmission"),
+    ("minEngineSize", "confirmedMinEngineSize", "engine"),
+    ("maxEngineSize", "confirmedMaxEngineSize", "engine"),
+    ("minHorsepower", "confirmedMinHorsePower", "hp"),  # Note the capital P in HorsePower
+    ("maxHorsepower", "confirmedMaxHorsePower", "hp"),  # Note the capital P in HorsePower
+)
+
+# Parameters is_valid_extraction accepts as search criteria, and the negation lists
+SEARCH_SCALAR_CRITERIA = tuple(param for param, _, _ in SCALAR_PARAM_TABLE)
+SEARCH_LIST_CRITERIA = (
+    "preferredMakes",
+    "preferredFuelTypes",
+    "preferredVehicleTypes",
+    "desiredFeatures",
+)
+NEGATED_LIST_KEYS = (
+    "explicitly_negated_makes",
+    "explicitly_negated_vehicle_types",
+    "explicitly_negated_fuel_types",
+)
+
+# One keyword alternation per scalar category, for scans without pyahocorasick.
+# A search finds a match exactly when some keyword is a substring of the text.
+SCALAR_KEYWORD_RES = {
+    category: re.compile("|".join(map(re.escape, sorted(keywords, key=len, reverse=True))))
+    for category, keywords in SCALAR_KEYWORD_SETS.items()
+}
+
+
+def _build_scalar_keyword_automaton():
+    """
+    Builds an Aho-Corasick automaton mapping each scalar keyword to the categories
+    it marks, or returns None if pyahocorasick is unavailable.
+    """
+    if ahocorasick is None:
+        return None
+    keyword_categories: Dict[str, Set[str]] = {}
+    for category, keywords in SCALAR_KEYWORD_SETS.items():
+        for keyword in keywords:
+            keyword_categories.setdefault(keyword, set()).add(category)
+    automaton = ahocorasick.Automaton()
+    for keyword, categories in keyword_categories.items():
+        automaton.add_word(keyword, frozenset(categories))
+    automaton.make_automaton()
+    return automaton
+
+
+SCALAR_KEYWORD_AUTOMATON = _build_scalar_keyword_automaton()
+
+
+negation_triggers = (
     "no ",
     "not ",
     "don't want ",
@@ -191,14 +701,86 @@ negation_triggers = [
     "other than ",
     "besides ",
     "apart from ",
-]
+)
+
+# Finds every negation trigger in one pass. The lookahead makes matches zero-width,
+# so overlapping triggers ("anything except " / "except ") are each reported, the
+# same as searching for every trigger separately.
+NEGATION_TRIGGER_RE = re.compile(
+    "(?=("
+    + "|".join(map(re.escape, sorted(negation_triggers, key=len, reverse=True)))
+    + "))"
+)
+# Ends the phrase that follows a negation trigger
+PHRASE_BOUNDARY_RE = re.compile(r"[.!?,\n]| but | also | and | with | like | prefer ")
+
+
+def _build_negation_trigger_automaton():
+    """Builds an Aho-Corasick automaton over negation_triggers, or returns None if unavailable."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for trigger in negation_triggers:
+        automaton.add_word(trigger, trigger)
+    automaton.make_automaton()
+    return automaton
+
+
+NEGATION_TRIGGER_AUTOMATON = _build_negation_trigger_automaton()
+
+# Matches one "word" for word_count_clean
+WORD_TOKEN_RE = re.compile(r"\S*[a-zA-Z0-9]\S*")
 
-conjunctions = [" or ", " and ", ", "]
+# A JSON object wrapped in a ```json Markdown fence in LLM output
+JSON_FENCE_RE = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL | re.IGNORECASE)
+# Characters that change JSON nesting state while scanning a completion stream
+STREAM_STRUCTURAL_CHAR_RE = re.compile(r'[{}"\\]')
+
+# Numeric patterns used by the RAG-category and direct query extractors
+QUERY_PRICE_RE = re.compile(r"(\d[\d,]*(?:\.\d+)?)\s*(?:k|€|£|\$)?")
+QUERY_MILEAGE_RE = re.compile(r"(\d[\d,]*)\s*(?:km|miles|mi)?")
+QUERY_YEAR_RE = re.compile(r"(20\d{2}|19\d{2}|'\d{2}|\d{2})")
+CATEGORY_PRICE_RE = re.compile(
+    r"(?:budget|price|cost|under|up to|€|£|\$)\s*(\d[\d,]*(?:\.\d+)?)\s*(?:k|€|£|\$)?"
+)
+CATEGORY_MILEAGE_RE = re.compile(
+    r"(?:mileage|miles|km|odometer).*?(\d[\d,]*)\s*(?:km|miles|mi)?"
+)
+CATEGORY_YEAR_RE = re.compile(
+    r"(?:year|from|since|after|before|newer than|older than)\s*((?:20|19)\d{2})"
+)
+STANDALONE_YEAR_RE = re.compile(r"\b(20\d{2}|19\d{2})\b")
+DIRECT_PRICE_RES = (
+    # Match formats like "€25000", "25k", "under 25000", "budget 25000"
+    re.compile(
+        r"(?:budget|price|cost|under|up to|max|maximum|\€|\$|\£)\s*(\d[\d,]*(?:\.\d+)?)\s*(?:k|€|£|\$)?"
+    ),
+    # Match standalone numbers with currency indicators
+    re.compile(r"(\d[\d,]*(?:\.\d+)?)\s*(?:k|grand|euros|euro|pounds|dollars)"),
+)
+DIRECT_MILEAGE_RES = (
+    # Match formats like "50000 km", "under 50000 miles", "max mileage 50000"
+    re.compile(
+        r"(?:mileage|miles|km|odometer|driven|under|max|maximum)\s*(\d[\d,]*)\s*(?:km|miles|mi)?"
+    ),
+)
+# Years that come after qualifiers indicating min or max
+DIRECT_YEAR_AFTER_RE = re.compile(
+    r"(?:after|since|from|newer than|min|minimum|at least)\s*((?:20|19)\d{2}|[\']\d{2})"
+)
+DIRECT_YEAR_BEFORE_RE = re.compile(
+    r"(?:before|until|older than|max|maximum|up to|no older than)\s*((?:20|19)\d{2}|[\']\d{2})"
+)
+STANDALONE_2000S_YEAR_RE = re.compile(r"\b(20\d{2})\b")
+
+# The backend appends a follow-up to the original query after this separator
+FOLLOW_UP_SEPARATOR = " - Additional info:"
 
 
 # --- Helper Function Definitions (Defined Before Routes) ---
 
 
+@functools.lru_cache(maxsize=QUERY_HELPER_CACHE_MAXSIZE)
 def word_count_clean(query: str) -> int:
     """Counts meaningful words in a cleaned-up user query.
 
@@ -217,10 +799,12 @@ def word_count_clean(query: str) -> int:
         >>> word_count_clean("  Find me a car.  ")
         4
     """
-    cleaned = re.sub(r"[^a-zA-Z0-9 ]+", "", query).lower()
-    return len(cleaned.strip().split())
+    # A word is any whitespace-delimited run containing at least one letter or digit,
+    # which matches stripping punctuation and splitting, without building a list
+    return sum(1 for _ in WORD_TOKEN_RE.finditer(query))
 
 
+@functools.lru_cache(maxsize=QUERY_HELPER_CACHE_MAXSIZE)
 def extract_newest_user_fragment(query: str) -> str:
     """
     Extracts the latest user input from a potentially compound query string.
@@ -241,14 +825,75 @@ def extract_newest_user_fragment(query: str) -> str:
         >>> extract_newest_user_fragment("Just a red car")
         'Just a red car'
     """
-    # Use rsplit to handle multiple occurrences, splitting only once from the right
-    parts = query.rsplit(" - Additional info:", 1)
-    if len(parts) > 1:
-        return parts[-1].strip()
+    # Use rpartition to handle multiple occurrences, splitting only once from the right
+    _, separator, newest = query.rpartition(FOLLOW_UP_SEPARATOR)
+    if separator:
+        return newest.strip()
     else:
         return query.strip()  # Return original if pattern not found
 
 
+def label_embeddings_cache_path() -> str:
+    """
+    Returns the on-disk path for the cached intent label embeddings.
+
+    The file name contains a hash of the embedding model name and the label
+    descriptions, so changing either one makes the old file unused.
+
+    Returns:
+        The path of the .npz file inside LABEL_EMBEDDINGS_CACHE_DIR.
+    """
+    key_material = json.dumps(
+        {"model": EMBEDDING_MODEL_NAME, "labels": INTENT_LABELS}, sort_keys=True
+    )
+    key = hashlib.blake2b(key_material.encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(LABEL_EMBEDDINGS_CACHE_DIR, f"intent_embeddings_{key}.npz")
+
+
+def load_cached_label_embeddings() -> Optional[Dict[str, np.ndarray]]:
+    """
+    Loads intent label embeddings saved by a previous start.
+
+    Returns:
+        A dict of label -> embedding if a cache file exists and covers every label
+        in INTENT_LABELS, otherwise None. Unreadable files are treated as missing.
+    """
+    path = label_embeddings_cache_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            embeddings = {label: data[label] for label in INTENT_LABELS}
+    except Exception as e:
+        logger.warning("Ignoring unreadable label embedding cache %s: %s", path, e)
+        return None
+    logger.info("Loaded intent label embeddings from %s.", path)
+    return embeddings
+
+
+def save_label_embeddings(embeddings: Dict[str, np.ndarray]) -> None:
+    """
+    Saves intent label embeddings so the next start can load them.
+
+    The file is written under a temporary name and then renamed, so a worker
+    starting at the same time never reads a half-written file. Failures are
+    logged and otherwise ignored.
+
+    Args:
+        embeddings: A dict of label -> embedding.
+    """
+    path = label_embeddings_cache_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(LABEL_EMBEDDINGS_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **embeddings)
+        os.replace(tmp_path, path)
+        logger.info("Saved intent label embeddings to %s.", path)
+    except OSError as e:
+        logger.warning("Could not save label embedding cache %s: %s", path, e)
+
+
 def initialize_app_components():
     """
     Initializes necessary components for the application.
@@ -257,34 +902,51 @@ def initialize_app_components():
     1. Initializes the RAG (Retrieval Augmented Generation) retriever by calling
        `initialize_retriever()`. This typically involves loading language models
        and precomputed embeddings for vehicle categories.
-    2. Precomputes embeddings for the intent labels defined in `INTENT_LABELS`.
+    2. Precomputes embeddings for the intent labels defined in `INTENT_LABELS`,
+       or loads them from the on-disk cache written by an earlier start.
        These embeddings are stored in the global `PRECOMPUTED_LABEL_EMBEDDINGS`
        dictionary and are used for zero-shot intent classification.
 
     If any part of the initialization fails, appropriate error messages are logged,
     and `PRECOMPUTED_LABEL_EMBEDDINGS` might be left empty, potentially disabling
     or degrading intent classification.
+
+    Safe to call more than once: after a successful run, later calls return
+    immediately, so the models loaded by a preloading server are reused.
     """
-    global PRECOMPUTED_LABEL_EMBEDDINGS
+    global PRECOMPUTED_LABEL_EMBEDDINGS, LABEL_NAMES, LABEL_MATRIX
+    if LABEL_MATRIX is not None:
+        logger.info("App components already initialized.")
+        return
     logger.info("Initializing app components...")
     try:
         initialize_retriever()  # Initialize RAG retriever (loads model, category embeddings)
         logger.info("Retriever initialized successfully.")
 
-        logger.info("Pre-computing intent label embeddings...")
         embeddings_computed = True
-        temp_embeddings = {}
-        for label, description in INTENT_LABELS.items():
-            embedding = get_query_embedding(
-                description
-            )  # Use the embedding function from retriever
-            if embedding is not None:
-                temp_embeddings[label] = embedding
-            else:
-                logger.error(f"Failed to compute embedding for intent label: {label}")
-                embeddings_computed = False
+        temp_embeddings = load_cached_label_embeddings()
+        if temp_embeddings is None:
+            logger.info("Pre-computing intent label embeddings...")
+            temp_embeddings = {}
+            for label, description in INTENT_LABELS.items():
+                embedding = get_query_embedding(
+                    description
+                )  # Use the embedding function from retriever
+                if embedding is not None:
+                    # Pin float32 so the label matrix and the saved cache never hold float64
+                    temp_embeddings[label] = np.ascontiguousarray(
+                        embedding, dtype=np.float32
+                    )
+                else:
+                    logger.error(
+                        "Failed to compute embedding for intent label: %s", label
+                    )
+                    embeddings_computed = False
+            if embeddings_computed:
+                save_label_embeddings(temp_embeddings)
 
         PRECOMPUTED_LABEL_EMBEDDINGS = temp_embeddings  # Assign after loop finishes
+        LABEL_NAMES, LABEL_MATRIX = build_label_matrix(PRECOMPUTED_LABEL_EMBEDDINGS)
 
         if embeddings_computed and PRECOMPUTED_LABEL_EMBEDDINGS:
             logger.info("Successfully pre-computed all intent label embeddings.")
@@ -298,8 +960,41 @@ def initialize_app_components():
             )
 
     except Exception as e:
-        logger.error(f"Error during app component initialization: {e}", exc_info=True)
+        logger.error("Error during app component initialization: %s", e, exc_info=True)
         PRECOMPUTED_LABEL_EMBEDDINGS = {}  # Ensure it's empty on error
+        LABEL_NAMES, LABEL_MATRIX = (), None
+
+
+def build_label_matrix(
+    label_embeddings: Dict[str, np.ndarray]
+) -> tuple:
+    """
+    Stacks intent label embeddings into an L2-normalized float32 matrix.
+
+    Args:
+        label_embeddings: Mapping of intent label to its embedding.
+
+    Returns:
+        A `(names, matrix)` tuple where row `i` of `matrix` is the unit-length
+        embedding of `names[i]`. Returns `((), None)` if no valid embeddings exist.
+    """
+    names = []
+    rows = []
+    for label, embedding in label_embeddings.items():
+        if not isinstance(embedding, np.ndarray):
+            logger.warning("Skipping invalid embedding type for label '%s'.", label)
+            continue
+        names.append(label)
+        rows.append(embedding)
+
+    if not rows:
+        return (), None
+
+    matrix = np.vstack(rows, dtype=np.float32)  # Stacks straight into float32, one copy
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return tuple(names), matrix
 
 
 def classify_intent_zero_shot(
@@ -328,7 +1023,7 @@ def classify_intent_zero_shot(
         Returns `None` if label embeddings are not available, the query embedding is None,
         no similarities can be calculated, or an unexpected error occurs.
     """
-    if not PRECOMPUTED_LABEL_EMBEDDINGS:
+    if not PRECOMPUTED_LABEL_EMBEDDINGS or LABEL_MATRIX is None:
         logger.warning(
             "Label embeddings not available, skipping intent classification."
         )
@@ -339,49 +1034,47 @@ def classify_intent_zero_shot(
         return None
 
     try:
-        similarities = {}
-        for label, label_embedding in PRECOMPUTED_LABEL_EMBEDDINGS.items():
-            # Ensure embeddings are valid numpy arrays before calculating similarity
-            if isinstance(label_embedding, np.ndarray) and isinstance(
-                query_embedding, np.ndarray
-            ):
-                similarities[label] = cosine_sim(query_embedding, label_embedding)
-            else:
-                logger.warning(
-                    f"Skipping invalid embedding type for label '{label}' or query during classification."
-                )
-
-        if not similarities:
+        # Cosine similarity against every label at once: the label rows are already
+        # unit length, so dividing the label scores by the query norm is enough (no
+        # normalized copy of the query is needed)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = float(np.sqrt(np.dot(query_vector, query_vector)))
+        scores = LABEL_MATRIX @ query_vector
+        if query_norm != 0:
+            scores /= query_norm
+
+        if scores.size == 0:
             logger.warning(
                 "No similarities calculated (embeddings might be missing/invalid)."
             )
             return None
 
-        best_label = max(similarities, key=similarities.get)
-        best_score = float(similarities[best_label])  # Cast to float explicitly
+        best_index = int(np.argmax(scores))
+        best_label = LABEL_NAMES[best_index]
+        best_score = float(scores[best_index])  # Cast to float explicitly
 
-        formatted_scores = {k: f"{v:.2f}" for k, v in similarities.items()}
-        logger.info(
-            f"Intent classification scores: {formatted_scores}"
-        )  # Fixed log statement
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Intent classification scores: %s",
+                {k: round(v, 2) for k, v in zip(LABEL_NAMES, scores.tolist())},
+            )
 
         if best_score >= threshold:
-            logger.info(f"Classified intent: {best_label} (Score: {best_score:.2f})")
+            logger.info("Classified intent: %s (Score: %.2f)", best_label, best_score)
             return best_label
         else:
             # --- NEW FALLBACK LOGIC ---
             logger.info(
-                f"Intent classification score ({best_score:.2f}) below threshold ({threshold}).Applying fallback logic"
+                "Intent classification score (%.2f) below threshold (%s).Applying fallback logic",
+                best_score,
+                threshold,
             )
-            # Check if VAGUE_INQUIRY had the highest (but below threshold) score, OR if both scores are extremely low
-            specific_score = similarities.get("SPECIFIC_SEARCH", 0.0)
-            vague_score = similarities.get("VAGUE_INQUIRY", 0.0)
+            # Check if VAGUE_INQUIRY had the highest (but below threshold) score, OR if both scores are extremely low.
+            # best_score is the maximum, so every score is very low exactly when it is.
             # You might adjust this lower threshold (e.g., 0.25 or 0.3) based on testing
             very_low_threshold = 0.3
 
-            if best_label == "VAGUE_INQUIRY" or (
-                specific_score < very_low_threshold and vague_score < very_low_threshold
-            ):
+            if best_label == "VAGUE_INQUIRY" or best_score < very_low_threshold:
                 logger.info(
                     "Defaulting to VAGUE_INQUIRY based on fallback logic (Vague was highest or both very low)."
                 )
@@ -393,152 +1086,261 @@ def classify_intent_zero_shot(
                 return "SPECIFIC_SEARCH"
             # --- END NEW FALLBACK LOGIC ---
     except Exception as e:
-        logger.error(
-            f"Error during cosine similarity or intent classification logic: {e}",
-            exc_info=True,
-        )
+        logger.warning("Intent classification scoring failed: %r", e)
         return None  # Return None on error
 
 
-def is_car_related(query: str) -> bool:
+def to_unit_vector(embedding: Optional[np.ndarray]) -> Optional[np.ndarray]:
     """
-    Performs a simple heuristic check to determine if a user query is car-related.
+    Returns an L2-normalized float32 copy of an embedding.
 
-    The function checks for the presence of common automotive keywords, including
-    vehicle types, makes, fuel types, and terms related to buying/selling cars.
-    It also tries to identify and filter out common off-topic greetings or
-    general questions not containing car keywords. Very short queries are also
-    scrutinized.
+    Args:
+        embedding: The embedding to normalize.
+
+    Returns:
+        The normalized embedding, or `None` if the embedding is missing or has zero norm.
+    """
+    if embedding is None:
+        return None
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
+
+
+def get_normalized_query_embedding(text: str) -> Optional[np.ndarray]:
+    """
+    Embeds a query into this thread's reusable float32 buffer and L2-normalizes it in place.
+
+    The buffer is allocated on the first call in each thread and overwritten by the
+    next call, so callers must copy the result if they need to keep it beyond the
+    current request. Results are cached by query text, so repeated queries skip
+    the embedding model. The cache key is lowercased and whitespace-collapsed:
+    the model's uncased tokenizer produces the same tokens for both forms.
 
     Args:
-        query: The user query string.
+        text: The text to embed.
 
     Returns:
-        True if the query is deemed car-related, False otherwise.
+        The normalized embedding (the thread's buffer), or `None` if embedding failed.
+    """
+    normalized_text = " ".join(text.lower().split())
+    cache_key = hashlib.blake2b(normalized_text.encode("utf-8"), digest_size=16).digest()
+    buffer = getattr(_thread_local, "query_buffer", None)
+    with _query_embedding_cache_lock:
+        cached = _query_embedding_cache.get(cache_key)
+        if cached is not None:
+            _query_embedding_cache.move_to_end(cache_key)
+    if cached is not None and buffer is not None and buffer.shape == cached.shape:
+        np.copyto(buffer, cached)
+        return buffer
+    if cached is not None:
+        buffer = cached.copy()
+        _thread_local.query_buffer = buffer
+        return buffer
+
+    if buffer is None:
+        embedding = get_query_embedding(text)
+        if embedding is None:
+            return None
+        buffer = np.array(embedding, dtype=np.float32)
+        _thread_local.query_buffer = buffer
+    elif get_query_embedding(text, out=buffer) is None:
+        return None
+    norm = np.linalg.norm(buffer)
+    if norm > 0:
+        buffer /= norm
 
-    Example:
-        >>> is_car_related("I want to buy a Toyota SUV")
-        True
-        >>> is_car_related("What's the weather like?")
-        False
-        >>> is_car_related("BMW")
-        True
-        >>> is_car_related("Hi")
-        False
+    with _query_embedding_cache_lock:
+        _query_embedding_cache[cache_key] = buffer.copy()
+        if len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_MAXSIZE:
+            _query_embedding_cache.popitem(last=False)
+    return buffer
+
+
+def semantic_cache_signature(text_lower: str) -> Tuple:
     """
-    if not query:
-        return False
-    query_lower = query.lower()
+    Returns the exact-match part of a semantic cache key for a query.
 
-    # Combine keywords for better readability
-    car_keywords = {
-        "car",
-        "vehicle",
-        "auto",
-        "automobile",
-        "sedan",
-        "suv",
-        "truck",
-        "hatchback",
-        "coupe",
-        "convertible",
-        "van",
-        "minivan",
-        "electric",
-        "hybrid",
-        "diesel",
-        "petrol",
-        "gasoline",
-        "make",
-        "model",
-        "year",
-        "price",
-        "mileage",
-        "engine",
-        "transmission",
-        "drive",
-        "buy",
-        "sell",
-        "lease",
-        "dealer",
-        "used",
-        "new",
-        "road tax",
-        "nct",
-        "insurance",
-        "mpg",
-        "kpl",
-        "automatic",
-        "manual",
-        "auto",
-        "stick shift",
-        "paddle shift",
-        "dsg",
-        "cvt",
-        "engine size",
-        "liter",
-        "litre",
-        "cc",
-        "cubic",
-        "displacement",
-        "horsepower",
-        "hp",
-        "bhp",
-        "power",
-        "torque",
-        "performance",
-        "l engine",
-        "cylinder",
-    }
+    Args:
+        text_lower: The lowercased query text.
 
-    # Add common makes dynamically from the global list
-    car_keywords.update(make.lower() for make in VALID_MANUFACTURERS)
+    Returns:
+        A tuple of the numbers and the comparison/transmission words in the query,
+        in order, and the makes, types and fuels it mentions, split into positive
+        and negated mentions.
+    """
+    positive, negated = find_terms(text_lower, VALID_KEYWORDS_LOWER)
+    return (
+        tuple(SEMANTIC_CACHE_NUMBER_RE.findall(text_lower)),
+        tuple(SEMANTIC_CACHE_QUALIFIER_RE.findall(text_lower)),
+        frozenset(positive),
+        frozenset(negated),
+    )
 
-    # Check for presence of keywords
-    if any(keyword in query_lower for keyword in car_keywords):
-        return True
 
-    # Enhanced off-topic detection - include more greetings
-    off_topic_starts = (
-        "hi",
-        "hello",
-        "how are you",
-        "who is",
-        "tell me a joke",
-        "hey",
-        "hey there",
-        "yo",
-        "sup",
-        "what's up",
-        "hiya",
-        "howdy",
-        "good morning",
-        "good afternoon",
-        "good evening",
-    )
+def semantic_cache_lookup(query_unit: np.ndarray, signature: Tuple) -> Optional[Dict[str, Any]]:
+    """
+    Looks up previously extracted parameters for a semantically similar query.
+
+    Compares the normalized query embedding against all cached embeddings with a
+    single matrix-vector product and returns the parameters of the most similar
+    entry whose cosine similarity reaches `SEMANTIC_CACHE_THRESHOLD` and whose
+    signature equals `signature`.
+
+    Args:
+        query_unit: The L2-normalized embedding of the user's query.
+        signature: The query's `semantic_cache_signature`.
+
+    Returns:
+        A deep copy of the cached parameters on a hit, so callers can mutate it
+        freely, or `None` on a miss.
+    """
+    with _semantic_cache_lock:
+        if _semantic_cache_vectors is None or _semantic_cache_size == 0:
+            return None
+        if query_unit.shape[0] != _semantic_cache_vectors.shape[1]:
+            return None
+        sims = _semantic_cache_vectors[:_semantic_cache_size] @ query_unit
+        candidates = np.flatnonzero(sims >= SEMANTIC_CACHE_THRESHOLD)
+        # Most similar first
+        for idx in candidates[np.argsort(sims[candidates])[::-1]]:
+            if _semantic_cache_signatures[idx] == signature:
+                logger.info("Semantic cache hit (similarity %.3f).", float(sims[idx]))
+                return copy.deepcopy(_semantic_cache_params[idx])
+        return None
+
+
+def semantic_cache_store(query_unit: np.ndarray, signature: Tuple, params: Dict[str, Any]) -> None:
+    """
+    Stores extracted parameters in the semantic cache.
+
+    Entries are written round-robin, so once the cache is full the oldest entry
+    is overwritten.
+
+    Args:
+        query_unit: The L2-normalized embedding of the user's query.
+        signature: The query's `semantic_cache_signature`.
+        params: The extracted parameters to cache. A deep copy is stored.
+    """
+    global _semantic_cache_vectors, _semantic_cache_size, _semantic_cache_next
+    with _semantic_cache_lock:
+        if (
+            _semantic_cache_vectors is None
+            or _semantic_cache_vectors.shape[1] != query_unit.shape[0]
+        ):
+            _semantic_cache_vectors = np.empty(
+                (SEMANTIC_CACHE_CAPACITY, query_unit.shape[0]), dtype=np.float32
+            )
+            _semantic_cache_size = 0
+            _semantic_cache_next = 0
+        _semantic_cache_vectors[_semantic_cache_next] = query_unit
+        _semantic_cache_params[_semantic_cache_next] = copy.deepcopy(params)
+        _semantic_cache_signatures[_semantic_cache_next] = signature
+        _semantic_cache_next = (_semantic_cache_next + 1) % SEMANTIC_CACHE_CAPACITY
+        _semantic_cache_size = min(_semantic_cache_size + 1, SEMANTIC_CACHE_CAPACITY)
+
+
+@functools.lru_cache(maxsize=QUERY_HELPER_CACHE_MAXSIZE)
+def is_car_related(query: str, query_lower: Optional[str] = None) -> bool:
+    """
+    Performs a simple heuristic check to determine if a user query is car-related.
+
+    The function checks for the presence of common automotive keywords, including
+    vehicle types, makes, fuel types, and terms related to buying/selling cars.
+    It also tries to identify and filter out common off-topic greetings or
+    general questions not containing car keywords. Very short queries are also
+    scrutinized.
+
+    Args:
+        query: The user query string.
+        query_lower: `query.lower()`, if the caller already has it.
+
+    Returns:
+        True if the query is deemed car-related, False otherwise.
+
+    Example:
+        >>> is_car_related("I want to buy a Toyota SUV")
+        True
+        >>> is_car_related("What's the weather like?")
+        False
+        >>> is_car_related("BMW")
+        True
+        >>> is_car_related("Hi")
+        False
+    """
+    if not query:
+        return False
+    if query_lower is None:
+        query_lower = query.lower()
+
+    # Check for presence of keywords (first automaton hit is enough)
+    if CAR_KEYWORD_AUTOMATON is not None:
+        if next(CAR_KEYWORD_AUTOMATON.iter(query_lower), None) is not None:
+            return True
+    elif any(keyword in query_lower for keyword in CAR_KEYWORDS):
+        return True
 
-    # Improved check: either starts with or equals one of these phrases
-    if query_lower.startswith(off_topic_starts) or query_lower in off_topic_starts:
+    # Off-topic greetings (startswith also covers an exact match)
+    if query_lower.startswith(OFF_TOPIC_STARTS):
         return False
 
-    # Check for questions that are unlikely car related unless containing keywords
-    if query_lower.startswith(("what is", "what are", "where is")) and not any(
-        kw in query_lower for kw in ["car", "vehicle", "suv", "sedan"]
-    ):
+    # Check for questions that are unlikely car related (queries containing car
+    # keywords already returned True above)
+    if query_lower.startswith(OFF_TOPIC_QUESTION_STARTS):
         return False
 
-    # Consider very short queries potentially off-topic unless they meet certain conditions
+    # Consider very short queries off-topic. Short queries that contain car
+    # terminology or a make name (makes are part of CAR_KEYWORDS) already
+    # returned True above, so no second keyword scan is needed here.
     if word_count_clean(query) < 2:
-        # Short query is only car-related if it contains specific car terminology
-        if not any(keyword in query_lower for keyword in car_keywords):
-            # Single make names like "BMW" or "Audi" should be considered car-related
-            if not any(make.lower() == query_lower for make in VALID_MANUFACTURERS):
-                return False
+        return False
 
     # Default to assuming it might be car-related if not caught by above rules
     return True
 
 
+# Template for create_default_parameters. Key order defines the order of the JSON
+# output. List fields hold immutable placeholders and are replaced with fresh lists
+# on every copy so callers never share (and mutate) the same list object.
+_DEFAULT_PARAMETERS_TEMPLATE = {
+    "minPrice": None,
+    "maxPrice": None,
+    "minYear": None,
+    "maxYear": None,
+    "maxMileage": None,
+    "preferredMakes": (),
+    "preferredFuelTypes": (),
+    "preferredVehicleTypes": (),
+    "desiredFeatures": (),
+    "isOffTopic": False,
+    "offTopicResponse": None,
+    "clarificationNeeded": False,
+    "clarificationNeededFor": (),
+    "retrieverSuggestion": None,
+    "matchedCategory": None,
+    "intent": "new_query",
+    "transmission": None,
+    "minEngineSize": None,
+    "maxEngineSize": None,
+    "minHorsepower": None,
+    "maxHorsepower": None,
+    "explicitly_negated_makes": (),
+    "explicitly_negated_vehicle_types": (),
+    "explicitly_negated_fuel_types": (),
+}
+_DEFAULT_LIST_FIELDS = (
+    "preferredMakes",
+    "preferredFuelTypes",
+    "preferredVehicleTypes",
+    "desiredFeatures",
+    "explicitly_negated_makes",
+    "explicitly_negated_vehicle_types",
+    "explicitly_negated_fuel_types",
+)
+
+
 def create_default_parameters(
     intent: str = "new_query",
     is_off_topic: bool = False,
@@ -570,98 +1372,283 @@ def create_default_parameters(
         A dictionary containing all standard search parameters, initialized to
         None or empty lists, along with the provided metadata (intent, flags, etc.).
     """
-    return {
-        "minPrice": None,
-        "maxPrice": None,
-        "minYear": None,
-        "maxYear": None,
-        "maxMileage": None,
-        "preferredMakes": [],
-        "preferredFuelTypes": [],
-        "preferredVehicleTypes": [],
-        "desiredFeatures": [],
-        "isOffTopic": is_off_topic,
-        "offTopicResponse": off_topic_response,
-        "clarificationNeeded": clarification_needed,
-        "clarificationNeededFor": clarification_needed_for or [],
-        "retrieverSuggestion": retriever_suggestion,
-        "matchedCategory": matched_category,
-        "intent": intent,
-        "transmission": None,
-        "minEngineSize": None,
-        "maxEngineSize": None,
-        "minHorsepower": None,
-        "maxHorsepower": None,
-        "explicitly_negated_makes": [],
-        "explicitly_negated_vehicle_types": [],
-        "explicitly_negated_fuel_types": [],
-    }
+    params = _DEFAULT_PARAMETERS_TEMPLATE.copy()
+    for key in _DEFAULT_LIST_FIELDS:
+        params[key] = []
+    params["isOffTopic"] = is_off_topic
+    params["offTopicResponse"] = off_topic_response
+    params["clarificationNeeded"] = clarification_needed
+    params["clarificationNeededFor"] = list(clarification_needed_for or ())
+    params["retrieverSuggestion"] = retriever_suggestion
+    params["matchedCategory"] = matched_category
+    params["intent"] = intent
+    return params
+
+
+def merge_with_default_parameters(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fills in the default value for every standard parameter missing from `params`.
 
+    Equivalent to `create_default_parameters()` followed by `.update(params)`, but
+    only allocates fresh empty lists for the list fields `params` does not set.
 
-def build_enhanced_system_prompt(
-    user_query: str,
-    conversation_history: List[Dict[str, str]],
-    matched_category: Optional[str],
-    valid_makes: List[str],
-    valid_fuels: List[str],
-    valid_vehicles: List[str],
-    confirmed_context: Optional[Dict] = None,
-    rejected_context: Optional[Dict] = None,
-    last_question_asked: Optional[str] = None,  # ADD THIS
-) -> str:
+    Args:
+        params: Extracted parameters, typically the LLM pipeline's output.
+
+    Returns:
+        A new dictionary with every standard parameter key.
     """
-    Constructs a detailed system prompt for the LLM parameter extraction task.
+    merged = _DEFAULT_PARAMETERS_TEMPLATE.copy()
+    merged.update(params)
+    for key in _DEFAULT_LIST_FIELDS:
+        if key not in params:
+            merged[key] = []
+    if "clarificationNeededFor" not in params:
+        merged["clarificationNeededFor"] = []
+    return merged
+
+
+@dataclass(slots=True)
+class ConversationHistory:
+    """
+    Conversation history as parallel per-turn lists of user and assistant messages.
 
-    The prompt includes:
-    - Instructions for the LLM on its role and expected JSON output format.
-    - Conversation history (last few turns).
-    - Matched vehicle category from RAG (if any).
-    - Confirmed preferences from previous interactions.
-    - Rejected preferences from previous interactions.
-    - The latest user query.
-    - Core extraction rules, negation handling rules, parameter handling rules.
-    - Intent determination guidelines.
-    - Contextual interpretation rules (especially for clarification intents).
-    - Lists of valid makes, fuel types, vehicle types, and transmission types.
-    - Examples of input and expected JSON output.
+    Requests carry history as a list of dicts, either `{"user", "ai"}` pairs (as
+    sent by the backend) or `{"role", "content"}` messages. Converting once gives
+    direct indexed access (e.g. `ais[-1]`) to code that scans the history.
+    Missing messages are stored as empty strings.
+    """
+
+    users: List[str] = field(default_factory=list)
+    ais: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_turns(cls, turns: Optional[List[Dict[str, str]]]) -> "ConversationHistory":
+        """
+        Builds a `ConversationHistory` from request history turns.
+
+        Args:
+            turns: History turns in either supported format, or `None`.
+
+        Returns:
+            The history split into `users` and `ais`.
+        """
+        history = cls()
+        for turn in turns or ():
+            role = turn.get("role")
+            if role:
+                content = turn.get("content") or ""
+                history.users.append(content if role == "user" else "")
+                history.ais.append(content if role == "assistant" else "")
+            else:
+                history.users.append(turn.get("user") or "")
+                history.ais.append(turn.get("ai") or "")
+        return history
+
+
+def _build_prompt_header() -> str:
+    """
+    Builds the invariant opening of the extraction prompt.
+
+    Covers the role instructions, the list of expected keys and the example
+    JSON output, none of which depend on the request.
+
+    Returns:
+        The prompt text that precedes the conversation history.
+    """
+    # Use create_default_parameters to ensure all keys are present
+    default_params_example = create_default_parameters()
+    # Populate with example values for clarity in the prompt
+    default_params_example.update(
+        {
+            "minPrice": 15000,
+            "maxPrice": 25000,
+            "minYear": 2018,
+            "maxYear": 2022,
+            "maxMileage": 50000,
+            "preferredMakes": ["Toyota", "Honda"],
+            "preferredFuelTypes": ["Petrol"],
+            "preferredVehicleTypes": ["SUV"],
+            "desiredFeatures": ["Bluetooth", "Backup Camera"],
+            "intent": "new_query",
+            "transmission": "Automatic",
+            "minEngineSize": 2.0,
+            "maxEngineSize": 3.5,
+            "minHorsepower": 150,
+            "maxHorsepower": 300,
+        }
+    )
+    # Ensure explicitly_negated lists are included in the example structure
+    default_params_example["explicitly_negated_makes"] = []
+    default_params_example["explicitly_negated_vehicle_types"] = []
+    default_params_example["explicitly_negated_fuel_types"] = []
+    json_format_example = json.dumps(default_params_example, indent=2)
+
+    # Build the full prompt
+    # Added more specific instructions based on previous issues
+    return f"""
+You are an advanced automotive parameter extraction assistant for Smart Auto Trader.
+Analyze the LATEST user query ONLY to extract explicitly mentioned parameters.
+Use conversation history and context PRIMARILY to determine the 'intent' and understand implicit
+references (like 'it' or 'that one').
+DO NOT infer parameters from history if they are not mentioned in the LATEST query, especially for preferredMakes,
+preferredFuelTypes, and preferredVehicleTypes during refinements.
+YOUR RESPONSE MUST BE ONLY A SINGLE VALID JSON OBJECT containing the following keys:
+{list(create_default_parameters().keys())}.
+Use this exact format, filling values based ONLY on the LATEST query and context:
+{json_format_example}
+
+"""
+
+
+# Rules, valid values and examples that follow the per-request context. The
+# valid-value lists are filled in by _build_prompt_rules.
+_PROMPT_RULES_TEMPLATE = """
+## CORE EXTRACTION RULES:
+- Focus ONLY on the LATEST user query for explicit parameters.
+- Use conversation history ONLY to determine the 'intent' or resolve pronouns/references.
+- Numeric values MUST be numbers (int or float), not strings. Use null if not mentioned.
+- Array values MUST be lists of strings. Use [] if not mentioned.
+- Extract makes/fuels/types ONLY if explicitly mentioned in the LATEST query AND they appear in the Valid lists below.
+- desiredFeatures: Extract features mentioned in the LATEST query.
+- isOffTopic: Set to true ONLY if the LATEST query is clearly NOT about vehicles. If true, set offTopicResponse.
+- clarificationNeeded: Set to true ONLY if the LATEST query is vague AND lacks sufficient detail
+   -to proceed (e.g., "Find me something nice"). If true, list needed info in clarificationNeededFor
+   -(e.g., ["budget", "type"]).
+   - DO NOT set to true if the user is just refining or negating criteria.
+"When the user mentions a budget with a single number (e.g., 'under 50000', 'around 50000', '50000 budget'),
+    - interpret this number as the maxPrice ONLY. Leave minPrice as null unless a clear
+    -range (e.g., 'between 40k and 50k') is stated."
+
+## NEGATION HANDLING (CRITICAL RULES):
+- If the user explicitly rejects a make/type/fuel (e.g., "not Toyota", "no SUVs", "don't want diesel")
+    -DO NOT include it in the corresponding preferred* list. The post-processing step will
+    -handle adding it to the 'explicitly_negated_*' list.
+- For transmission, if user says "not automatic" or "no manual", set the transmission field to null.
+
+## PARAMETER HANDLING RULES:
+- transmission: Set to "Automatic" or "Manual". Null otherwise.
+- minEngineSize/maxEngineSize: Extract engine size in liters (e.g., "2.0L" -> 2.0).
+    -Handle ranges, minimums ("at least 2.0L"), maximums ("under 2.5L").
+    -Convert units like "1600cc" -> 1.6. Null if not mentioned.
+- minHorsepower/maxHorsepower: Extract horsepower as integers (e.g., "200hp" -> 200).
+    -Handle ranges, minimums, maximums. Accept "bhp", "PS". Null if not mentioned.
+
+## INTENT DETERMINATION (CRITICAL):
+- 'new_query': User starts a completely new search or provides initial criteria.
+- 'refine_criteria': User modifies
+    -existing criteria (changes price, adds/removes makes/types/fuels, adds constraints like 'no toyota').
+    -This is the MOST COMMON intent after the first query.
+- 'add_criteria': User adds criteria without contradicting previous ones (less common than refine).
+- 'clarify': User directly answers a specific question asked by the Assistant in the previous turn.
+- 'off_topic': User query is unrelated to vehicles.
+
+## CONTEXTUAL INTERPRETATION (Use ONLY for 'clarify' intent):
+- If the Assistant asked about budget, interpret numbers like "15000" as maxPrice.
+- If the Assistant asked about year, interpret numbers like "2018" as minYear.
+- If the Assistant asked about transmission, interpret replies like "automatic" accordingly.
+- Apply similar logic ONLY for direct answers to specific questions about engine size or horsepower.
+- For non-clarification queries, extract parameters ONLY as explicitly stated in the LATEST query.
+
+## VALID VALUES:
+- Valid Makes: {valid_makes}
+- Valid Fuel Types: {valid_fuels}
+- Valid Vehicle Types (includes aliases): {valid_vehicles}
+- Valid Transmission Types: ["Automatic", "Manual"]
+
+## EXAMPLES (Focus on LATEST query + history for intent):
+Latest User Query: "I want a Toyota under 20000"
+Output: {{"minPrice": null, "maxPrice": 20000, "preferredMakes": ["Toyota"], "intent": "new_query"...}}
+
+Latest User Query: "Actually, make it a Honda instead"
+Output: {{"preferredMakes": ["Honda"], "intent": "refine_criteria"...}}
+    -# Note: Other fields are null/[] as not mentioned in THIS query
+
+Latest User Query: "I hate SUVs"
+Output: {{"preferredVehicleTypes": [], "intent": "refine_criteria"...}}
+    -# Note: preferredVehicleTypes is empty, post-processing handles the negation list
+
+Latest User Query: "What's the weather like today?"
+Output: {{"isOffTopic": true, "offTopicResponse":
+    -"I specialize in helping with vehicle searches...", "intent": "off_topic"...}}
+
+Latest User Query: "Under €15000"
+History: Assistant: What's your budget?
+Output: {{"maxPrice": 15000, "intent": "clarify"...}} # Intent is clarify due to history
+
+Latest User Query: "Ok, but no toyota"
+History: Assistant: Found 5 Honda SUVs...
+Output: {{"intent": "refine_criteria", "preferredMakes": [] ...}}
+    -# Intent is refine, preferredMakes empty, post-processing handles negated list
+
+Respond ONLY with the JSON object.
+"""
+
+
+def _build_prompt_rules(
+    valid_makes: List[str], valid_fuels: List[str], valid_vehicles: List[str]
+) -> str:
+    """
+    Renders the extraction rules section with the given valid-value lists.
 
     Args:
-        user_query: The latest query from the user.
-        conversation_history: A list of previous turns in the conversation,
-                              where each turn is a dictionary with 'role' and 'content'.
-        matched_category: The vehicle category matched by the RAG system, if any.
         valid_makes: A list of valid manufacturer names.
         valid_fuels: A list of valid fuel types.
         valid_vehicles: A list of valid vehicle types (including aliases).
-        confirmed_context: A dictionary of parameters confirmed by the user in
-                           previous turns.
-        rejected_context: A dictionary of parameters explicitly rejected by the
-                          user in previous turns.
-        last_question_asked: The last question asked by the assistant, if any.
 
     Returns:
-        A string representing the complete system prompt to be sent to the LLM.
+        The prompt text that follows the latest user query.
     """
+    return _PROMPT_RULES_TEMPLATE.format(
+        valid_makes=json.dumps(valid_makes),
+        valid_fuels=json.dumps(valid_fuels),
+        valid_vehicles=json.dumps(valid_vehicles),
+    )
+
+
+# The static parts of the prompt are identical for every request, so they are
+# rendered once here instead of on each call to build_enhanced_system_prompt.
+_PROMPT_HEADER = _build_prompt_header()
+_PROMPT_RULES = _build_prompt_rules(
+    VALID_MANUFACTURERS, VALID_FUEL_TYPES, VALID_VEHICLE_TYPES
+)
+
+
+def _uses_default_valid_lists(
+    valid_makes: List[str], valid_fuels: List[str], valid_vehicles: List[str]
+) -> bool:
+    """Returns True if the prompt is built from the module's own valid lists."""
+    return (
+        valid_makes is VALID_MANUFACTURERS
+        and valid_fuels is VALID_FUEL_TYPES
+        and valid_vehicles is VALID_VEHICLE_TYPES
+    )
+
+
+def _render_system_prompt(
+    user_query: str,
+    conversation_history: List[Dict[str, str]],
+    matched_category: Optional[str],
+    valid_makes: List[str],
+    valid_fuels: List[str],
+    valid_vehicles: List[str],
+    confirmed_context: Optional[Dict],
+    rejected_context: Optional[Dict],
+) -> str:
+    """Renders the system prompt; see `build_enhanced_system_prompt`."""
     # Format conversation history as clear context
     history_context = ""
     if conversation_history:
-        history_context = "## CONVERSATION HISTORY:\n"
-        for i, turn in enumerate(conversation_history[-5:]):  # Last 5 turns max
-            # Handle different possible keys for role and content
-            role = turn.get("role")
-            content = turn.get("content")
-            if not role:
-                if "user" in turn:
-                    role = "user"
-                    content = turn.get("user")
-                elif "ai" in turn:
-                    role = "assistant"
-                    content = turn.get("ai")
-
-            if role == "user" and content:
-                history_context += f"User: {content}\n"
-            elif role == "assistant" and content:
-                history_context += f"Assistant: {content}\n"
+        history = ConversationHistory.from_turns(
+            conversation_history[-PROMPT_HISTORY_TURNS:]
+        )
+        history_parts = ["## CONVERSATION HISTORY:\n"]
+        for user_message, ai_message in zip(history.users, history.ais):
+            if user_message:
+                history_parts.append(f"User: {user_message}\n")
+            if ai_message:
+                history_parts.append(f"Assistant: {ai_message}\n")
+        history_context = "".join(history_parts)
 
     # Format matched category if available
     category_context = ""
@@ -669,19 +1656,19 @@ def build_enhanced_system_prompt(
         category_context = f"\n## MATCHED VEHICLE CATEGORY: {matched_category}\n"
 
     # Format confirmed context if available
-    confirmed_context_str = ""
+    confirmed_parts = []
     if confirmed_context and any(
         v
         for v in confirmed_context.values()
         if v is not None and (not isinstance(v, list) or len(v) > 0)
     ):
-        confirmed_context_str = (
+        confirmed_parts.append(
             "\n## CONFIRMED PREFERENCES (Do not contradict these):\n"
         )
 
         # Add confirmed makes
         if confirmed_context.get("confirmedMakes"):
-            confirmed_context_str += (
+            confirmed_parts.append(
                 f"- Preferred Makes: {', '.join(confirmed_context['confirmedMakes'])}\n"
             )
 
@@ -692,7 +1679,7 @@ def build_enhanced_system_prompt(
         if confirmed_context.get("confirmedMaxPrice") is not None:
             price_info.append(f"Max: {confirmed_context['confirmedMaxPrice']}")
         if price_info:
-            confirmed_context_str += f"- Price Range: {', '.join(price_info)}\n"
+            confirmed_parts.append(f"- Price Range: {', '.join(price_info)}\n")
 
         # Add confirmed year range
         year_info = []
@@ -701,28 +1688,28 @@ def build_enhanced_system_prompt(
         if confirmed_context.get("confirmedMaxYear") is not None:
             year_info.append(f"Max: {confirmed_context['confirmedMaxYear']}")
         if year_info:
-            confirmed_context_str += f"- Year Range: {', '.join(year_info)}\n"
+            confirmed_parts.append(f"- Year Range: {', '.join(year_info)}\n")
 
         # Add confirmed mileage
         if confirmed_context.get("confirmedMaxMileage") is not None:
-            confirmed_context_str += (
+            confirmed_parts.append(
                 f"- Max Mileage: {confirmed_context['confirmedMaxMileage']}\n"
             )
 
         # Add confirmed fuel types
         if confirmed_context.get("confirmedFuelTypes"):
-            confirmed_context_str += f"- Preferred Fuel Types: {', '.join(confirmed_context['confirmedFuelTypes'])}\n"
+            confirmed_parts.append(f"- Preferred Fuel Types: {', '.join(confirmed_context['confirmedFuelTypes'])}\n")
 
         # Add confirmed vehicle types
         if confirmed_context.get("confirmedVehicleTypes"):
-            confirmed_context_str += (
+            confirmed_parts.append(
                 f"- Preferred Vehicle Types: "
                 f"{', '.join(confirmed_context['confirmedVehicleTypes'])}\n"
             )
 
         # Add confirmed transmission
         if confirmed_context.get("confirmedTransmission"):
-            confirmed_context_str += (
+            confirmed_parts.append(
                 f"- Transmission: {confirmed_context['confirmedTransmission']}\n"
             )
 
@@ -737,7 +1724,7 @@ def build_enhanced_system_prompt(
                 f"Max: {confirmed_context['confirmedMaxEngineSize']}L"
             )
         if engine_size_info:
-            confirmed_context_str += (
+            confirmed_parts.append(
                 f"- Engine Size Range: {', '.join(engine_size_info)}\n"
             )
 
@@ -748,171 +1735,258 @@ def build_enhanced_system_prompt(
         if confirmed_context.get("confirmedMaxHorsePower") is not None:
             hp_info.append(f"Max: {confirmed_context['confirmedMaxHorsePower']}hp")
         if hp_info:
-            confirmed_context_str += f"- Horsepower Range: {', '.join(hp_info)}\n"
+            confirmed_parts.append(f"- Horsepower Range: {', '.join(hp_info)}\n")
 
     # Format rejected context if available
-    rejected_context_str = ""
+    rejected_parts = []
     if rejected_context and any(
         v
         for v in rejected_context.values()
         if v is not None and (not isinstance(v, list) or len(v) > 0)
     ):
-        rejected_context_str = (
+        rejected_parts.append(
             "\n## REJECTED PREFERENCES (User has explicitly rejected these):\n"
         )
 
         # Add rejected makes
         if rejected_context.get("rejectedMakes"):
-            rejected_context_str += (
+            rejected_parts.append(
                 f"- Rejected Makes: {', '.join(rejected_context['rejectedMakes'])}\n"
             )
 
         # Add rejected vehicle types
         if rejected_context.get("rejectedVehicleTypes"):
-            rejected_context_str += f"- Rejected Vehicle Types: {', '.join(rejected_context['rejectedVehicleTypes'])}\n"
+            rejected_parts.append(f"- Rejected Vehicle Types: {', '.join(rejected_context['rejectedVehicleTypes'])}\n")
 
         # Add rejected fuel types
         if rejected_context.get("rejectedFuelTypes"):
-            rejected_context_str += f"- Rejected Fuel Types: {', '.join(rejected_context['rejectedFuelTypes'])}\n"
+            rejected_parts.append(f"- Rejected Fuel Types: {', '.join(rejected_context['rejectedFuelTypes'])}\n")
 
         # Add rejected transmission if present
         if rejected_context.get("rejectedTransmission"):
-            rejected_context_str += (
+            rejected_parts.append(
                 f"- Rejected Transmission: {rejected_context['rejectedTransmission']}\n"
             )
 
-    # Create example format for JSON output
-    # Use create_default_parameters to ensure all keys are present
-    default_params_example = create_default_parameters()
-    # Populate with example values for clarity in the prompt
-    default_params_example.update(
-        {
-            "minPrice": 15000,
-            "maxPrice": 25000,
-            "minYear": 2018,
-            "maxYear": 2022,
-            "maxMileage": 50000,
-            "preferredMakes": ["Toyota", "Honda"],
-            "preferredFuelTypes": ["Petrol"],
-            "preferredVehicleTypes": ["SUV"],
-            "desiredFeatures": ["Bluetooth", "Backup Camera"],
-            "intent": "new_query",
-            "transmission": "Automatic",
-            "minEngineSize": 2.0,
-            "maxEngineSize": 3.5,
-            "minHorsepower": 150,
-            "maxHorsepower": 300,
-        }
+    if _uses_default_valid_lists(valid_makes, valid_fuels, valid_vehicles):
+        prompt_rules = _PROMPT_RULES
+    else:
+        prompt_rules = _build_prompt_rules(valid_makes, valid_fuels, valid_vehicles)
+
+    # Only the per-request sections are assembled here; the header and rules
+    # (with the valid lists and JSON example) are prebuilt strings
+    return "".join(
+        [
+            _PROMPT_HEADER,
+            history_context,
+            "\n",
+            category_context,
+            "\n",
+            *confirmed_parts,
+            "\n",
+            *rejected_parts,
+            '\nLatest User Query: "',
+            user_query,
+            '"\n',
+            prompt_rules,
+        ]
     )
-    # Ensure explicitly_negated lists are included in the example structure
-    default_params_example["explicitly_negated_makes"] = []
-    default_params_example["explicitly_negated_vehicle_types"] = []
-    default_params_example["explicitly_negated_fuel_types"] = []
-    json_format_example = json.dumps(default_params_example, indent=2)
-
-    # Build the full prompt
-    # Added more specific instructions based on previous issues
-    return f"""
-You are an advanced automotive parameter extraction assistant for Smart Auto Trader.
-Analyze the LATEST user query ONLY to extract explicitly mentioned parameters.
-Use conversation history and context PRIMARILY to determine the 'intent' and understand implicit
-references (like 'it' or 'that one').
-DO NOT infer parameters from history if they are not mentioned in the LATEST query, especially for preferredMakes,
-preferredFuelTypes, and preferredVehicleTypes during refinements.
-YOUR RESPONSE MUST BE ONLY A SINGLE VALID JSON OBJECT containing the following keys:
-{list(create_default_parameters().keys())}.
-Use this exact format, filling values based ONLY on the LATEST query and context:
-{json_format_example}
 
-{history_context}
-{category_context}
-{confirmed_context_str}
-{rejected_context_str}
-Latest User Query: "{user_query}"
 
-## CORE EXTRACTION RULES:
-- Focus ONLY on the LATEST user query for explicit parameters.
-- Use conversation history ONLY to determine the 'intent' or resolve pronouns/references.
-- Numeric values MUST be numbers (int or float), not strings. Use null if not mentioned.
-- Array values MUST be lists of strings. Use [] if not mentioned.
-- Extract makes/fuels/types ONLY if explicitly mentioned in the LATEST query AND they appear in the Valid lists below.
-- desiredFeatures: Extract features mentioned in the LATEST query.
-- isOffTopic: Set to true ONLY if the LATEST query is clearly NOT about vehicles. If true, set offTopicResponse.
-- clarificationNeeded: Set to true ONLY if the LATEST query is vague AND lacks sufficient detail
-   -to proceed (e.g., "Find me something nice"). If true, list needed info in clarificationNeededFor
-   -(e.g., ["budget", "type"]).
-   - DO NOT set to true if the user is just refining or negating criteria.
-"When the user mentions a budget with a single number (e.g., 'under 50000', 'around 50000', '50000 budget'),
-    - interpret this number as the maxPrice ONLY. Leave minPrice as null unless a clear
-    -range (e.g., 'between 40k and 50k') is stated."
+def build_enhanced_system_prompt(
+    user_query: str,
+    conversation_history: List[Dict[str, str]],
+    matched_category: Optional[str],
+    valid_makes: List[str],
+    valid_fuels: List[str],
+    valid_vehicles: List[str],
+    confirmed_context: Optional[Dict] = None,
+    rejected_context: Optional[Dict] = None,
+    last_question_asked: Optional[str] = None,  # ADD THIS
+) -> str:
+    """
+    Constructs a detailed system prompt for the LLM parameter extraction task.
 
-## NEGATION HANDLING (CRITICAL RULES):
-- If the user explicitly rejects a make/type/fuel (e.g., "not Toyota", "no SUVs", "don't want diesel")
-    -DO NOT include it in the corresponding preferred* list. The post-processing step will
-    -handle adding it to the 'explicitly_negated_*' list.
-- For transmission, if user says "not automatic" or "no manual", set the transmission field to null.
+    The prompt includes:
+    - Instructions for the LLM on its role and expected JSON output format.
+    - Conversation history (last few turns).
+    - Matched vehicle category from RAG (if any).
+    - Confirmed preferences from previous interactions.
+    - Rejected preferences from previous interactions.
+    - The latest user query.
+    - Core extraction rules, negation handling rules, parameter handling rules.
+    - Intent determination guidelines.
+    - Contextual interpretation rules (especially for clarification intents).
+    - Lists of valid makes, fuel types, vehicle types, and transmission types.
+    - Examples of input and expected JSON output.
 
-## PARAMETER HANDLING RULES:
-- transmission: Set to "Automatic" or "Manual". Null otherwise.
-- minEngineSize/maxEngineSize: Extract engine size in liters (e.g., "2.0L" -> 2.0).
-    -Handle ranges, minimums ("at least 2.0L"), maximums ("under 2.5L").
-    -Convert units like "1600cc" -> 1.6. Null if not mentioned.
-- minHorsepower/maxHorsepower: Extract horsepower as integers (e.g., "200hp" -> 200).
-    -Handle ranges, minimums, maximums. Accept "bhp", "PS". Null if not mentioned.
+    Prompts built from the default valid lists are memoized in an LRU cache
+    keyed by the query, recent history, category and context.
 
-## INTENT DETERMINATION (CRITICAL):
-- 'new_query': User starts a completely new search or provides initial criteria.
-- 'refine_criteria': User modifies
-    -existing criteria (changes price, adds/removes makes/types/fuels, adds constraints like 'no toyota').
-    -This is the MOST COMMON intent after the first query.
-- 'add_criteria': User adds criteria without contradicting previous ones (less common than refine).
-- 'clarify': User directly answers a specific question asked by the Assistant in the previous turn.
-- 'off_topic': User query is unrelated to vehicles.
+    Args:
+        user_query: The latest query from the user.
+        conversation_history: A list of previous turns in the conversation,
+                              where each turn is a dictionary with 'role' and 'content'.
+        matched_category: The vehicle category matched by the RAG system, if any.
+        valid_makes: A list of valid manufacturer names.
+        valid_fuels: A list of valid fuel types.
+        valid_vehicles: A list of valid vehicle types (including aliases).
+        confirmed_context: A dictionary of parameters confirmed by the user in
+                           previous turns.
+        rejected_context: A dictionary of parameters explicitly rejected by the
+                          user in previous turns.
+        last_question_asked: The last question asked by the assistant, if any.
 
-## CONTEXTUAL INTERPRETATION (Use ONLY for 'clarify' intent):
-- If the Assistant asked about budget, interpret numbers like "15000" as maxPrice.
-- If the Assistant asked about year, interpret numbers like "2018" as minYear.
-- If the Assistant asked about transmission, interpret replies like "automatic" accordingly.
-- Apply similar logic ONLY for direct answers to specific questions about engine size or horsepower.
-- For non-clarification queries, extract parameters ONLY as explicitly stated in the LATEST query.
+    Returns:
+        A string representing the complete system prompt to be sent to the LLM.
+    """
+    if not _uses_default_valid_lists(valid_makes, valid_fuels, valid_vehicles):
+        return _render_system_prompt(
+            user_query,
+            conversation_history,
+            matched_category,
+            valid_makes,
+            valid_fuels,
+            valid_vehicles,
+            confirmed_context,
+            rejected_context,
+        )
 
-## VALID VALUES:
-- Valid Makes: {json.dumps(valid_makes)}
-- Valid Fuel Types: {json.dumps(valid_fuels)}
-- Valid Vehicle Types (includes aliases): {json.dumps(valid_vehicles)}
-- Valid Transmission Types: ["Automatic", "Manual"]
+    key_material = json_dumps_sorted_bytes(
+        [
+            user_query,
+            conversation_history[-PROMPT_HISTORY_TURNS:] if conversation_history else [],
+            matched_category,
+            confirmed_context,
+            rejected_context,
+        ]
+    )
+    cache_key = hashlib.blake2b(key_material, digest_size=16).digest()
+    with _prompt_cache_lock:
+        cached = _prompt_cache.get(cache_key)
+        if cached is not None:
+            _prompt_cache.move_to_end(cache_key)
+            return cached
+
+    prompt = _render_system_prompt(
+        user_query,
+        conversation_history,
+        matched_category,
+        valid_makes,
+        valid_fuels,
+        valid_vehicles,
+        confirmed_context,
+        rejected_context,
+    )
+    with _prompt_cache_lock:
+        _prompt_cache[cache_key] = prompt
+        if len(_prompt_cache) > PROMPT_CACHE_MAXSIZE:
+            _prompt_cache.popitem(last=False)
+    return prompt
 
-## EXAMPLES (Focus on LATEST query + history for intent):
-Latest User Query: "I want a Toyota under 20000"
-Output: {{"minPrice": null, "maxPrice": 20000, "preferredMakes": ["Toyota"], "intent": "new_query"...}}
 
-Latest User Query: "Actually, make it a Honda instead"
-Output: {{"preferredMakes": ["Honda"], "intent": "refine_criteria"...}}
-    -# Note: Other fields are null/[] as not mentioned in THIS query
+def read_completion_stream(
+    response: requests.Response,
+    deadline: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> Optional[str]:
+    """
+    Reads a streamed (SSE) OpenRouter chat completion, stopping early once the
+    model has produced a complete top-level JSON object.
 
-Latest User Query: "I hate SUVs"
-Output: {{"preferredVehicleTypes": [], "intent": "refine_criteria"...}}
-    -# Note: preferredVehicleTypes is empty, post-processing handles the negation list
+    Brace depth is tracked over the generated text (ignoring braces inside JSON
+    strings). When it returns to zero and the text since the opening brace parses
+    as a JSON object, the connection is closed so no further tokens are waited for.
 
-Latest User Query: "What's the weather like today?"
-Output: {{"isOffTopic": true, "offTopicResponse":
-    -"I specialize in helping with vehicle searches...", "intent": "off_topic"...}}
+    The `requests` timeout only bounds each socket read, so a stream that keeps
+    trickling tokens could run indefinitely; `deadline` bounds the whole read.
 
-Latest User Query: "Under €15000"
-History: Assistant: What's your budget?
-Output: {{"maxPrice": 15000, "intent": "clarify"...}} # Intent is clarify due to history
+    Args:
+        response: A streaming `requests` response for a completion sent with
+                  `"stream": true`.
+        deadline: Optional `time.monotonic()` value after which the stream is
+                  abandoned and the connection closed.
+        cancel_event: Optional event; once set, the stream is abandoned and the
+                      connection closed (e.g. another hedged model already won).
 
-Latest User Query: "Ok, but no toyota"
-History: Assistant: Found 5 Honda SUVs...
-Output: {{"intent": "refine_criteria", "preferredMakes": [] ...}}
-    -# Intent is refine, preferredMakes empty, post-processing handles negated list
+    Returns:
+        The generated text received so far, or `None` if the stream reported an
+        error, produced no content, outlived the deadline or was cancelled.
+    """
+    parts: List[str] = []
+    received = 0  # Characters received, i.e. the offset of the next delta
+    depth = 0
+    object_start = -1
+    in_string = False
+    escaped_offset = -1  # Offset of the character after a backslash inside a string
+    try:
+        for line in response.iter_lines():
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning("OpenRouter stream passed its deadline, closing it.")
+                return None
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info("OpenRouter stream cancelled, closing it.")
+                return None
+            # Skip keep-alive blanks and SSE comments (": OPENROUTER PROCESSING")
+            if not line or line.startswith(b":") or not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json_loads(data)
+            if "error" in chunk:
+                logger.error("OpenRouter stream reported an error: %s", chunk["error"])
+                return None
+            choices = chunk.get("choices")
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if not delta:
+                continue
+
+            parts.append(delta)
+            # Only braces, quotes and backslashes affect the depth; the regex jumps
+            # over everything else in C instead of visiting each character
+            for match in STREAM_STRUCTURAL_CHAR_RE.finditer(delta):
+                char = match.group()
+                offset = received + match.start()
+                if in_string:
+                    if offset == escaped_offset:
+                        continue
+                    if char == "\\":
+                        escaped_offset = offset + 1
+                    elif char == '"':
+                        in_string = False
+                elif char == '"' and depth > 0:
+                    in_string = True
+                elif char == "{":
+                    if depth == 0:
+                        object_start = offset
+                    depth += 1
+                elif char == "}" and depth > 0:
+                    depth -= 1
+                    if depth == 0:
+                        text = "".join(parts)
+                        try:
+                            complete = isinstance(
+                                json_loads(text[object_start:offset + 1]), dict
+                            )
+                        except ValueError:
+                            complete = False
+                        if complete:
+                            logger.debug("Complete JSON object received, closing stream.")
+                            return text
+            received += len(delta)
+    finally:
+        response.close()
 
-Respond ONLY with the JSON object.
-"""
+    return "".join(parts) or None
 
 
 def try_extract_with_model(
-    model: str, system_prompt: str, user_query: str
+    model: str,
+    system_prompt: str,
+    user_query: str,
+    timeout: float = OPENROUTER_TIMEOUT_SECONDS,
+    cancel_event: Optional[threading.Event] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Attempts to extract parameters by calling an LLM via the OpenRouter API.
@@ -925,6 +1999,11 @@ def try_extract_with_model(
         model: The identifier of the LLM model to use (e.g., "meta-llama/llama-3.1-8b-instruct:free").
         system_prompt: The system prompt guiding the LLM's behavior.
         user_query: The user's query to extract parameters from.
+        timeout: Seconds to wait for OpenRouter before giving up, including the
+                 time spent streaming the completion. Callers pass the time left
+                 before their request deadline.
+        cancel_event: Optional event that, once set, closes the completion stream
+                      and makes the call return `None`.
 
     Returns:
         A dictionary containing the extracted parameters if the API call and
@@ -939,59 +2018,55 @@ def try_extract_with_model(
     if not OPENROUTER_API_KEY:
         logger.error("OpenRouter API Key is not configured. Cannot make API call.")
         return None
+    deadline = time.monotonic() + timeout
     try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://smartautotrader.app",
-            "X-Title": "SmartAutoTraderParameterExtraction",
-        }
         payload = {
             "model": model,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_query},
             ],
-            "temperature": 0.2,  # Slightly lower for more deterministic extraction
-            "max_tokens": 600,  # Increased slightly just in case
-            # "response_format": {"type": "json_object"},
+            "temperature": 0,  # Greedy decoding: extraction wants the single most likely JSON
+            "top_p": 1,
+            "max_tokens": LLM_MAX_OUTPUT_TOKENS,
+            "stream": True,  # Lets read_completion_stream stop once the JSON is complete
         }
+        if LLM_JSON_MODE:
+            payload["response_format"] = {"type": "json_object"}
 
-        logger.info(f"Sending request to OpenRouter (Model: {model})...")
-        response = requests.post(
+        logger.info("Sending request to OpenRouter (Model: %s)...", model)
+        # The prompt makes up most of the payload; serialize it straight to bytes
+        response = _openrouter_session.post(
             OPENROUTER_URL,
-            headers=headers,
-            json=payload,
-            timeout=45,  # Increased timeout
+            data=json_dumps_bytes(payload),
+            timeout=timeout,
+            stream=True,  # Completion is read incrementally by read_completion_stream
         )
 
         if response.status_code != 200:
+            # Read at most ERROR_BODY_LOG_LIMIT bytes of the error body for the log
+            error_body = next(response.iter_content(ERROR_BODY_LOG_LIMIT), b"")
+            response.close()
             logger.error(
-                f"OpenRouter API call failed for model {model}. Status: {response.status_code}, Body: {response.text}"
+                "OpenRouter API call failed for model %s. Status: %s, Body (truncated): %s",
+                model,
+                response.status_code,
+                error_body.decode("utf-8", errors="replace"),
             )
             return None
 
-        response_data = response.json()
-        logger.debug(
-            f"Full OpenRouter response for model {model}: {json.dumps(response_data, indent=2)}"
-        )
-
-        if not response_data.get("choices") or not response_data["choices"][0].get(
-            "message"
-        ):
-            logger.error(
-                f"Invalid response format from OpenRouter model {model}: {response_data}"
-            )
+        generated_text = read_completion_stream(response, deadline, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        if generated_text is None:
+            logger.error("No content streamed from OpenRouter model %s.", model)
             return None
 
-        generated_text = response_data["choices"][0]["message"]["content"]
-        logger.info(f"Raw output from model {model}: {generated_text}")
+        logger.debug("Raw output from model %s: %s", model, generated_text)
 
         # Attempt to parse JSON robustly
         # Look for ```json ... ``` blocks first
-        match = re.search(
-            r"```json\s*(\{.*?\})\s*```", generated_text, re.DOTALL | re.IGNORECASE
-        )
+        match = JSON_FENCE_RE.search(generated_text)
         json_str = None
         if match:
             json_str = match.group(1).strip()
@@ -1006,45 +2081,171 @@ def try_extract_with_model(
 
         if json_str:
             try:
-                extracted = json.loads(json_str)
+                extracted = json_loads(json_str)
                 # Basic check for expected structure
                 if isinstance(extracted, dict) and "intent" in extracted:
-                    logger.info(
-                        f"Successfully parsed JSON from model {model}: {extracted}"
-                    )
+                    logger.info("Successfully parsed JSON from model %s.", model)
+                    logger.debug("Parsed JSON from model %s: %s", model, extracted)
                     return extracted
                 else:
                     logger.warning(
-                        f"Parsed JSON from model {model} lacks expected structure: {extracted}"
+                        "Parsed JSON from model %s lacks expected structure: %s",
+                        model,
+                        extracted,
                     )
                     return None
             except json.JSONDecodeError as je:
                 logger.error(
-                    f"JSON decoding failed for model {model}: {je}. "
-                    f"JSON string was: '{json_str}'"
+                    "JSON decoding failed for model %s: %s. JSON string was: '%s'",
+                    model,
+                    je,
+                    json_str,
                 )
                 return None
         else:
-            logger.warning(f"No JSON object found in model {model} output.")
+            logger.warning("No JSON object found in model %s output.", model)
             return None
 
     except requests.exceptions.Timeout:
-        logger.error(f"Request timed out calling OpenRouter model {model}.")
+        logger.error("Request timed out calling OpenRouter model %s.", model)
         return None
     except (
         requests.exceptions.RequestException
     ) as req_ex:  # Use req_ex (or request_exception, or e)
-        logger.error(
-            f"Network error calling OpenRouter model {model}: {req_ex}", exc_info=True
-        )  # Update the log too
+        logger.error("Network error calling OpenRouter model %s: %s", model, req_ex)
         return None
     except Exception as e:
         logger.exception(
-            f"Unhandled exception in try_extract_with_model (Model: {model}): {e}"
+            "Unhandled exception in try_extract_with_model (Model: %s): %s", model, e
         )
         return None
 
 
+_llm_hedge_executor: Optional[ThreadPoolExecutor] = None
+_llm_hedge_executor_lock = threading.Lock()
+
+
+def extract_with_models_hedged(
+    models: tuple,
+    system_prompt: str,
+    user_query: str,
+    timeout: float = OPENROUTER_TIMEOUT_SECONDS,
+) -> Optional[Dict[str, Any]]:
+    """
+    Sends the same extraction to several models concurrently; first valid result wins.
+
+    Each model is called with `try_extract_with_model` on a shared thread pool,
+    started on first use. Once a result wins (or the timeout expires) the other
+    calls are cancelled: their streams are closed, releasing the pool thread and
+    the pooled connection instead of streaming a completion nobody reads.
+
+    Args:
+        models: The OpenRouter model identifiers to race.
+        system_prompt: The system prompt for the LLM.
+        user_query: The user's query.
+        timeout: Seconds to wait for a valid result from any model.
+
+    Returns:
+        The first parsed result that is a dict with an "intent" key, or `None`
+        if every model failed or the timeout expired.
+    """
+    global _llm_hedge_executor
+    with _llm_hedge_executor_lock:
+        if _llm_hedge_executor is None:
+            _llm_hedge_executor = ThreadPoolExecutor(
+                max_workers=OPENROUTER_POOL_SIZE, thread_name_prefix="llm-hedge"
+            )
+
+    cancel_event = threading.Event()
+    futures = {
+        _llm_hedge_executor.submit(
+            try_extract_with_model,
+            model,
+            system_prompt,
+            user_query,
+            timeout=timeout,
+            cancel_event=cancel_event,
+        ): model
+        for model in models
+    }
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            extracted = future.result()
+            if isinstance(extracted, dict) and "intent" in extracted:
+                logger.info("Hedged extraction won by model %s.", futures[future])
+                return extracted
+    except FutureTimeoutError:
+        logger.warning("Hedged extraction timed out after %.1fs.", timeout)
+    finally:
+        cancel_event.set()  # Closes the losers' streams
+        for future in futures:
+            future.cancel()  # Calls that have not started yet never run
+    return None
+
+
+# Extractions currently waiting on OpenRouter, keyed by a hash of (model, system
+# prompt, user query). Concurrent identical requests share the one upstream call.
+_inflight_extractions: Dict[bytes, Future] = {}
+_inflight_extractions_lock = threading.Lock()
+
+
+def run_extraction_coalesced(
+    extract,
+    model,
+    system_prompt: str,
+    user_query: str,
+    timeout: float = OPENROUTER_TIMEOUT_SECONDS,
+) -> Optional[Dict[str, Any]]:
+    """
+    Runs `extract`, sharing the call with any identical extraction already in flight.
+
+    The first caller for a (model, system prompt, user query) combination makes
+    the call; callers arriving while it runs wait for its result instead of
+    sending a duplicate request (e.g. client retries or several open tabs).
+
+    Args:
+        extract: The extraction function to call, with the signature of
+                 `try_extract_with_model`.
+        model: The model identifier (or tuple of models) passed to `extract`.
+        system_prompt: The system prompt for the LLM.
+        user_query: The user's query.
+        timeout: Seconds the call, or the wait for a shared call, may take.
+
+    Returns:
+        The result of `extract`. Waiting callers get their own deep copy, or
+        `None` if the shared call does not finish within `timeout`.
+    """
+    key = hashlib.blake2b(
+        json_dumps_sorted_bytes([model, system_prompt, user_query]), digest_size=16
+    ).digest()
+    with _inflight_extractions_lock:
+        future = _inflight_extractions.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight_extractions[key] = future
+
+    if not is_leader:
+        logger.info("Identical extraction already in flight for %s, waiting for it.", model)
+        try:
+            return copy.deepcopy(future.result(timeout=timeout))
+        except FutureTimeoutError:
+            logger.warning("Timed out waiting for the in-flight extraction.")
+            return None
+
+    try:
+        extracted = extract(model, system_prompt, user_query, timeout=timeout)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(extracted)
+        return extracted
+    finally:
+        with _inflight_extractions_lock:
+            _inflight_extractions.pop(key, None)
+
+
 def is_valid_extraction(params: Dict[str, Any]) -> bool:
     """
     Validates if the extracted parameters dictionary is plausible for a vehicle search.
@@ -1074,86 +2275,230 @@ def is_valid_extraction(params: Dict[str, Any]) -> bool:
     if params.get("clarificationNeeded") is True:
         return True
 
-    if params.get("intent") == "refine_criteria":
-        has_negations = (
-            len(params.get("explicitly_negated_makes", [])) > 0
-            or len(params.get("explicitly_negated_vehicle_types", [])) > 0
-            or len(params.get("explicitly_negated_fuel_types", [])) > 0
-        )
-        if has_negations:
-            # Allow refinement if only negations were extracted
-            # Check if *other* criteria were also set. If only negations, it's valid.
-            has_other_criteria = (
-                params.get("minPrice") is not None
-                or params.get("maxPrice") is not None
-                or params.get("minYear") is not None
-                or params.get("maxYear") is not None
-                or params.get("maxMileage") is not None
-                or len(params.get("preferredMakes", [])) > 0
-                or len(params.get("preferredFuelTypes", [])) > 0
-                or len(params.get("preferredVehicleTypes", [])) > 0
-                or len(params.get("desiredFeatures", [])) > 0
-                or params.get("transmission") is not None
-                or params.get("minEngineSize") is not None
-                or params.get("maxEngineSize") is not None
-                or params.get("minHorsepower") is not None
-                or params.get("maxHorsepower") is not None
-            )
-            if not has_other_criteria:
-                logger.info(
-                    "Validation: Allowing refine_criteria intent with only negations."
-                )
-                return True
-            # If it has negations AND other criteria, fall through to normal checks below
-
-    # Check for at least one non-null parameter or non-empty list
-    has_price = params.get("minPrice") is not None or params.get("maxPrice") is not None
-    has_year = params.get("minYear") is not None or params.get("maxYear") is not None
-    has_mileage = params.get("maxMileage") is not None
-    has_makes = len(params.get("preferredMakes", [])) > 0
-    has_fuel = len(params.get("preferredFuelTypes", [])) > 0
-    has_type = len(params.get("preferredVehicleTypes", [])) > 0
-    has_features = len(params.get("desiredFeatures", [])) > 0
-    has_transmission = params.get("transmission") is not None
-    has_engine = (
-        params.get("minEngineSize") is not None
-        or params.get("maxEngineSize") is not None
-    )
-    has_hp = (
-        params.get("minHorsepower") is not None
-        or params.get("maxHorsepower") is not None
-    )
+    # At least one scalar criterion set or one non-empty list (stops at the first hit)
+    has_criteria = any(
+        params.get(key) is not None for key in SEARCH_SCALAR_CRITERIA
+    ) or any(params.get(key) for key in SEARCH_LIST_CRITERIA)
 
-    # Consider it valid if at least one criterion is set
-    is_sufficient = (
-        has_price
-        or has_year
-        or has_mileage
-        or has_makes
-        or has_fuel
-        or has_type
-        or has_features
-        or has_transmission
-        or has_engine
-        or has_hp
-    )
+    if (
+        not has_criteria
+        and params.get("intent") == "refine_criteria"
+        and any(params.get(key) for key in NEGATED_LIST_KEYS)
+    ):
+        # Allow refinement if only negations were extracted
+        logger.info("Validation: Allowing refine_criteria intent with only negations.")
+        return True
 
-    if is_sufficient:
+    if has_criteria:
         return True
-    else:
-        # Log only if it wasn't already allowed as a refine_criteria with only negations
-        # Check the negation lists again to be safe before logging the warning
-        was_negation_only = params.get("intent") == "refine_criteria" and (
-            len(params.get("explicitly_negated_makes", [])) > 0
-            or len(params.get("explicitly_negated_vehicle_types", [])) > 0
-            or len(params.get("explicitly_negated_fuel_types", [])) > 0
-        )
-        if not was_negation_only:
-            logger.warning(
-                f"Extracted parameters deemed invalid (no criteria set and no clarification needed): "
-                f"{params}"
-            )
-        return False
+
+    logger.warning(
+        "Extracted parameters deemed invalid (no criteria set and no clarification needed): %s",
+        params,
+    )
+    return False
+
+
+_VALID_INTENTS = frozenset(
+    {
+        "new_query",
+        "clarify",
+        "refine_criteria",
+        "add_criteria",
+        "replace_criteria",
+        "error",
+        "off_topic",
+        # Added 'negative_constraint' as potentially valid from LLM
+        "negative_constraint",
+    }
+)
+
+
+@dataclass(slots=True)
+class ExtractedParams:
+    """
+    Typed, validated view of the parameters extracted by the LLM.
+
+    Field names and order mirror `create_default_parameters()`, so `to_dict()`
+    produces the same JSON structure the rest of the service works with.
+    """
+
+    minPrice: Optional[float] = None
+    maxPrice: Optional[float] = None
+    minYear: Optional[int] = None
+    maxYear: Optional[int] = None
+    maxMileage: Optional[int] = None
+    preferredMakes: List[str] = field(default_factory=list)
+    preferredFuelTypes: List[str] = field(default_factory=list)
+    preferredVehicleTypes: List[str] = field(default_factory=list)
+    desiredFeatures: List[str] = field(default_factory=list)
+    isOffTopic: bool = False
+    offTopicResponse: Optional[str] = None
+    clarificationNeeded: bool = False
+    clarificationNeededFor: List[str] = field(default_factory=list)
+    retrieverSuggestion: Optional[str] = None
+    matchedCategory: Optional[str] = None
+    intent: str = "new_query"
+    transmission: Optional[str] = None
+    minEngineSize: Optional[float] = None
+    maxEngineSize: Optional[float] = None
+    minHorsepower: Optional[int] = None
+    maxHorsepower: Optional[int] = None
+    explicitly_negated_makes: List[str] = field(default_factory=list)
+    explicitly_negated_vehicle_types: List[str] = field(default_factory=list)
+    explicitly_negated_fuel_types: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_llm_output(cls, params: Dict[str, Any]) -> "ExtractedParams":
+        """
+        Builds an `ExtractedParams` from raw LLM output, coercing and validating each field.
+
+        Invalid values are logged and left at their defaults.
+
+        Args:
+            params: The dictionary of parameters as extracted by the LLM.
+
+        Returns:
+            The validated parameters.
+        """
+        result = cls()
+
+        # Handle numeric fields with proper type validation
+        for name in ("minPrice", "maxPrice"):
+            val = params.get(name)
+            # Check for None explicitly before type check
+            if val is not None and isinstance(val, (int, float)):
+                if val > 0:
+                    setattr(result, name, float(val))
+                else:
+                    logger.warning("Invalid %s value: %s (must be positive)", name, val)
+
+        latest_model_year = datetime.datetime.now().year + 1
+        for name in ("minYear", "maxYear", "maxMileage"):
+            val = params.get(name)
+            if val is not None and isinstance(val, (int, float)):
+                if name == "minYear" and 1900 <= val <= latest_model_year:
+                    result.minYear = int(val)
+                elif name == "maxYear" and 1900 <= val <= latest_model_year:
+                    result.maxYear = int(val)
+                elif name == "maxMileage" and val >= 0:  # Allow 0 mileage
+                    result.maxMileage = int(val)
+                else:
+                    logger.warning(
+                        "Invalid %s value: %s (out of reasonable range)",
+                        name,
+                        val,
+                    )
+
+        # Handle array fields with validation against known valid values (case-insensitive)
+        # using the module-level canonical-casing maps (one lowercase and lookup per item)
+        for name, canonical_map in CANONICAL_LIST_PARAMS:
+            values = params.get(name)
+            if isinstance(values, list):
+                canonical_get = canonical_map.get
+                setattr(
+                    result,
+                    name,
+                    [
+                        canonical  # Use the original casing from the valid list
+                        for v in values
+                        if type(v) is str
+                        and (canonical := canonical_get(v.lower())) is not None  # Case-insensitive validation
+                    ],
+                )
+
+        features = params.get("desiredFeatures")
+        if isinstance(features, list):
+            result.desiredFeatures = [
+                f
+                for f in features
+                if type(f) is str and f.strip()  # Basic validation + remove empty/whitespace-only
+            ]
+
+        # Handle boolean flags
+        if isinstance(params.get("isOffTopic"), bool):
+            result.isOffTopic = params["isOffTopic"]
+
+        if isinstance(params.get("clarificationNeeded"), bool):
+            result.clarificationNeeded = params["clarificationNeeded"]
+
+        # Handle string fields
+        if isinstance(params.get("offTopicResponse"), str):
+            result.offTopicResponse = params["offTopicResponse"]
+
+        if isinstance(params.get("retrieverSuggestion"), str):
+            result.retrieverSuggestion = params["retrieverSuggestion"]
+
+        if isinstance(params.get("matchedCategory"), str):
+            result.matchedCategory = params["matchedCategory"]
+
+        # Process intent with validation (defaults to 'new_query' if missing)
+        if isinstance(params.get("intent"), str):
+            intent = params["intent"].lower().strip()
+            if intent in _VALID_INTENTS:
+                result.intent = intent
+            else:
+                logger.warning("Unknown intent '%s', defaulting to 'new_query'", intent)
+
+        # Process clarificationNeededFor as array of strings
+        if isinstance(params.get("clarificationNeededFor"), list):
+            result.clarificationNeededFor = [
+                item
+                for item in params["clarificationNeededFor"]
+                if isinstance(item, str)
+            ]
+
+        # Handle transmission (null transmission from the LLM stays None)
+        if isinstance(params.get("transmission"), str):
+            transmission_value = params["transmission"].strip().lower()
+            if transmission_value in ("automatic", "manual"):
+                result.transmission = transmission_value.capitalize()
+            else:
+                logger.warning("Invalid transmission value: %s", params["transmission"])
+
+        # Handle engine size (as float)
+        for name in ("minEngineSize", "maxEngineSize"):
+            val = params.get(name)
+            if val is not None and isinstance(val, (int, float)):
+                if val >= 0.5 and val <= 10.0:
+                    setattr(result, name, float(val))
+                else:
+                    logger.warning(
+                        "Invalid %s value: %s (outside reasonable range)",
+                        name,
+                        val,
+                    )
+
+        # Handle horsepower (as int)
+        for name in ("minHorsepower", "maxHorsepower"):
+            val = params.get(name)
+            if val is not None and isinstance(val, (int, float)):
+                if val >= 20 and val <= 1500:
+                    setattr(result, name, int(val))
+                else:
+                    logger.warning(
+                        "Invalid %s value: %s (outside reasonable range)",
+                        name,
+                        val,
+                    )
+
+        for name in (
+            "explicitly_negated_makes",
+            "explicitly_negated_vehicle_types",
+            "explicitly_negated_fuel_types",
+        ):
+            if isinstance(params.get(name), list):
+                # Ensure items are strings
+                setattr(result, name, [item for item in params[name] if isinstance(item, str)])
+
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the parameters as a plain dictionary for JSON responses and post-processing."""
+        return {name: getattr(self, name) for name in _EXTRACTED_PARAMS_FIELDS}
+
+
+_EXTRACTED_PARAMS_FIELDS = tuple(f.name for f in fields(ExtractedParams))
 
 
 def process_parameters(
@@ -1162,7 +2507,8 @@ def process_parameters(
     """
     Cleans, validates, and standardizes the structure of parameters extracted by the LLM.
 
-    This function takes the raw dictionary output from the LLM and performs several operations:
+    This function takes the raw dictionary output from the LLM and performs several operations
+    (see `ExtractedParams.from_llm_output`):
     - Ensures all expected fields are present by starting with a default structure.
     - Validates and converts numeric fields (price, year, mileage, engine size, horsepower)
       to their correct types (float or int) and checks if they are within reasonable ranges.
@@ -1185,196 +2531,142 @@ def process_parameters(
         error occurs during processing, a default parameter structure with 'intent'
         set to "error" is returned.
     """
-    # Start with default structure to ensure all fields exist
-    result = create_default_parameters()
-
     try:
-        # Handle numeric fields with proper type validation
-        for field in ["minPrice", "maxPrice"]:
-            val = params.get(field)
-            # Check for None explicitly before type check
-            if val is not None and isinstance(val, (int, float)):
-                if val > 0:
-                    result[field] = float(val)
-                else:
-                    logger.warning(f"Invalid {field} value: {val} (must be positive)")
+        return ExtractedParams.from_llm_output(params).to_dict()
+    except Exception as e:
+        logger.exception("Error during parameter processing: %s", e)
+        # Return default structure on error
+        return create_default_parameters(intent="error")  # Set intent to error
 
-        for field in ["minYear", "maxYear", "maxMileage"]:
-            val = params.get(field)
-            if val is not None and isinstance(val, (int, float)):
-                current_year = datetime.datetime.now().year
-                if field == "minYear" and val >= 1900 and val <= current_year + 1:
-                    result[field] = int(val)
-                elif field == "maxYear" and val >= 1900 and val <= current_year + 1:
-                    result[field] = int(val)
-                elif field == "maxMileage" and val >= 0:  # Allow 0 mileage
-                    result[field] = int(val)
-                else:
-                    logger.warning(
-                        f"Invalid {field} value: {val} (out of reasonable range)"
-                    )
 
-        # Convert valid lists to lowercase sets for case-insensitive matching
-        valid_makes_lower = {make.lower() for make in VALID_MANUFACTURERS}
-        valid_fuel_types_lower = {fuel.lower() for fuel in VALID_FUEL_TYPES}
-        valid_vehicle_types_lower = {
-            vehicle_type.lower() for vehicle_type in VALID_VEHICLE_TYPES
-        }
+def _is_word_char(char: str) -> bool:
+    """Returns True if `char` counts as a word character for regex `\\b`."""
+    return char.isalnum() or char == "_"
 
-        # Create lookup maps for preserving original casing
-        valid_makes_map = {make.lower(): make for make in VALID_MANUFACTURERS}
-        valid_fuel_types_map = {fuel.lower(): fuel for fuel in VALID_FUEL_TYPES}
-        valid_vehicle_types_map = {
-            vehicle_type.lower(): vehicle_type for vehicle_type in VALID_VEHICLE_TYPES
-        }
 
-        # Handle array fields with validation against known valid values (case-insensitive)
-        if isinstance(params.get("preferredMakes"), list):
-            result["preferredMakes"] = [
-                valid_makes_map[
-                    m.lower()
-                ]  # Use the original casing from the valid list
-                for m in params["preferredMakes"]
-                if isinstance(m, str)
-                and m.lower() in valid_makes_lower  # Case-insensitive validation
-            ]
+@functools.lru_cache(maxsize=16)
+def _valid_items_automaton(valid_items: tuple):
+    """
+    Builds an Aho-Corasick automaton over the lowercased `valid_items`.
 
-        if isinstance(params.get("preferredFuelTypes"), list):
-            result["preferredFuelTypes"] = [
-                valid_fuel_types_map[
-                    f.lower()
-                ]  # Use the original casing from the valid list
-                for f in params.get("preferredFuelTypes", [])
-                if isinstance(f, str)
-                and f.lower() in valid_fuel_types_lower  # Case-insensitive validation
-            ]
+    Each word maps to `(length, item)`, where `item` keeps its original casing.
+    Built once per distinct list of valid items.
+    """
+    automaton = ahocorasick.Automaton()
+    for item in valid_items:
+        item_lower = item.lower()
+        automaton.add_word(item_lower, (len(item_lower), item))
+    automaton.make_automaton()
+    return automaton
 
-        if isinstance(params.get("preferredVehicleTypes"), list):
-            result["preferredVehicleTypes"] = [
-                valid_vehicle_types_map[
-                    v.lower()
-                ]  # Use the original casing from the valid list
-                for v in params["preferredVehicleTypes"]
-                if isinstance(v, str)
-                and v.lower()
-                in valid_vehicle_types_lower  # Case-insensitive validation
-            ]
 
-        if isinstance(params.get("desiredFeatures"), list):
-            result["desiredFeatures"] = [
-                f
-                for f in params["desiredFeatures"]
-                if isinstance(f, str)
-                and f.strip()  # Basic validation + remove empty/whitespace-only
-            ]
+@functools.lru_cache(maxsize=16)
+def _whole_word_patterns(valid_items: tuple):
+    """
+    Compiles a whole-word pattern for each distinct lowercased item in `valid_items`.
 
-        # Handle boolean flags
-        if isinstance(params.get("isOffTopic"), bool):
-            result["isOffTopic"] = params["isOffTopic"]
+    Returns `(pattern, item)` pairs, where `item` keeps its original casing. The
+    lookahead reports overlapping occurrences. Used when pyahocorasick is missing.
+    """
+    lower_map = {item.lower(): item for item in valid_items}
+    return tuple(
+        (re.compile(r"(?=\b(" + re.escape(item_lower) + r")\b)"), item)
+        for item_lower, item in lower_map.items()
+    )
 
-        if isinstance(params.get("clarificationNeeded"), bool):
-            result["clarificationNeeded"] = params["clarificationNeeded"]
 
-        # Handle string fields
-        if "offTopicResponse" in params and isinstance(params["offTopicResponse"], str):
-            result["offTopicResponse"] = params["offTopicResponse"]
+def _iter_whole_word_matches(text_lower: str, valid_items: List[str]):
+    """
+    Yields `(start, end, item)` for every whole-word occurrence of a valid item.
+
+    With pyahocorasick the text is scanned once for all items and the word
+    boundaries are checked on the match offsets; otherwise each item is searched
+    with a `\\b`-delimited regex.
+    """
+    if ahocorasick is None or not valid_items:
+        for pattern, item in _whole_word_patterns(tuple(valid_items)):
+            for match in pattern.finditer(text_lower):
+                yield match.start(1), match.end(1), item
+        return
+
+    text_len = len(text_lower)
+    for end, (length, item) in _valid_items_automaton(tuple(valid_items)).iter(text_lower):
+        start = end - length + 1
+        # A regex \b holds where a word character meets a non-word character
+        before = start > 0 and _is_word_char(text_lower[start - 1])
+        after = end + 1 < text_len and _is_word_char(text_lower[end + 1])
+        if before != _is_word_char(text_lower[start]) and after != _is_word_char(text_lower[end]):
+            yield start, end + 1, item
+
+
+def find_whole_word_items(text_lower: str, valid_items: List[str]) -> Set[str]:
+    """
+    Finds the items of `valid_items` that occur in `text_lower` as whole words.
+
+    Equivalent to testing `re.search(r"\\b" + re.escape(item) + r"\\b", text_lower)`
+    for every item, but with pyahocorasick the text is scanned once for all items.
+
+    Args:
+        text_lower: The lowercased text to search.
+        valid_items: Canonical items to look for (matched case-insensitively).
+
+    Returns:
+        The matching items, in their original casing.
+    """
+    return {item for _, _, item in _iter_whole_word_matches(text_lower, valid_items)}
 
-        if "retrieverSuggestion" in params and isinstance(
-            params["retrieverSuggestion"], str
-        ):
-            result["retrieverSuggestion"] = params["retrieverSuggestion"]
-
-        if "matchedCategory" in params and isinstance(params["matchedCategory"], str):
-            result["matchedCategory"] = params["matchedCategory"]
-
-        # Process intent with validation
-        if "intent" in params and isinstance(params["intent"], str):
-            # Added 'negative_constraint' as potentially valid from LLM
-            valid_intents = [
-                "new_query",
-                "clarify",
-                "refine_criteria",
-                "add_criteria",
-                "replace_criteria",
-                "error",
-                "off_topic",
-                "negative_constraint",
-            ]
-            intent = params["intent"].lower().strip()
-            if intent in valid_intents:
-                result["intent"] = intent
-            else:
-                logger.warning(f"Unknown intent '{intent}', defaulting to 'new_query'")
-                result["intent"] = "new_query"
-        else:
-            result["intent"] = "new_query"  # Default if missing
 
-        # Process clarificationNeededFor as array of strings
-        if isinstance(params.get("clarificationNeededFor"), list):
-            result["clarificationNeededFor"] = [
-                item
-                for item in params["clarificationNeededFor"]
-                if isinstance(item, str)
-            ]
+def find_mentioned_scalar_categories(text_lower: str) -> Set[str]:
+    """
+    Returns the scalar parameter categories whose keywords appear in `text_lower`.
 
-        # Handle transmission
-        if "transmission" in params and isinstance(params["transmission"], str):
-            transmission_value = params["transmission"].strip().lower()
-            if transmission_value in ["automatic", "manual"]:
-                result["transmission"] = transmission_value.capitalize()
-            # Allow null transmission from LLM
-            elif params["transmission"] is None:
-                result["transmission"] = None
-            else:
-                logger.warning(f"Invalid transmission value: {params['transmission']}")
+    A category is mentioned if any of its keywords in SCALAR_KEYWORD_SETS is a
+    substring of the text. With pyahocorasick the text is scanned once for all
+    categories; otherwise once per category with SCALAR_KEYWORD_RES.
 
-        # Handle engine size (as float)
-        for field in ["minEngineSize", "maxEngineSize"]:
-            val = params.get(field)
-            if val is not None and isinstance(val, (int, float)):
-                if val >= 0.5 and val <= 10.0:
-                    result[field] = float(val)
-                else:
-                    logger.warning(
-                        f"Invalid {field} value: {val} (outside reasonable range)"
-                    )
+    Args:
+        text_lower: The lowercased query fragment.
 
-        # Handle horsepower (as int)
-        for field in ["minHorsepower", "maxHorsepower"]:
-            val = params.get(field)
-            if val is not None and isinstance(val, (int, float)):
-                if val >= 20 and val <= 1500:
-                    result[field] = int(val)
-                else:
-                    logger.warning(
-                        f"Invalid {field} value: {val} (outside reasonable range)"
-                    )
+    Returns:
+        A set of category names (keys of SCALAR_KEYWORD_SETS).
+    """
+    if SCALAR_KEYWORD_AUTOMATON is None:
+        return {
+            category
+            for category, keyword_re in SCALAR_KEYWORD_RES.items()
+            if keyword_re.search(text_lower)
+        }
+    mentioned: Set[str] = set()
+    for _, categories in SCALAR_KEYWORD_AUTOMATON.iter(text_lower):
+        mentioned |= categories
+    return mentioned
 
-        for key in [
-            "explicitly_negated_makes",
-            "explicitly_negated_vehicle_types",
-            "explicitly_negated_fuel_types",
-        ]:
-            if key in params and isinstance(params[key], list):
-                # Ensure items are strings
-                result[key] = [item for item in params[key] if isinstance(item, str)]
 
-    except Exception as e:
-        logger.exception(f"Error during parameter processing: {e}")
-        # Return default structure on error
-        return create_default_parameters(intent="error")  # Set intent to error
+def _iter_negation_triggers(text_lower: str):
+    """
+    Yields `(phrase_start, trigger)` for every negation trigger in `text_lower`.
 
-    return result
+    Uses the Aho-Corasick automaton when pyahocorasick is installed, otherwise the
+    lookahead regex. Both report overlapping triggers in a single pass.
+    """
+    if NEGATION_TRIGGER_AUTOMATON is not None:
+        for end, trigger in NEGATION_TRIGGER_AUTOMATON.iter(text_lower):
+            yield end + 1, trigger
+    else:
+        for trigger_match in NEGATION_TRIGGER_RE.finditer(text_lower):
+            trigger = trigger_match.group(1)
+            yield trigger_match.start() + len(trigger), trigger
 
 
 def find_negated_terms(text: str, valid_items: List[str]) -> Set[str]:
     """
     Identifies items from a valid list that are explicitly negated in the given text.
 
-    This function iterates through a list of `negation_triggers` (e.g., "no ", "not ",
-    "don't want ") and checks if any of the `valid_items` follow these triggers
-    in the text. It handles simple conjunctions (like "or", "and", ",") within
-    the negated phrase.
+    This function scans for every `negation_triggers` entry (e.g., "no ", "not ",
+    "don't want ") in one pass and checks if any of the `valid_items` follow these triggers
+    in the text, up to the end of the negated phrase. Simple conjunctions (like "or",
+    "and", ",") within the phrase do not end it. Use `find_terms` when the positive
+    mentions are needed too.
 
     Args:
         text: The input text string (e.g., user query) to search for negations.
@@ -1393,44 +2685,72 @@ def find_negated_terms(text: str, valid_items: List[str]) -> Set[str]:
         >>> find_negated_terms("Anything but an SUV.", ["SUV", "Sedan"])
         {'SUV'}
     """
+    return find_terms(text.lower(), valid_items)[1]
+
+
+def _negation_zones(text_lower: str) -> List[Tuple[int, int]]:
+    """
+    Returns the `(start, end)` spans of the phrases that follow negation triggers.
+
+    Each phrase runs from the end of a trigger to the next PHRASE_BOUNDARY_RE
+    match. Overlapping or nested phrases are merged, so the spans are disjoint
+    and in text order.
+    """
+    zones: List[Tuple[int, int]] = []
+    phrase_end = -1
+    for phrase_start, _ in _iter_negation_triggers(text_lower):
+        # Triggers arrive in text order, so a boundary found for an earlier
+        # phrase still ends this one unless the phrase starts past it
+        if phrase_start > phrase_end:
+            end_match = PHRASE_BOUNDARY_RE.search(text_lower, phrase_start)
+            phrase_end = end_match.start() if end_match else len(text_lower)
+        if zones and phrase_start <= zones[-1][1]:
+            zones[-1] = (zones[-1][0], phrase_end)
+        else:
+            zones.append((phrase_start, phrase_end))
+    return zones
+
+
+def find_terms(text_lower: str, valid_items: List[str]) -> Tuple[Set[str], Set[str]]:
+    """
+    Splits the valid items mentioned in the text into positive and negated ones.
+
+    The negation zones are computed once, then every whole-word match of a
+    valid item is placed by binary-searching its offset into those zones. An
+    item is negated if any of its mentions lies inside a negated phrase; it is
+    positive if it is mentioned and not negated. The result is the same as
+    calling `find_negated_terms` and then `find_positive_terms`.
+
+    Args:
+        text_lower: The input text (e.g., user query), already lowercased. Callers
+                    lowercase the query once and share it across categories.
+        valid_items: Canonical items to look for (e.g., VALID_MANUFACTURERS).
+
+    Returns:
+        A `(positive, negated)` tuple of sets, with the original casing from
+        `valid_items`.
+
+    Example:
+        >>> find_terms("i like honda, but not toyota or diesel.",
+        ...            ["Toyota", "Honda", "Diesel", "Petrol"])
+        ({'Honda'}, {'Toyota', 'Diesel'})
+    """
+    zones = _negation_zones(text_lower)
+    zone_starts = [start for start, _ in zones]
+
+    mentioned = set()
     negated = set()
-    text_lower = text.lower()
-    valid_items_lower_map = {item.lower(): item for item in valid_items}
-
-    for pattern in negation_triggers:
-        start_index = 0
-        while start_index < len(text_lower):
-            idx = text_lower.find(pattern, start_index)
-            if idx == -1:
-                break
-            phrase_start = idx + len(pattern)
-            end_match = re.search(
-                r"[.!?,\n]| but | also | and | with | like | prefer ",
-                text_lower[phrase_start:],
-            )
-            phrase_end = (
-                phrase_start + end_match.start() if end_match else len(text_lower)
-            )
-            phrase = text_lower[phrase_start:phrase_end].strip()
-            potential_items_parts = [phrase]
-            for conj in conjunctions:
-                new_parts = []
-                for part in potential_items_parts:
-                    new_parts.extend(part.split(conj))
-                potential_items_parts = new_parts
-            for potential_item in potential_items_parts:
-                potential_item = potential_item.strip().lower()
-                if not potential_item:
-                    continue
-                for item_lower, item_original in valid_items_lower_map.items():
-                    if re.search(r"\b" + re.escape(item_lower) + r"\b", potential_item):
-                        logger.debug(
-                            f"Negation Match: Found '{item_original}' after '{pattern}' "
-                            f"in phrase segment '{potential_item}'"
-                        )
-                        negated.add(item_original)  # Use canonical casing
-            start_index = phrase_start
-    return negated
+    for start, end, item in _iter_whole_word_matches(text_lower, valid_items):
+        mentioned.add(item)
+        zone_index = bisect.bisect_right(zone_starts, start) - 1
+        if zone_index >= 0 and end <= zones[zone_index][1]:
+            logger.debug("Negation Match: Found '%s' in a negated phrase", item)
+            negated.add(item)
+
+    positive = mentioned - negated
+    if positive:
+        logger.debug("Positive Matches (not identified as negated): %s", positive)
+    return positive, negated
 
 
 def find_positive_terms(
@@ -1462,17 +2782,14 @@ def find_positive_terms(
         {'Honda', 'Petrol'}
     """
     positive = set()
-    text_lower = text.lower()
-    valid_items_lower_map = {item.lower(): item for item in valid_items}
-    negated_terms_lower = {term.lower() for term in negated_terms}
-    for item_lower, item_original in valid_items_lower_map.items():
-        if item_lower in negated_terms_lower:
+    negated_terms_lower = frozenset(term.lower() for term in negated_terms)
+    for item_original in find_whole_word_items(text.lower(), valid_items):
+        if item_original.lower() in negated_terms_lower:
             continue
-        if re.search(r"\b" + re.escape(item_lower) + r"\b", text_lower):
-            logger.debug(
-                f"Positive Match: Found '{item_original}' (and not identified as negated)"
-            )
-            positive.add(item_original)  # Use canonical casing
+        logger.debug(
+            "Positive Match: Found '%s' (and not identified as negated)", item_original
+        )
+        positive.add(item_original)  # Use canonical casing
     return positive
 
 
@@ -1524,15 +2841,22 @@ def merge_list_param_corrected(
     """
     if is_simple_negation and negated_set and not positive_set:
         logger.info(
-            f"Simple negation for {param_name}: clearing list due to explicit negation and no positives."
+            "Simple negation for %s: clearing list due to explicit negation and no positives.",
+            param_name,
         )
         return []
 
     context_list = confirmed_context.get(context_key, []) if confirmed_context else []
-    merged = set(llm_list) | set(context_list)
-    merged -= set(negated_set)
+    merged = set(llm_list)
+    merged.update(context_list)
+    merged.difference_update(negated_set)
     logger.debug(
-        f"Merged {param_name}: {merged} (llm={llm_list}, context={context_list}, negated={negated_set})"
+        "Merged %s: %s (llm=%s, context=%s, negated=%s)",
+        param_name,
+        merged,
+        llm_list,
+        context_list,
+        negated_set,
     )
     return list(merged)
 
@@ -1559,7 +2883,9 @@ def try_extract_param_from_rag(category_name: str, user_query: str) -> tuple:
         Returns `(None, None)` if no parameter can be confidently extracted.
     """
     logger.info(
-        f"Attempting parameter extraction from RAG category: '{category_name}' and query: '{user_query}'"
+        "Attempting parameter extraction from RAG category: '%s' and query: '%s'",
+        category_name,
+        user_query,
     )
 
     # Convert to lowercase for easier matching
@@ -1572,7 +2898,7 @@ def try_extract_param_from_rag(category_name: str, user_query: str) -> tuple:
         for term in ["budget", "price", "cost", "cheap", "affordable", "expensive"]
     ):
         # Look for numeric values with optional currency symbols
-        price_match = re.search(r"(\d[\d,]*(?:\.\d+)?)\s*(?:k|€|£|\$)?", query_lower)
+        price_match = QUERY_PRICE_RE.search(query_lower)
         if price_match:
             try:
                 # Remove commas and convert to float
@@ -1583,7 +2909,7 @@ def try_extract_param_from_rag(category_name: str, user_query: str) -> tuple:
                     price_value *= 1000
 
                 # For budget queries, typically this is a maximum price
-                logger.info(f"Extracted price parameter: maxPrice={price_value}")
+                logger.info("Extracted price parameter: maxPrice=%s", price_value)
                 return "maxPrice", price_value
             except ValueError:
                 logger.warning("Failed to convert extracted price value to float")
@@ -1591,11 +2917,11 @@ def try_extract_param_from_rag(category_name: str, user_query: str) -> tuple:
     # Extract mileage
     elif any(term in category_lower for term in ["mileage", "km", "miles", "odometer"]):
         # Look for numeric values with optional unit indicators
-        mileage_match = re.search(r"(\d[\d,]*)\s*(?:km|miles|mi)?", query_lower)
+        mileage_match = QUERY_MILEAGE_RE.search(query_lower)
         if mileage_match:
             try:
                 mileage_value = int(mileage_match.group(1).replace(",", ""))
-                logger.info(f"Extracted mileage parameter: maxMileage={mileage_value}")
+                logger.info("Extracted mileage parameter: maxMileage=%s", mileage_value)
                 return "maxMileage", mileage_value
             except ValueError:
                 logger.warning("Failed to convert extracted mileage value to int")
@@ -1603,7 +2929,7 @@ def try_extract_param_from_rag(category_name: str, user_query: str) -> tuple:
     # Extract year
     elif any(term in category_lower for term in ["year", "new", "older", "newer"]):
         # Look for 4-digit years or 2-digit years with apostrophe
-        year_match = re.search(r"(20\d{2}|19\d{2}|'\d{2}|\d{2})", query_lower)
+        year_match = QUERY_YEAR_RE.search(query_lower)
         if year_match:
             try:
                 year_str = year_match.group(1)
@@ -1621,10 +2947,10 @@ def try_extract_param_from_rag(category_name: str, user_query: str) -> tuple:
                     term in query_lower
                     for term in ["after", "newer", "min", "from", "since"]
                 ):
-                    logger.info(f"Extracted year parameter: minYear={year_value}")
+                    logger.info("Extracted year parameter: minYear=%s", year_value)
                     return "minYear", year_value
                 else:
-                    logger.info(f"Extracted year parameter: maxYear={year_value}")
+                    logger.info("Extracted year parameter: maxYear=%s", year_value)
                     return "maxYear", year_value
             except ValueError:
                 logger.warning("Failed to convert extracted year value to int")
@@ -1658,16 +2984,15 @@ def try_extract_param_from_rag_category(category_name: str) -> tuple:
         Returns `(None, None)` if no parameter can be confidently extracted from
         the category name.
     """
-    logger.info(f"Attempting parameter extraction from RAG category: '{category_name}'")
+    logger.info(
+        "Attempting parameter extraction from RAG category: '%s'", category_name
+    )
 
     category_lower = category_name.lower()
 
     # Extract price range
     # Look for patterns like "under €25000", "budget 25k", "affordable (under 15000)"
-    price_match = re.search(
-        r"(?:budget|price|cost|under|up to|€|£|\$)\s*(\d[\d,]*(?:\.\d+)?)\s*(?:k|€|£|\$)?",
-        category_lower,
-    )
+    price_match = CATEGORY_PRICE_RE.search(category_lower)
     if price_match:
         try:
             price_value = float(price_match.group(1).replace(",", ""))
@@ -1676,30 +3001,25 @@ def try_extract_param_from_rag_category(category_name: str) -> tuple:
             if "k" in category_lower and price_value < 1000:
                 price_value *= 1000
 
-            logger.info(f"Extracted from category: maxPrice={price_value}")
+            logger.info("Extracted from category: maxPrice=%s", price_value)
             return "maxPrice", price_value
         except ValueError:
             logger.warning("Failed to convert category price value to float")
 
     # Extract mileage
     # Look for patterns like "low mileage (under 50000 km)", "under 100000 miles"
-    mileage_match = re.search(
-        r"(?:mileage|miles|km|odometer).*?(\d[\d,]*)\s*(?:km|miles|mi)?", category_lower
-    )
+    mileage_match = CATEGORY_MILEAGE_RE.search(category_lower)
     if mileage_match:
         try:
             mileage_value = int(mileage_match.group(1).replace(",", ""))
-            logger.info(f"Extracted from category: maxMileage={mileage_value}")
+            logger.info("Extracted from category: maxMileage=%s", mileage_value)
             return "maxMileage", mileage_value
         except ValueError:
             logger.warning("Failed to convert category mileage value to int")
 
     # Extract year
     # Look for patterns like "newer than 2018", "after 2020", "2015 or newer"
-    year_match = re.search(
-        r"(?:year|from|since|after|before|newer than|older than)\s*((?:20|19)\d{2})",
-        category_lower,
-    )
+    year_match = CATEGORY_YEAR_RE.search(category_lower)
     if year_match:
         try:
             year_value = int(year_match.group(1))
@@ -1709,21 +3029,21 @@ def try_extract_param_from_rag_category(category_name: str) -> tuple:
                 term in category_lower
                 for term in ["after", "newer", "from", "since", "min"]
             ):
-                logger.info(f"Extracted from category: minYear={year_value}")
+                logger.info("Extracted from category: minYear=%s", year_value)
                 return "minYear", year_value
             else:
-                logger.info(f"Extracted from category: maxYear={year_value}")
+                logger.info("Extracted from category: maxYear=%s", year_value)
                 return "maxYear", year_value
         except ValueError:
             logger.warning("Failed to convert category year value to int")
 
     # Standalone year (e.g., "2018 Toyota Camry")
-    standalone_year = re.search(r"\b(20\d{2}|19\d{2})\b", category_lower)
+    standalone_year = STANDALONE_YEAR_RE.search(category_lower)
     if standalone_year:
         try:
             year_value = int(standalone_year.group(1))
             # Default to minYear for standalone years in categories
-            logger.info(f"Extracted from category: minYear={year_value} (standalone)")
+            logger.info("Extracted from category: minYear=%s (standalone)", year_value)
             return "minYear", year_value
         except ValueError:
             pass
@@ -1740,28 +3060,28 @@ def try_extract_param_from_rag_category(category_name: str) -> tuple:
     ]:
         if vehicle_type in category_lower:
             # Find formal name in VALID_VEHICLE_TYPES
-            for valid_type in VALID_VEHICLE_TYPES:
-                if vehicle_type == valid_type.lower():
-                    logger.info(
-                        f"Extracted from category: preferredVehicleTypes=[{valid_type}]"
-                    )
-                    return "preferredVehicleTypes", [valid_type]
+            valid_type = CANONICAL_VEHICLE_TYPE.get(vehicle_type)
+            if valid_type is not None:
+                logger.info(
+                    "Extracted from category: preferredVehicleTypes=[%s]", valid_type
+                )
+                return "preferredVehicleTypes", [valid_type]
 
     # Check for fuel type
     for fuel_type in ["petrol", "diesel", "electric", "hybrid"]:
         if fuel_type in category_lower:
             # Find formal name in VALID_FUEL_TYPES
-            for valid_fuel in VALID_FUEL_TYPES:
-                if fuel_type == valid_fuel.lower():
-                    logger.info(
-                        f"Extracted from category: preferredFuelTypes=[{valid_fuel}]"
-                    )
-                    return "preferredFuelTypes", [valid_fuel]
+            valid_fuel = CANONICAL_FUEL_TYPE.get(fuel_type)
+            if valid_fuel is not None:
+                logger.info(
+                    "Extracted from category: preferredFuelTypes=[%s]", valid_fuel
+                )
+                return "preferredFuelTypes", [valid_fuel]
 
     # Check for manufacturers
-    for make in VALID_MANUFACTURERS:
-        if make.lower() in category_lower:
-            logger.info(f"Extracted from category: preferredMakes=[{make}]")
+    for make_lower, make in CANONICAL_MAKE.items():
+        if make_lower in category_lower:
+            logger.info("Extracted from category: preferredMakes=[%s]", make)
             return "preferredMakes", [make]
 
     logger.info("No parameters extracted from RAG category")
@@ -1788,15 +3108,8 @@ def try_direct_extract_from_query(user_query: str) -> Dict[str, Any]:
     query_lower = user_query.lower()
 
     # Extract price/budget
-    price_patterns = [
-        # Match formats like "€25000", "25k", "under 25000", "budget 25000"
-        r"(?:budget|price|cost|under|up to|max|maximum|\€|\$|\£)\s*(\d[\d,]*(?:\.\d+)?)\s*(?:k|€|£|\$)?",
-        # Match standalone numbers with currency indicators
-        r"(\d[\d,]*(?:\.\d+)?)\s*(?:k|grand|euros|euro|pounds|dollars)",
-    ]
-
-    for pattern in price_patterns:
-        price_match = re.search(pattern, query_lower)
+    for pattern in DIRECT_PRICE_RES:
+        price_match = pattern.search(query_lower)
         if price_match:
             try:
                 # Remove commas and convert to float
@@ -1809,34 +3122,26 @@ def try_direct_extract_from_query(user_query: str) -> Dict[str, Any]:
                     price_value *= 1000
 
                 results["maxPrice"] = price_value
-                logger.info(f"Direct extraction: Found maxPrice={price_value}")
+                logger.info("Direct extraction: Found maxPrice=%s", price_value)
                 break
             except ValueError:
                 logger.warning("Failed to convert extracted price value to float")
 
     # Extract mileage
-    mileage_patterns = [
-        # Match formats like "50000 km", "under 50000 miles", "max mileage 50000"
-        r"(?:mileage|miles|km|odometer|driven|under|max|maximum)\s*(\d[\d,]*)\s*(?:km|miles|mi)?",
-    ]
-
-    for pattern in mileage_patterns:
-        mileage_match = re.search(pattern, query_lower)
+    for pattern in DIRECT_MILEAGE_RES:
+        mileage_match = pattern.search(query_lower)
         if mileage_match:
             try:
                 mileage_value = int(mileage_match.group(1).replace(",", ""))
                 results["maxMileage"] = mileage_value
-                logger.info(f"Direct extraction: Found maxMileage={mileage_value}")
+                logger.info("Direct extraction: Found maxMileage=%s", mileage_value)
                 break
             except ValueError:
                 logger.warning("Failed to convert extracted mileage value to int")
 
     # Extract year
     # Look for years that come after qualifiers indicating min or max
-    year_after_pattern = r"(?:after|since|from|newer than|min|minimum|at least)\s*((?:20|19)\d{2}|[\']\d{2})"
-    year_before_pattern = r"(?:before|until|older than|max|maximum|up to|no older than)\s*((?:20|19)\d{2}|[\']\d{2})"
-
-    year_after_match = re.search(year_after_pattern, query_lower)
+    year_after_match = DIRECT_YEAR_AFTER_RE.search(query_lower)
     if year_after_match:
         try:
             year_str = year_after_match.group(1)
@@ -1847,11 +3152,11 @@ def try_direct_extract_from_query(user_query: str) -> Dict[str, Any]:
                 year_value = int(year_str)
 
             results["minYear"] = year_value
-            logger.info(f"Direct extraction: Found minYear={year_value}")
+            logger.info("Direct extraction: Found minYear=%s", year_value)
         except ValueError:
             logger.warning("Failed to convert extracted minYear value to int")
 
-    year_before_match = re.search(year_before_pattern, query_lower)
+    year_before_match = DIRECT_YEAR_BEFORE_RE.search(query_lower)
     if year_before_match:
         try:
             year_str = year_before_match.group(1)
@@ -1862,20 +3167,21 @@ def try_direct_extract_from_query(user_query: str) -> Dict[str, Any]:
                 year_value = int(year_str)
 
             results["maxYear"] = year_value
-            logger.info(f"Direct extraction: Found maxYear={year_value}")
+            logger.info("Direct extraction: Found maxYear=%s", year_value)
         except ValueError:
             logger.warning("Failed to convert extracted maxYear value to int")
 
     # If no year with qualifiers found, check for standalone 4-digit year
     if "minYear" not in results and "maxYear" not in results:
-        standalone_year = re.search(r"\b(20\d{2})\b", query_lower)
+        standalone_year = STANDALONE_2000S_YEAR_RE.search(query_lower)
         if standalone_year:
             try:
                 year_value = int(standalone_year.group(1))
                 # Default to minYear for standalone years
                 results["minYear"] = year_value
                 logger.info(
-                    f"Direct extraction: Found standalone year, assuming minYear={year_value}"
+                    "Direct extraction: Found standalone year, assuming minYear=%s",
+                    year_value,
                 )
             except ValueError:
                 pass
@@ -1925,17 +3231,44 @@ _INDIFFERENCE_KEYWORDS_MAP = {
 }
 
 
+def apply_clarify_overrides(
+    params: Dict[str, Any], reason: str, prevent_loop: bool = True
+) -> None:
+    """
+    Marks LLM-extracted parameters as an answer in an ongoing clarification.
+
+    Sets the intent to 'clarify' and, with `prevent_loop`, clears a clarification
+    request so the user is not asked the same question again.
+
+    Args:
+        params: The extracted parameters, updated in place.
+        reason: Why the overrides apply, for the log messages.
+        prevent_loop: Whether to force `clarificationNeeded` to False.
+    """
+    if prevent_loop and params.get("clarificationNeeded"):
+        logger.info(
+            "LOOP PREVENTION: Overriding LLM's clarificationNeeded=True because this is a %s",
+            reason,
+        )
+        params["clarificationNeeded"] = False
+        params["clarificationNeededFor"] = []
+
+    if params.get("intent") != "clarify":
+        logger.info("Overriding LLM intent to 'clarify' based on %s", reason)
+        params["intent"] = "clarify"
+
+
 def _detect_indifference_and_update_clarification_list(
-    query_fragment: str, clarification_needed_for: List[str]
+    query_lower: str, clarification_needed_for: List[str]
 ) -> List[str]:
     """
-    Detects user indifference from query_fragment and removes corresponding items from clarification_needed_for.
+    Detects user indifference from query_lower (the lowercased query fragment) and
+    removes corresponding items from clarification_needed_for.
     Returns the updated clarification_needed_for list.
     """
-    if not query_fragment or not clarification_needed_for:
+    if not query_lower or not clarification_needed_for:
         return clarification_needed_for
 
-    query_lower = query_fragment.lower()
     indifferent_params_detected = set()
 
     for param_key_in_map, keywords in _INDIFFERENCE_KEYWORDS_MAP.items():
@@ -1943,8 +3276,10 @@ def _detect_indifference_and_update_clarification_list(
             if keyword in query_lower:
                 indifferent_params_detected.add(param_key_in_map)
                 logger.info(
-                    f"Detected indifference for '{param_key_in_map}' due to keyword: "
-                    f"'{keyword}' in query: '{query_fragment}'"
+                    "Detected indifference for '%s' due to keyword: '%s' in query: '%s'",
+                    param_key_in_map,
+                    keyword,
+                    query_lower,
                 )
                 break
 
@@ -1973,8 +3308,9 @@ def _detect_indifference_and_update_clarification_list(
             updated_needed_for.append(item_needed)
         else:
             logger.info(
-                f"Removed '{item_needed}' from clarificationNeededFor due to indifference detected for: "
-                f"{indifferent_params_detected}"
+                "Removed '%s' from clarificationNeededFor due to indifference detected for: %s",
+                item_needed,
+                indifferent_params_detected,
             )
 
     if len(updated_needed_for) < len(clarification_needed_for):
@@ -1986,6 +3322,66 @@ def _detect_indifference_and_update_clarification_list(
     return updated_needed_for
 
 
+def make_extraction_cache_key(
+    user_query: str,
+    conversation_history: List[Dict[str, str]],
+    matched_category: Optional[str],
+    models: List[str],
+    confirmed_context: Optional[Dict],
+    rejected_context: Optional[Dict],
+    last_question_asked: Optional[str],
+) -> str:
+    """
+    Builds the extraction cache key for a `run_llm_with_history` call.
+
+    The query is normalized (stripped, lowercased) and only the tail of the
+    conversation history is included, since older turns do not reach the prompt.
+    The models that will be tried are part of the key, since different models
+    can extract different parameters.
+
+    Returns:
+        A hex digest identifying the inputs.
+    """
+    key_material = json_dumps_sorted_bytes(
+        [
+            user_query.strip().lower(),
+            conversation_history[-EXTRACTION_CACHE_HISTORY_TURNS:]
+            if conversation_history
+            else [],
+            matched_category,
+            models,
+            confirmed_context or {},
+            rejected_context or {},
+            last_question_asked,
+        ]
+    )
+    return hashlib.blake2b(key_material, digest_size=16).hexdigest()
+
+
+def extraction_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    """Returns a deep copy of the cached extraction for `key`, or `None` on a miss or expiry."""
+    with _extraction_cache_lock:
+        entry = _extraction_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, cached = entry
+        if time.monotonic() >= expires_at:
+            del _extraction_cache[key]
+            return None
+        _extraction_cache.move_to_end(key)
+        return copy.deepcopy(cached)
+
+
+def extraction_cache_put(key: str, params: Dict[str, Any]) -> None:
+    """Stores a deep copy of `params`, evicting the least recently used entry when full."""
+    expires_at = time.monotonic() + EXTRACTION_CACHE_TTL_SECONDS
+    with _extraction_cache_lock:
+        _extraction_cache[key] = (expires_at, copy.deepcopy(params))
+        _extraction_cache.move_to_end(key)
+        if len(_extraction_cache) > EXTRACTION_CACHE_MAXSIZE:
+            _extraction_cache.popitem(last=False)
+
+
 def run_llm_with_history(
     user_query: str,
     conversation_history: List[Dict[str, str]],
@@ -1995,6 +3391,8 @@ def run_llm_with_history(
     rejected_context: Optional[Dict] = None,
     contains_override: bool = False,
     last_question_asked: Optional[str] = None,
+    bypass_cache: bool = False,
+    skip_fast: bool = False,
 ) -> Optional[Dict[str, Any]]:
     """
     Orchestrates parameter extraction using an LLM, incorporating conversation history and context.
@@ -2033,19 +3431,18 @@ def run_llm_with_history(
         contains_override: A boolean flag indicating if the query contains override
                            keywords that might force an LLM path.
         last_question_asked: The last question asked by the assistant, if any.
+        bypass_cache: If True, skip the extraction cache lookup and always call the LLM.
+                      Successful results are still stored.
+        skip_fast: If True, go straight to CLARIFY_MODEL instead of FAST_MODEL. Used for
+                   answers to the assistant's clarification question, which the fast
+                   model often fails on.
 
     Returns:
         A dictionary containing the final extracted and processed parameters,
         or `None` if a critical error occurred before a fallback could be generated
         (though it aims to always return a dictionary, even if it's a confused state).
     """
-    # Define confused fallback prompt
-    CONFUSED_FALLBACK_PROMPT = (
-        "Sorry, I seem to have gotten a bit confused. Could you please restate your "
-        "main vehicle requirements simply? (e.g., 'SUV under 50k, hybrid or petrol, 2020 or newer')"
-    )
-
-    FAST_MODEL = "meta-llama/llama-3.1-8b-instruct:free"
+    FAST_MODEL = EXTRACTION_FAST_MODEL
     # REFINE_MODEL = "google/gemma-3-27b-it:free"
     # CLARIFY_MODEL = "mistralai/mistral-7b-instruct:free"
     # if force_model == "fast": models_to_try = [FAST_MODEL, REFINE_MODEL, CLARIFY_MODEL]
@@ -2053,7 +3450,31 @@ def run_llm_with_history(
     # elif force_model == "clarify": models_to_try = [CLARIFY_MODEL, REFINE_MODEL, FAST_MODEL]
     # else: models_to_try = [FAST_MODEL, REFINE_MODEL, CLARIFY_MODEL]
     # logger.info(f"Will try models in sequence: {models_to_try}")
-    models_to_try = [FAST_MODEL]
+    models_to_try = [CLARIFY_MODEL] if skip_fast else [FAST_MODEL]
+    if LLM_HEDGING_ENABLED and not skip_fast:
+        # A single attempt that races every hedged model
+        models_to_try = [LLM_HEDGED_MODELS]
+
+    cache_key = make_extraction_cache_key(
+        user_query,
+        conversation_history,
+        matched_category,
+        models_to_try,
+        confirmed_context,
+        rejected_context,
+        last_question_asked,
+    )
+    if not bypass_cache:
+        cached = extraction_cache_get(cache_key)
+        if cached is not None:
+            logger.info("Extraction cache hit, skipping LLM call.")
+            return cached
+
+    # Define confused fallback prompt
+    CONFUSED_FALLBACK_PROMPT = (
+        "Sorry, I seem to have gotten a bit confused. Could you please restate your "
+        "main vehicle requirements simply? (e.g., 'SUV under 50k, hybrid or petrol, 2020 or newer')"
+    )
 
     try:
         system_prompt = build_enhanced_system_prompt(
@@ -2068,21 +3489,44 @@ def run_llm_with_history(
             last_question_asked,  # PASS IT THROUGH
         )
     except Exception as e:
-        logger.exception(f"Error building system prompt: {e}")
+        logger.exception("Error building system prompt: %s", e)
         return create_default_parameters(intent="error")
 
     # --- Try Models ---
     extracted_params_from_llm_loop = (
         None  # Renamed to avoid confusion with final `extracted_params`
     )
+    # All model attempts share one deadline so a slow first attempt cannot be
+    # followed by another full-length call. Each call is given the time left,
+    # which also bounds how long its completion may keep streaming.
+    deadline = time.monotonic() + LLM_REQUEST_DEADLINE_SECONDS
     for model in models_to_try:
-        logger.info(f"Attempting extraction with model: {model}")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(
+                "LLM request deadline reached, skipping remaining models from %s.",
+                model,
+            )
+            break
+        logger.info("Attempting extraction with model: %s", model)
         extracted = None
+        if isinstance(model, tuple):
+            extract = extract_with_models_hedged
+        else:
+            extract = try_extract_with_model
         try:
-            extracted = try_extract_with_model(model, system_prompt, user_query)
+            extracted = run_extraction_coalesced(
+                extract,
+                model,
+                system_prompt,
+                user_query,
+                timeout=min(OPENROUTER_TIMEOUT_SECONDS, remaining),
+            )
         except Exception as e:
             logger.exception(
-                f"Error calling try_extract_with_model for model {model}: {e}"
+                "Error calling try_extract_with_model for model %s: %s",
+                model,
+                e,
             )
             continue
 
@@ -2126,7 +3570,9 @@ def run_llm_with_history(
 
             if validation_failed:
                 logger.warning(
-                    f"LLM output failed validation: {failure_reason}. LLM output: {processed}"
+                    "LLM output failed validation: %s. LLM output: %s",
+                    failure_reason,
+                    processed,
                 )
                 fallback_params = create_default_parameters(
                     intent="CONFUSED_FALLBACK",
@@ -2136,30 +3582,27 @@ def run_llm_with_history(
                 )
                 return fallback_params
 
-            # Extract query fragment for analysis
+            # An off-topic reply is answered with offTopicResponse alone (the backend
+            # ignores the search parameters), so skip the term scans and merging
+            if processed.get("isOffTopic") is True and processed.get("offTopicResponse"):
+                logger.info("Off-topic response from %s, skipping post-processing.", model)
+                extracted_params_from_llm_loop = processed
+                break
+
+            # Extract query fragment for analysis, lowercased once for all scans below
             query_fragment = extract_newest_user_fragment(user_query)
+            qf_lc = query_fragment.lower()
 
             # --- 1. Determine Context ---
-            # First, find negated terms in the query
-            negated_makes_set = find_negated_terms(
-                query_fragment.lower(), VALID_MANUFACTURERS
-            )
-            negated_types_set = find_negated_terms(
-                query_fragment.lower(), VALID_VEHICLE_TYPES
+            # Split each category's mentions into negated and positive in one scan
+            positive_makes_set, negated_makes_set = find_terms(
+                qf_lc, VALID_MANUFACTURERS
             )
-            negated_fuels_set = find_negated_terms(
-                query_fragment.lower(), VALID_FUEL_TYPES
+            positive_types_set, negated_types_set = find_terms(
+                qf_lc, VALID_VEHICLE_TYPES
             )
-
-            # Then find positive mentions, excluding negated terms
-            positive_makes_set = find_positive_terms(
-                query_fragment.lower(), VALID_MANUFACTURERS, negated_makes_set
-            )
-            positive_types_set = find_positive_terms(
-                query_fragment.lower(), VALID_VEHICLE_TYPES, negated_types_set
-            )
-            positive_fuels_set = find_positive_terms(
-                query_fragment.lower(), VALID_FUEL_TYPES, negated_fuels_set
+            positive_fuels_set, negated_fuels_set = find_terms(
+                qf_lc, VALID_FUEL_TYPES
             )
 
             # Determine basic query attributes
@@ -2176,13 +3619,21 @@ def run_llm_with_history(
 
             # Log query analysis
             logger.info(
-                f"Query analysis: intent={final_intent}, simple_negation={is_simple_negation_query}"
+                "Query analysis: intent=%s, simple_negation=%s",
+                final_intent,
+                is_simple_negation_query,
             )
             logger.info(
-                f"Positive mentions: makes={positive_makes_set}, types={positive_types_set}, fuels={positive_fuels_set}"
+                "Positive mentions: makes=%s, types=%s, fuels=%s",
+                positive_makes_set,
+                positive_types_set,
+                positive_fuels_set,
             )
             logger.info(
-                f"Negated terms: makes={negated_makes_set}, types={negated_types_set}, fuels={negated_fuels_set}"
+                "Negated terms: makes=%s, types=%s, fuels=%s",
+                negated_makes_set,
+                negated_types_set,
+                negated_fuels_set,
             )
 
             # Override intent for simple negation queries if needed
@@ -2195,201 +3646,33 @@ def run_llm_with_history(
                     "refine_criteria"  # Update in processed for consistency
                 )
 
-            # --- 1a. Define keyword sets for scalar parameter types ---
-            # Keywords related to price parameters
-            PRICE_KEYWORDS = {
-                "price",
-                "budget",
-                "cost",
-                "euro",
-                "dollar",
-                "pound",
-                "spend",
-                "pay",
-                "afford",
-                "€",
-                "$",
-                "£",
-                "under",
-                "over",
-                "between",
-                "range",
-                "cheap",
-                "expensive",
-                "pricey",
-                "costly",
-                "money",
-                "funds",
-                "finances",
-                "affordable",
-                "grand",
-                "k",
-            }
-
-            # Keywords related to year parameters
-            YEAR_KEYWORDS = {
-                "year",
-                "older",
-                "newer",
-                "age",
-                "recent",
-                "vintage",
-                "yr",
-                "model year",
-                "registration",
-                "reg",
-                "plate",
-                "built",
-                "manufactured",
-                "make",
-                "made",
-                "new",
-                "old",
-                "20",
-                "19",
-                "'",
-                "from",
-                "since",
-                "before",  # Year indicators like '20xx, '19xx
-            }
-
-            # Keywords related to mileage parameters
-            MILEAGE_KEYWORDS = {
-                "mileage",
-                "miles",
-                "mile",
-                "km",
-                "kilometers",
-                "kilometre",
-                "odometer",
-                "clock",
-                "driven",
-                "used",
-                "low",
-                "high",
-                "distance",
-                "travelled",
-                "run",
-                "usage",
-                "wear",
-            }
-
-            # Keywords related to transmission parameters
-            TRANSMISSION_KEYWORDS = {
-                "transmission",
-                "automatic",
-                "manual",
-                "gear",
-                "gearbox",
-                "auto",
-                "stick",
-                "cvt",
-                "dsg",
-                "paddle",
-                "shift",
-                "clutch",
-                "self-shifting",
-                "tiptronic",
-                "sequential",
-            }
-
-            # Keywords related to engine size parameters
-            ENGINE_KEYWORDS = {
-                "engine",
-                "size",
-                "liter",
-                "litre",
-                "l engine",
-                "cc",
-                "cubic",
-                "displacement",
-                "capacity",
-                "motor",
-                "cylinder",
-                "cylinders",
-                "block",
-                "tdi",
-                "tsi",
-                "tfsi",
-                "turbo",
-                "small",
-                "big",
-                "large",
-                "displacement",
-            }
-
-            # Keywords related to horsepower parameters
-            HP_KEYWORDS = {
-                "horsepower",
-                "hp",
-                "bhp",
-                "power",
-                "ps",
-                "kw",
-                "performance",
-                "fast",
-                "strong",
-                "quick",
-                "powerful",
-                "output",
-                "torque",
-                "acceleration",
-                "pulling power",
-                "grunt",
-            }
-
-            # Create parameter-to-keywords mapping
-            KEYWORD_SETS = {
-                "minPrice": PRICE_KEYWORDS,
-                "maxPrice": PRICE_KEYWORDS,
-                "minYear": YEAR_KEYWORDS,
-                "maxYear": YEAR_KEYWORDS,
-                "maxMileage": MILEAGE_KEYWORDS,
-                "transmission": TRANSMISSION_KEYWORDS,
-                "minEngineSize": ENGINE_KEYWORDS,
-                "maxEngineSize": ENGINE_KEYWORDS,
-                "minHorsepower": HP_KEYWORDS,
-                "maxHorsepower": HP_KEYWORDS,
-            }
+            # --- 1a. Find which scalar parameter types the query mentions ---
+            mentioned_categories = find_mentioned_scalar_categories(qf_lc)
 
             # --- 2. Initialize Final Parameters ---
             final_params = create_default_parameters()
             final_params["intent"] = final_intent
 
             # --- 3. Refactored Scalar Parameter Merging Logic ---
-            # Define scalar parameters and their corresponding context keys
-            scalar_params = {
-                "minPrice": "confirmedMinPrice",
-                "maxPrice": "confirmedMaxPrice",
-                "minYear": "confirmedMinYear",
-                "maxYear": "confirmedMaxYear",
-                "maxMileage": "confirmedMaxMileage",
-                "transmission": "confirmedTransmission",
-                "minEngineSize": "confirmedMinEngineSize",
-                "maxEngineSize": "confirmedMaxEngineSize",
-                "minHorsepower": "confirmedMinHorsePower",  # Note the capital P in HorsePower
-                "maxHorsepower": "confirmedMaxHorsePower",  # Note the capital P in HorsePower
-            }
+            processed_get = processed.get
+            context_get = confirmed_context.get if confirmed_context else None
 
             # Process each scalar parameter with improved context-awareness
-            for param, context_key in scalar_params.items():
-                llm_value = processed.get(param)
-                context_value = (
-                    confirmed_context.get(context_key) if confirmed_context else None
-                )
-                relevant_keywords = KEYWORD_SETS.get(param, set())
+            for param, context_key, category in SCALAR_PARAM_TABLE:
+                llm_value = processed_get(param)
+                context_value = context_get(context_key) if context_get else None
 
                 # Check if the current query mentions this parameter type
-                query_mentions_param = any(
-                    kw in query_fragment.lower() for kw in relevant_keywords
-                )
+                query_mentions_param = category in mentioned_categories
 
                 # Apply new logic based on query content and LLM extraction
                 if llm_value is not None and query_mentions_param:
                     # LLM extracted a value AND query mentions this parameter type - use LLM value
                     final_params[param] = llm_value
                     logger.debug(
-                        f"Using explicit {param}={llm_value} from query (keywords present)"
+                        "Using explicit %s=%s from query (keywords present)",
+                        param,
+                        llm_value,
                     )
                 elif (
                     final_intent in ["refine_criteria", "clarify", "add_criteria"]
@@ -2399,65 +3682,27 @@ def run_llm_with_history(
                     final_params[param] = context_value
                     if query_mentions_param:
                         logger.debug(
-                            f"Query mentions {param} keywords but LLM provided no value, "
-                            f"keeping context {param}={context_value}"
+                            "Query mentions %s keywords but LLM provided no value, keeping context %s=%s",
+                            param,
+                            param,
+                            context_value,
                         )
                     else:
                         logger.debug(
-                            f"Carrying over {param}={context_value} from context (no mention in query)"
+                            "Carrying over %s=%s from context (no mention in query)",
+                            param,
+                            context_value,
                         )
                 else:
                     # Default: leave as None for new queries or when no context exists
                     if llm_value is not None and not query_mentions_param:
                         logger.info(
-                            f"Ignoring potential LLM hallucination: {param}={llm_value} (no keywords in query)"
+                            "Ignoring potential LLM hallucination: %s=%s (no keywords in query)",
+                            param,
+                            llm_value,
                         )
 
             # --- 4. Merge List Parameters ---
-            # Helper function to handle list merging logic consistently
-            # (currently unused, merge_list_param_corrected is used)
-            def merge_list_param(
-                param_name,
-                context_key,
-                positive_set,
-                negated_set,
-                is_simple_negation=False,
-            ):
-                # Start with confirmed values from context if intent suggests we should keep context
-                if (
-                    final_intent in ["refine_criteria", "clarify", "add_criteria"]
-                    and confirmed_context
-                ):
-                    result_set = set(confirmed_context.get(context_key, []))
-
-                    # For simple negation, we clear everything if there are negations for this param
-                    if is_simple_negation and negated_set:
-                        result_set = set()
-                        logger.info(f"Simple negation: Clearing all {param_name}")
-                    else:
-                        # Otherwise add positives and remove negatives
-                        if positive_set:
-                            result_set = result_set.union(positive_set)
-                            logger.debug(
-                                f"Added positives to {param_name}: {positive_set}"
-                            )
-
-                        # Always remove negated terms
-                        if negated_set:
-                            result_set = result_set.difference(negated_set)
-                            logger.debug(
-                                f"Removed negatives from {param_name}: {negated_set}"
-                            )
-                else:
-                    # For new queries or other intents, just use what was explicitly mentioned
-                    result_set = set(positive_set)
-                    logger.debug(
-                        f"Using only explicit mentions for {param_name}: {result_set}"
-                    )
-
-                # Convert back to list
-                return list(result_set)
-
             # For "new_query" intent, list parameters (Makes, VehicleTypes, FuelTypes, DesiredFeatures)
             # should be based ONLY on positive mentions or direct LLM extraction from the current query,
             # effectively replacing any previous context for these lists.
@@ -2473,14 +3718,16 @@ def run_llm_with_history(
                 # For new_query, desiredFeatures come only from the current LLM processing
                 final_params["desiredFeatures"] = processed.get("desiredFeatures", [])
                 logger.info(
-                    f"New query: preferredMakes={final_params['preferredMakes']}, "
-                    f"preferredVehicleTypes={final_params['preferredVehicleTypes']}, "
-                    f"preferredFuelTypes={final_params['preferredFuelTypes']}, "
-                    f"desiredFeatures={final_params['desiredFeatures']}"
+                    "New query: preferredMakes=%s, preferredVehicleTypes=%s, preferredFuelTypes=%s, desiredFeatures=%s",
+                    final_params["preferredMakes"],
+                    final_params["preferredVehicleTypes"],
+                    final_params["preferredFuelTypes"],
+                    final_params["desiredFeatures"],
                 )
             else:
                 logger.info(
-                    f"Intent is '{final_intent}'. Merging list parameters with context."
+                    "Intent is '%s'. Merging list parameters with context.",
+                    final_intent,
                 )
                 # Apply the existing merging logic (using merge_list_param_corrected) for makes, types, fuels
                 final_params["preferredMakes"] = merge_list_param_corrected(
@@ -2527,10 +3774,13 @@ def run_llm_with_history(
                         "desiredFeatures", []
                     )
                 logger.info(
-                    f"Merged query ({final_intent}): preferredMakes={final_params['preferredMakes']}, "
-                    f"preferredVehicleTypes={final_params['preferredVehicleTypes']}, "
-                    f"preferredFuelTypes={final_params['preferredFuelTypes']}, "
-                    f"desiredFeatures={final_params['desiredFeatures']}"
+                    "Merged query (%s): preferredMakes=%s, preferredVehicleTypes=%s, preferredFuelTypes=%s, "
+                    "desiredFeatures=%s",
+                    final_intent,
+                    final_params["preferredMakes"],
+                    final_params["preferredVehicleTypes"],
+                    final_params["preferredFuelTypes"],
+                    final_params["desiredFeatures"],
                 )
 
             # --- 5. Set Negated Lists ---
@@ -2551,7 +3801,8 @@ def run_llm_with_history(
                 final_params[key] = processed.get(key)
 
             logger.info(
-                f"Parameters after LLM processing & initial merge: {final_params}"
+                "Parameters after LLM processing & initial merge: %s",
+                final_params,
             )
 
             # --- SUFFICIENCY OVERRIDE LOGIC ---
@@ -2599,7 +3850,8 @@ def run_llm_with_history(
                         and len(llm_suggested_clarification_for) > 0
                     ):
                         logger.info(
-                            f"Using base clarificationNeededFor from LLM: {llm_suggested_clarification_for}"
+                            "Using base clarificationNeededFor from LLM: %s",
+                            llm_suggested_clarification_for,
                         )
                         current_clarification_list.extend(
                             llm_suggested_clarification_for
@@ -2655,7 +3907,7 @@ def run_llm_with_history(
             ):  # Only if there's something to clarify
                 final_params["clarificationNeededFor"] = (
                     _detect_indifference_and_update_clarification_list(
-                        query_fragment, final_params["clarificationNeededFor"]
+                        qf_lc, final_params["clarificationNeededFor"]
                     )
                 )
                 if (
@@ -2678,15 +3930,18 @@ def run_llm_with_history(
             # ... (else block for failed validation) ...
         else:  # if not extracted (LLM call failed or no JSON)
             logger.warning(
-                f"Extraction from model {model} returned None or failed parsing."
+                "Extraction from model %s returned None or failed parsing.",
+                model,
             )
             # extracted_params_from_llm_loop remains None or its last valid value
 
     # --- Final Return ---
     if extracted_params_from_llm_loop:  # Use the renamed variable
         logger.info(
-            f"Successful extraction with final parameters: {extracted_params_from_llm_loop}"
+            "Successful extraction with final parameters: %s",
+            extracted_params_from_llm_loop,
         )
+        extraction_cache_put(cache_key, extracted_params_from_llm_loop)
         return extracted_params_from_llm_loop
     else:
         # ... (CONFUSED_FALLBACK logic) ...
@@ -2700,8 +3955,95 @@ def run_llm_with_history(
         return confused_fallback_params
 
 
+def warm_up_service() -> None:
+    """
+    Primes per-process resources so the first real request avoids cold-start costs.
+
+    Runs one query embedding (allocating the thread's embedding buffer and
+    exercising the encoder), and opens a pooled keep-alive connection to
+    OpenRouter so the first extraction skips DNS + TCP + TLS setup. When
+    `LLM_WARMUP_MODELS` is enabled, also sends a throwaway extraction to each
+    model `run_llm_with_history` may call.
+
+    Call this in the serving process (e.g. gunicorn's `post_worker_init`), not
+    before forking, so the warmed connection belongs to the worker. Failures
+    are logged and otherwise ignored.
+    """
+    logger.info("Warming up service...")
+    get_normalized_query_embedding("warm up")
+
+    try:
+        _openrouter_session.head(OPENROUTER_URL, timeout=5).close()
+    except requests.exceptions.RequestException as e:
+        logger.warning("OpenRouter connection warm-up failed: %s", e)
+
+    if LLM_WARMUP_MODELS and OPENROUTER_API_KEY:
+        system_prompt = build_enhanced_system_prompt(
+            "test car",
+            [],
+            None,
+            VALID_MANUFACTURERS,
+            VALID_FUEL_TYPES,
+            VALID_VEHICLE_TYPES,
+        )
+        for model in (EXTRACTION_FAST_MODEL, CLARIFY_MODEL):
+            try_extract_with_model(model, system_prompt, "test car", timeout=15)
+    logger.info("Warm-up complete.")
+
+
 # --- Flask App Setup ---
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes and decodes with orjson.
+
+    Used for `jsonify` responses and `request.json` parsing when orjson is
+    installed. Honours the provider's `sort_keys`, `compact` and `default`
+    settings, so responses match the default provider's JSON.
+    """
+
+    def _dumps_bytes(self, obj: Any, indent: bool) -> bytes:
+        """Serializes `obj` to JSON bytes using the provider's settings."""
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        """Serializes `obj` to a JSON string."""
+        return self._dumps_bytes(obj, indent=bool(kwargs.get("indent"))).decode("utf-8")
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        """Deserializes JSON text or UTF-8 bytes."""
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        """
+        Builds a JSON response directly from orjson's bytes output.
+
+        Follows `JSONProvider.response`: no arguments serialize `None`, one
+        positional argument is serialized as is, several become a list, and
+        keyword arguments become an object. Positional and keyword arguments
+        cannot be mixed.
+        """
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if not args and not kwargs:
+            obj = None
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs
+        indent = (self.compact is None and current_app.debug) or self.compact is False
+        return current_app.response_class(
+            self._dumps_bytes(obj, indent) + b"\n", mimetype=self.mimetype
+        )
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 
 with app.app_context():
     initialize_app_components()
@@ -2709,6 +4051,49 @@ with app.app_context():
 
 # --- Flask Routes ---
 
+# Responses a caching reverse proxy may store, and for how long
+HTTP_CACHE_MAX_AGE_SECONDS = 3600
+_UNCACHEABLE_INTENTS = frozenset({"error", "CONFUSED_FALLBACK"})
+
+
+@app.after_request
+def add_cache_headers(response):
+    """
+    Adds HTTP caching headers to `/extract_parameters` responses.
+
+    `X-Cache-Key` is the blake2b-128 hash of the request body. A caller that sends
+    the same hash as a request header lets a reverse proxy cache these POSTs (e.g.
+    nginx `proxy_cache_methods POST; proxy_cache_key $http_x_cache_key;`).
+    Successful extractions are marked cacheable; errors, confused fallbacks and
+    `cacheBust` requests are marked `no-store`.
+
+    Args:
+        response: The Flask response about to be sent.
+
+    Returns:
+        The same response with headers added.
+    """
+    if request.endpoint != "extract_parameters":
+        return response
+
+    response.headers["X-Cache-Key"] = hashlib.blake2b(
+        request.get_data(cache=True), digest_size=16
+    ).hexdigest()
+
+    intent = g.get("response_intent")
+    if (
+        response.status_code == 200
+        and intent is not None
+        and intent not in _UNCACHEABLE_INTENTS
+        and not g.get("cache_bust", False)
+    ):
+        response.headers["Cache-Control"] = (
+            f"public, max-age={HTTP_CACHE_MAX_AGE_SECONDS}"
+        )
+    else:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
 
 @app.route("/extract_parameters", methods=["POST"])
 def extract_parameters():
@@ -2721,12 +4106,15 @@ def extract_parameters():
     MODERATE_RAG_THRESHOLD = 0.45  # Or desired value
     HIGH_RAG_THRESHOLD = 0.7  # Or desired value
     try:
-        start_time = datetime.datetime.now()
-        logger.info("Received request: %s", request.json)
+        start_ns = time.perf_counter_ns()
         data = request.json or {}
+        # The full payload includes the conversation history and can be kilobytes,
+        # so it is only formatted when debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received request: %s", data)
 
         is_follow_up = data.get("isFollowUpQuery", False)
-        logger.info(f"Processing as follow-up query: {is_follow_up}")
+        logger.info("Processing as follow-up query: %s", is_follow_up)
 
         if "query" not in data:
             logger.error("No 'query' provided in request.")
@@ -2739,6 +4127,9 @@ def extract_parameters():
         # Ensure the key "lastQuestionAsked" matches what's sent in the request payload.
         # If it's "lastQuestionAskedByAI" (like in your C# backend model), use that key instead.
         last_question_asked = data.get("lastQuestionAsked")
+        # Debugging aid: bypass the extraction cache and force a fresh LLM call
+        cache_bust = bool(data.get("cacheBust", False))
+        g.cache_bust = cache_bust
 
         # Safely retrieve context information
         confirmed_context = data.get("confirmedContext", {})
@@ -2752,24 +4143,33 @@ def extract_parameters():
         # Enhanced logging for context
         if rejected_makes or rejected_types or rejected_fuels:
             logger.info(
-                f"Rejected context: makes={rejected_makes}, types={rejected_types}, fuels={rejected_fuels}"
+                "Rejected context: makes=%s, types=%s, fuels=%s",
+                rejected_makes,
+                rejected_types,
+                rejected_fuels,
             )
 
         if confirmed_context and any(confirmed_context.values()):
             logger.info(
-                f"Confirmed context present with {len(confirmed_context)} items"
+                "Confirmed context present with %d items", len(confirmed_context)
             )
 
         logger.info(
-            "Processing query: %s (forceModel=%s) with %d history items",
-            user_query,
+            "Processing query of %d chars (forceModel=%s) with %d history items",
+            len(user_query),
             force_model,
             len(conversation_history),
         )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Query text: %s", user_query)
+
+        # Lowercased once for the off-topic check and the fragment scans below
+        uq_lc = user_query.lower()
 
         # 1) Quick check for off-topic
-        if not is_car_related(user_query):
+        if not is_car_related(user_query, uq_lc):
             logger.info("Query classified as off-topic.")
+            g.response_intent = "off_topic"
             return (
                 jsonify(
                     create_default_parameters(
@@ -2781,40 +4181,62 @@ def extract_parameters():
                 200,
             )
 
-        # 2) Intent Classification (Zero-Shot)
+        # 2) Extract newest user fragment for processing
+        query_fragment = extract_newest_user_fragment(user_query)
+        if FOLLOW_UP_SEPARATOR in user_query:
+            qf_lc = query_fragment.lower().strip()
+        else:  # The fragment is the whole query
+            qf_lc = uq_lc.strip()
+
+        # Initialize force_llm here, before the keyword checking block
+        force_llm = False
+
+        # Check if any specific known make/type/fuel keyword appears in the query
+        # as a whole word (one automaton pass, multi-word names included)
+        specific_keywords_found = find_whole_word_items(qf_lc, VALID_KEYWORDS_LOWER)
+
+        # 3) Intent Classification (Zero-Shot)
         classified_intent = "SPECIFIC_SEARCH"  # Default assumption
         intent_scores = None  # Initialize intent_scores to None
-        try:
-            query_embedding = get_query_embedding(user_query)
-            if query_embedding is not None:
-                # Adjusted threshold based on testing
-                # NOTE: classify_intent_zero_shot currently only returns the intent string.
-                # For the following logic to work as intended, classify_intent_zero_shot
-                # would need to be modified to return an intent_scores dictionary as well.
-                intent_result = classify_intent_zero_shot(
-                    query_embedding, threshold=0.25
-                )
-                if intent_result:
-                    classified_intent = intent_result
-                else:
-                    logger.info(
-                        "Intent classification score below threshold, using fallback logic."
-                    )
-                    # Fallback logic is now inside classify_intent_zero_shot
-                    if (
-                        intent_result is None
-                    ):  # This means classify_intent_zero_shot returned None
-                        classified_intent = "SPECIFIC_SEARCH"  # Safe default
-            else:  # query_embedding was None
-                logger.error(
-                    "Failed to get query embedding, defaulting intent to SPECIFIC_SEARCH."
-                )
-                classified_intent = "SPECIFIC_SEARCH"  # Default if embedding fails
-        except Exception as e:
-            logger.error(
-                f"Error during embedding or classification: {e}", exc_info=True
+        query_embedding = None
+        if specific_keywords_found:
+            # A query naming a specific make/type/fuel always takes the SPECIFIC_SEARCH
+            # path, so it is not embedded just to be classified
+            logger.info(
+                "Specific keywords found in query: %s. Skipping intent classification "
+                "(SPECIFIC_SEARCH/LLM path).",
+                specific_keywords_found,
             )
-            classified_intent = "SPECIFIC_SEARCH"  # Fallback safely
+        else:
+            try:
+                query_embedding = get_normalized_query_embedding(user_query)
+                if query_embedding is not None:
+                    # Adjusted threshold based on testing
+                    # NOTE: classify_intent_zero_shot currently only returns the intent string.
+                    # For the following logic to work as intended, classify_intent_zero_shot
+                    # would need to be modified to return an intent_scores dictionary as well.
+                    intent_result = classify_intent_zero_shot(
+                        query_embedding, threshold=0.25
+                    )
+                    if intent_result:
+                        classified_intent = intent_result
+                    else:
+                        logger.info(
+                            "Intent classification score below threshold, using fallback logic."
+                        )
+                        # Fallback logic is now inside classify_intent_zero_shot
+                        if (
+                            intent_result is None
+                        ):  # This means classify_intent_zero_shot returned None
+                            classified_intent = "SPECIFIC_SEARCH"  # Safe default
+                else:  # query_embedding was None
+                    logger.error(
+                        "Failed to get query embedding, defaulting intent to SPECIFIC_SEARCH."
+                    )
+                    classified_intent = "SPECIFIC_SEARCH"  # Default if embedding fails
+            except Exception as e:
+                logger.warning("Embedding/classification failed: %r", e)
+                classified_intent = "SPECIFIC_SEARCH"  # Fallback safely
 
         # This block checks hypothetical scores. For this to be effective,
         # classify_intent_zero_shot would need to be modified to return 'intent_scores'.
@@ -2826,41 +4248,14 @@ def extract_parameters():
             and intent_scores.get("VAGUE_INQUIRY", 0.0) < VERY_LOW_CONFIDENCE_THRESHOLD
         ):
             logger.warning(
-                f"Both SPECIFIC_SEARCH ({intent_scores.get('SPECIFIC_SEARCH', 0.0):.2f}) and "
-                f"VAGUE_INQUIRY ({intent_scores.get('VAGUE_INQUIRY', 0.0):.2f}) scores "
-                f"are below VERY_LOW_CONFIDENCE_THRESHOLD ({VERY_LOW_CONFIDENCE_THRESHOLD}). "
-                f"Forcing intent to CONFUSED_FALLBACK."
+                "Both SPECIFIC_SEARCH (%.2f) and VAGUE_INQUIRY (%.2f) scores are below "
+                "VERY_LOW_CONFIDENCE_THRESHOLD (%s). Forcing intent to CONFUSED_FALLBACK.",
+                intent_scores.get("SPECIFIC_SEARCH", 0.0),
+                intent_scores.get("VAGUE_INQUIRY", 0.0),
+                VERY_LOW_CONFIDENCE_THRESHOLD,
             )
             classified_intent = "CONFUSED_FALLBACK"
 
-        # 3) Extract newest user fragment for processing
-        query_fragment = extract_newest_user_fragment(user_query)
-        lower_query_fragment = query_fragment.lower()
-
-        # Initialize force_llm here, before the keyword checking block
-        force_llm = False
-
-        # Check for specific make/type/fuel keywords using the now-defined lower_query_fragment
-        valid_keywords_lower = set()
-        valid_keywords_lower.update(make.lower() for make in VALID_MANUFACTURERS)
-        valid_keywords_lower.update(fuel.lower() for fuel in VALID_FUEL_TYPES)
-        valid_keywords_lower.update(vtype.lower() for vtype in VALID_VEHICLE_TYPES)
-
-        # Check if any specific known keyword appears in the query
-        words_in_query = set(re.findall(r"\b(\w+)\b", lower_query_fragment))
-        specific_keywords_found = words_in_query.intersection(valid_keywords_lower)
-
-        # If query contains specific keywords and was classified as vague, change to specific
-        if (
-            specific_keywords_found
-            and classified_intent == "VAGUE_INQUIRY"
-            and not force_llm
-        ):
-            logger.info(
-                f"Specific keywords found in vague query: {specific_keywords_found}. Forcing SPECIFIC_SEARCH/LLM path."
-            )
-            classified_intent = "SPECIFIC_SEARCH"
-
         # 4) Initialize routing condition flags
         is_clarification_answer = False
         contains_override = False
@@ -2881,7 +4276,8 @@ def extract_parameters():
                 "Contextual follow-up detected, prioritizing LLM parameter extraction with enhanced prompt."
             )
 
-            # Direct call to LLM with enhanced context
+            # Direct call to LLM with enhanced context. With the "clarify" strategy the
+            # user is answering the assistant's question, so go straight to CLARIFY_MODEL
             extracted_params = run_llm_with_history(
                 user_query,
                 conversation_history,
@@ -2891,6 +4287,8 @@ def extract_parameters():
                 rejected_context=rejected_context,
                 contains_override=contains_override,
                 last_question_asked=last_question_asked,  # Use the initialized variable
+                bypass_cache=cache_bust,
+                skip_fast=force_model == "clarify",
             )
 
             if extracted_params and extracted_params.get("intent") != "error":
@@ -2899,26 +4297,11 @@ def extract_parameters():
                     "Contextual LLM extraction successful, performing post-processing."
                 )
 
-                # Prevent clarification loops
-                if extracted_params.get("clarificationNeeded"):
-                    logger.info(
-                        "LOOP PREVENTION: Overriding LLM's clarificationNeeded=True because this is a "
-                        "contextual follow-up answer"
-                    )
-                    extracted_params["clarificationNeeded"] = False
-                    extracted_params["clarificationNeededFor"] = []
-
-                # Override intent to 'clarify' for contextual answers
-                if extracted_params.get("intent") != "clarify":
-                    logger.info(
-                        "Overriding LLM intent to 'clarify' based on contextual follow-up detection"
-                    )
-                    extracted_params["intent"] = "clarify"
+                # Prevent clarification loops and report the 'clarify' intent
+                apply_clarify_overrides(extracted_params, "contextual follow-up answer")
 
-                # Ensure all fields exist using create_default_parameters as base
-                base = create_default_parameters()
-                base.update(extracted_params)
-                final_response = base
+                # Ensure all fields exist, on top of the default parameters
+                final_response = merge_with_default_parameters(extracted_params)
                 logger.info(
                     "Final extracted parameters from contextual LLM: %s", final_response
                 )
@@ -2947,44 +4330,62 @@ def extract_parameters():
                 logger.info("Intent classified as SPECIFIC_SEARCH, proceeding to LLM.")
             else:  # Log details if forced
                 logger.info(
-                    f"Routing conditions met (clarify={is_clarification_answer}, "
-                    f"override={contains_override}, mentions_rejected={mentions_rejected}), proceeding to LLM."
+                    "Routing conditions met (clarify=%s, override=%s, mentions_rejected=%s), proceeding to LLM.",
+                    is_clarification_answer,
+                    contains_override,
+                    mentions_rejected,
                 )
 
-            extracted_params = run_llm_with_history(
-                user_query,
-                conversation_history,
-                None,  # matched_category
-                force_model,
-                confirmed_context=confirmed_context,
-                rejected_context=rejected_context,
-                contains_override=contains_override,
-                last_question_asked=last_question_asked,  # Use the initialized variable consistently
+            # Only stateless queries (no history or context) are safe to answer from
+            # the semantic cache, since context changes the extraction result.
+            # Queries that skipped classification are not embedded just for it: the
+            # hit would need the same makes/types/fuels anyway, and exact repeats are
+            # served by the extraction cache.
+            query_unit = None
+            if query_embedding is not None and not (
+                conversation_history or confirmed_context or rejected_context
+            ):
+                query_unit = to_unit_vector(query_embedding)
+                cache_signature = semantic_cache_signature(uq_lc)
+
+            extracted_params = (
+                semantic_cache_lookup(query_unit, cache_signature)
+                if query_unit is not None and not cache_bust
+                else None
             )
+            if extracted_params is None:
+                extracted_params = run_llm_with_history(
+                    user_query,
+                    conversation_history,
+                    None,  # matched_category
+                    force_model,
+                    confirmed_context=confirmed_context,
+                    rejected_context=rejected_context,
+                    contains_override=contains_override,
+                    last_question_asked=last_question_asked,  # Use the initialized variable consistently
+                    bypass_cache=cache_bust,
+                )
+                if (
+                    query_unit is not None
+                    and extracted_params
+                    and extracted_params.get("intent")
+                    not in ("error", "CONFUSED_FALLBACK")
+                ):
+                    semantic_cache_store(query_unit, cache_signature, extracted_params)
 
             if extracted_params:
-                # NEW CODE: Prevent clarification loops by forcing clarificationNeeded=False
-                # if this is already a clarification answer
-                if is_clarification_answer:
-                    if extracted_params.get("clarificationNeeded"):
-                        logger.info(
-                            "LOOP PREVENTION: Overriding LLM's clarificationNeeded=True because this is already a "
-                            "clarification answer"
-                        )
-                        extracted_params["clarificationNeeded"] = False
-                        extracted_params["clarificationNeededFor"] = []
-
-                # Override intent to 'clarify' for contextual answers
-                if extracted_params.get("intent") != "clarify":
-                    logger.info(
-                        "Overriding LLM intent to 'clarify' based on context detection"
-                    )
-                    extracted_params["intent"] = "clarify"
+                # Results in this branch are always reported with the 'clarify'
+                # intent; only a clarification answer also gets loop prevention
+                apply_clarify_overrides(
+                    extracted_params,
+                    "clarification answer",
+                    prevent_loop=is_clarification_answer,
+                )
 
-                # Ensure all fields exist using create_default_parameters as base
-                base = create_default_parameters()
-                base.update(extracted_params)  # Overwrite defaults with LLM output
-                final_response = base
+                # Ensure all fields exist, on top of the default parameters
+                final_response = merge_with_default_parameters(
+                    extracted_params
+                )  # Overwrite defaults with LLM output
                 logger.info("Final extracted parameters from LLM: %s", final_response)
             else:
                 logger.error("LLM models failed or no valid extraction.")
@@ -2997,8 +4398,13 @@ def extract_parameters():
                 "Intent is VAGUE_INQUIRY and no override/clarification forced LLM, proceeding with RAG."
             )
             try:
-                match_cat, score = find_best_match(query_fragment)
-                logger.info(f"RAG result: Category='{match_cat}', Score={score:.2f}")
+                # The fragment is usually the whole query, whose embedding is
+                # already cached, so the retriever need not encode it again
+                match_cat, score = find_best_match(
+                    query_fragment,
+                    query_embedding=get_normalized_query_embedding(query_fragment),
+                )
+                logger.info("RAG result: Category='%s', Score=%.2f", match_cat, score)
 
                 # Define RAG confidence thresholds
                 LOW_CONFIDENCE_THRESHOLD = 0.4  # Very low confidence
@@ -3035,20 +4441,7 @@ def extract_parameters():
                         )
 
                         # Handle scalar parameters - only copy those not extracted directly
-                        scalar_params = [
-                            ("minPrice", "confirmedMinPrice"),
-                            ("maxPrice", "confirmedMaxPrice"),
-                            ("minYear", "confirmedMinYear"),
-                            ("maxYear", "confirmedMaxYear"),
-                            ("maxMileage", "confirmedMaxMileage"),
-                            ("transmission", "confirmedTransmission"),
-                            ("minEngineSize", "confirmedMinEngineSize"),
-                            ("maxEngineSize", "confirmedMaxEngineSize"),
-                            ("minHorsepower", "confirmedMinHorsePower"),
-                            ("maxHorsepower", "confirmedMaxHorsePower"),
-                        ]
-
-                        for param, context_key in scalar_params:
+                        for param, context_key, _ in SCALAR_PARAM_TABLE:
                             if (
                                 param not in extracted_params_direct
                                 and confirmed_context.get(context_key) is not None
@@ -3077,7 +4470,9 @@ def extract_parameters():
                     # High confidence match - provide category-specific clarification
                     if score >= HIGH_RAG_THRESHOLD:
                         logger.info(
-                            f"High confidence RAG match ({score:.2f}) for '{match_cat}'"
+                            "High confidence RAG match (%.2f) for '%s'",
+                            score,
+                            match_cat,
                         )
                         final_response = create_default_parameters(
                             intent="clarify",
@@ -3093,8 +4488,8 @@ def extract_parameters():
                     # Follow-up query with moderate confidence - try parameter extraction from category
                     elif is_follow_up and score >= MODERATE_RAG_THRESHOLD:
                         logger.info(
-                            f"Follow-up query with moderate RAG confidence ({score:.2f}). "
-                            f"Attempting parameter extraction."
+                            "Follow-up query with moderate RAG confidence (%.2f). Attempting parameter extraction.",
+                            score,
                         )
                         param_name, param_value = try_extract_param_from_rag_category(
                             match_cat
@@ -3110,7 +4505,9 @@ def extract_parameters():
                             # Set the extracted parameter
                             final_response[param_name] = param_value
                             logger.info(
-                                f"Category parameter extraction successful: {param_name}={param_value}"
+                                "Category parameter extraction successful: %s=%s",
+                                param_name,
+                                param_value,
                             )
 
                             # Merge with confirmed context
@@ -3120,20 +4517,7 @@ def extract_parameters():
                                 )
 
                                 # Handle scalar parameters (excluding the one we just extracted)
-                                scalar_params = [
-                                    ("minPrice", "confirmedMinPrice"),
-                                    ("maxPrice", "confirmedMaxPrice"),
-                                    ("minYear", "confirmedMinYear"),
-                                    ("maxYear", "confirmedMaxYear"),
-                                    ("maxMileage", "confirmedMaxMileage"),
-                                    ("transmission", "confirmedTransmission"),
-                                    ("minEngineSize", "confirmedMinEngineSize"),
-                                    ("maxEngineSize", "confirmedMaxEngineSize"),
-                                    ("minHorsepower", "confirmedMinHorsePower"),
-                                    ("maxHorsepower", "confirmedMaxHorsePower"),
-                                ]
-
-                                for p, context_key in scalar_params:
+                                for p, context_key, _ in SCALAR_PARAM_TABLE:
                                     if (
                                         p != param_name
                                         and confirmed_context.get(context_key)
@@ -3176,8 +4560,9 @@ def extract_parameters():
                     # Very low confidence - use confused fallback
                     elif score < LOW_CONFIDENCE_THRESHOLD:
                         logger.warning(
-                            f"RAG score ({score:.2f}) is below confidence threshold ({LOW_CONFIDENCE_THRESHOLD}). "
-                            f"Triggering CONFUSED_FALLBACK."
+                            "RAG score (%.2f) is below confidence threshold (%s). Triggering CONFUSED_FALLBACK.",
+                            score,
+                            LOW_CONFIDENCE_THRESHOLD,
                         )
                         final_response = create_default_parameters(
                             intent="CONFUSED_FALLBACK",
@@ -3189,8 +4574,8 @@ def extract_parameters():
                     # Low-moderate confidence or not a follow-up - general clarification
                     else:
                         logger.info(
-                            f"Low-moderate RAG score ({score:.2f}) or not a follow-up. "
-                            f"Requesting general clarification."
+                            "Low-moderate RAG score (%.2f) or not a follow-up. Requesting general clarification.",
+                            score,
                         )
                         final_response = create_default_parameters(
                             intent="clarify",
@@ -3203,7 +4588,7 @@ def extract_parameters():
                         )
 
             except Exception as e:
-                logger.error(f"Error during RAG processing: {e}", exc_info=True)
+                logger.error("Error during RAG processing: %r", e)
                 logger.warning("RAG failed, falling back to generic clarification.")
                 final_response = create_default_parameters(
                     intent="clarify",
@@ -3213,7 +4598,8 @@ def extract_parameters():
                 )
         else:
             logger.warning(
-                f"Unhandled classified_intent: {classified_intent}. Defaulting to error."
+                "Unhandled classified_intent: %s. Defaulting to error.",
+                classified_intent,
             )
             final_response = create_default_parameters(intent="error")
 
@@ -3224,16 +4610,18 @@ def extract_parameters():
             )
             final_response = create_default_parameters(intent="error")
 
-        end_time = datetime.datetime.now()
-        duration = (end_time - start_time).total_seconds()
-        logger.info(f"Request processing completed in {duration:.2f} seconds.")
+        duration_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+        logger.info("Request processing completed in %d ms.", duration_ms)
+
+        g.response_intent = final_response.get("intent")
 
         return jsonify(final_response), 200
 
     except Exception as e:
-        logger.exception(f"Unhandled exception in /extract_parameters: {e}")
+        logger.exception("Unhandled exception in /extract_parameters: %s", e)
         return jsonify(create_default_parameters(intent="error")), 500
 
 
 if __name__ == "__main__":
+    warm_up_service()
     app.run(host="0.0.0.0", port=5006, debug=False)  # Keep debug=False
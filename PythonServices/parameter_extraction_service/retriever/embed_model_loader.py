@@ -3,6 +3,8 @@
 
 from sentence_transformers import SentenceTransformer
 
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
 _model = None
 
 
@@ -12,5 +14,5 @@ def load_embedding_model():
         # Using a small, CPU-friendly model
         # If you're REALLY tight on memory, consider 'sentence-transformers/all-MiniLM-L6-v2'
         print("Loading local embedding model... (CPU only)")
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
+        _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
     return _model
@@ -20,7 +20,10 @@ Notes:
 Dependencies:
     - `json`: Used for loading category data from a JSON file.
     - `logging`: Used for application-level logging.
+    - `math`: Used for the square root in cosine similarity.
     - `os`: Used for operating system-dependent functionalities like path manipulation.
+    - `queue`, `threading`, `time`, `concurrent.futures.Future`: Used by the optional
+      query embedding micro-batcher.
     - `typing.Optional`: Used for type hinting optional return values.
     - `numpy`: Used for numerical operations, particularly for handling vector
       embeddings and calculating cosine similarity.
@@ -33,7 +36,12 @@ Dependencies:
 
 import json
 import logging
+import math
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from typing import Optional
 
 import numpy as np
@@ -48,8 +56,42 @@ EMBEDDINGS_PATH = os.path.join(os.path.dirname(__file__), "embeddings.npy")
 # We'll load categories from JSON and keep them + embeddings in memory
 _categories = []
 _vectors = None
+_unit_vectors = None  # _vectors with L2-normalized float32 rows; dot product == cosine
 _model = None
 
+# Optional micro-batching of query embeddings: concurrent get_query_embedding calls
+# are collected for up to EMBED_BATCH_WAIT_MS (or until EMBED_BATCH_SIZE are pending)
+# and encoded in one forward pass. Off by default.
+EMBED_BATCHING_ENABLED = (
+    os.environ.get("EMBED_BATCHING_ENABLED", "false").lower() == "true"
+)
+EMBED_BATCH_WAIT_MS = int(os.environ.get("EMBED_BATCH_WAIT_MS", "8"))
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))
+# Upper bound on how long a caller waits for the batcher to encode its text
+EMBED_BATCH_TIMEOUT_SECONDS = float(os.environ.get("EMBED_BATCH_TIMEOUT_SECONDS", "10"))
+
+_embed_queue: "queue.Queue[tuple]" = queue.Queue()
+_embed_worker: Optional[threading.Thread] = None
+_embed_worker_lock = threading.Lock()
+
+
+def _reset_embed_batcher_after_fork():
+    """
+    Drops the parent's batcher state in a forked child.
+
+    A preloaded gunicorn master can start the worker thread while computing label
+    embeddings at import; the forked workers inherit the queue and lock but not the
+    thread, so each child starts its own worker on first use.
+    """
+    global _embed_queue, _embed_worker, _embed_worker_lock
+    _embed_queue = queue.Queue()
+    _embed_worker = None
+    _embed_worker_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_embed_batcher_after_fork)
+
 
 def initialize_retriever():
     """
@@ -69,7 +111,7 @@ def initialize_retriever():
     to the caller, allowing the application to potentially continue if, for example,
     only some components fail to load.
     """
-    global _categories, _vectors, _model
+    global _categories, _vectors, _unit_vectors, _model
     if _model is None:  # Ensure model is loaded if not already
         _model = load_embedding_model()
         logger.info("Embedding model loaded for retriever.")
@@ -80,32 +122,41 @@ def initialize_retriever():
                 _categories = json.load(f)
             logger.info("Categories loaded.")
         except Exception as e:
-            logger.error(f"Failed to load categories from {CATEGORIES_PATH}: {e}")
+            logger.error("Failed to load categories from %s: %s", CATEGORIES_PATH, e)
             _categories = []  # Ensure it's an empty list on failure
 
     if _vectors is None:
         if not os.path.exists(EMBEDDINGS_PATH) and _categories and _model:
             try:
                 logger.info(
-                    f"Generating embeddings for categories and saving to {EMBEDDINGS_PATH}..."
+                    "Generating embeddings for categories and saving to %s...",
+                    EMBEDDINGS_PATH,
                 )
                 cat_embs = _model.encode(_categories, convert_to_numpy=True)
                 np.save(EMBEDDINGS_PATH, cat_embs)
                 _vectors = cat_embs
                 logger.info("Embeddings generated and saved.")
             except Exception as e:
-                logger.error(f"Failed to generate or save embeddings: {e}")
+                logger.error("Failed to generate or save embeddings: %s", e)
         elif os.path.exists(EMBEDDINGS_PATH):
             try:
                 _vectors = np.load(EMBEDDINGS_PATH)
                 logger.info("Embeddings loaded from file.")
             except Exception as e:
-                logger.error(f"Failed to load embeddings from {EMBEDDINGS_PATH}: {e}")
+                logger.error(
+                    "Failed to load embeddings from %s: %s", EMBEDDINGS_PATH, e
+                )
         else:
             logger.warning(
                 "Embeddings file not found and cannot generate (missing model or categories)."
             )
 
+    if _vectors is not None and _unit_vectors is None:
+        _unit_vectors = np.asarray(_vectors, dtype=np.float32)
+        norms = np.linalg.norm(_unit_vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0  # Leave zero rows as zeros
+        _unit_vectors = _unit_vectors / norms
+
 
 def cosine_sim(a, b):
     """
@@ -132,15 +183,78 @@ def cosine_sim(a, b):
     # Ensure inputs are numpy arrays
     a = np.asarray(a)
     b = np.asarray(b)
-    # Handle potential zero vectors
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    if norm_a == 0 or norm_b == 0:
+    # One sqrt over the product of squared norms; vdot skips np.linalg.norm's
+    # dispatch overhead. A zero denominator means one of the vectors is zero.
+    denominator = math.sqrt(float(np.vdot(a, a)) * float(np.vdot(b, b)))
+    if denominator == 0:
         return 0.0
-    return np.dot(a, b) / (norm_a * norm_b)
+    return np.dot(a, b) / denominator
 
 
-def get_query_embedding(text: str) -> Optional[np.ndarray]:
+def _embed_batch_worker():
+    """
+    Background loop that encodes queued query texts in micro-batches.
+
+    Waits for the first pending text, keeps collecting until the batch is full or
+    EMBED_BATCH_WAIT_MS has elapsed, then encodes the batch's distinct texts with a
+    single `encode` call and hands each row to the Futures waiting on that text.
+    """
+    while True:
+        batch = [_embed_queue.get()]
+        batch_deadline = time.monotonic() + EMBED_BATCH_WAIT_MS / 1000.0
+        while len(batch) < EMBED_BATCH_SIZE:
+            remaining = batch_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_embed_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Concurrent requests often carry the same text; encode each one once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = _model.encode(
+                texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True
+            )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            continue
+        embedding_by_text = dict(zip(texts, embeddings))
+        for text, future in batch:
+            future.set_result(embedding_by_text[text])
+
+
+def _encode_batched(text: str) -> np.ndarray:
+    """
+    Queues `text` for the embedding micro-batcher and waits for its vector.
+
+    The worker thread is started on first use.
+
+    Raises:
+        RuntimeError: If the worker thread has died.
+        concurrent.futures.TimeoutError: If the vector is not ready within
+            EMBED_BATCH_TIMEOUT_SECONDS.
+    """
+    global _embed_worker
+    with _embed_worker_lock:
+        if _embed_worker is None:
+            _embed_worker = threading.Thread(
+                target=_embed_batch_worker, name="embed-batch-worker", daemon=True
+            )
+            _embed_worker.start()
+        elif not _embed_worker.is_alive():
+            raise RuntimeError("Embedding batch worker thread has died")
+
+    future = Future()
+    _embed_queue.put((text, future))
+    return future.result(timeout=EMBED_BATCH_TIMEOUT_SECONDS)
+
+
+def get_query_embedding(
+    text: str, out: Optional[np.ndarray] = None
+) -> Optional[np.ndarray]:
     """
     Encodes the input text using the loaded embedding model.
 
@@ -151,9 +265,13 @@ def get_query_embedding(text: str) -> Optional[np.ndarray]:
 
     Args:
         text (str): The text string to encode.
+        out (Optional[np.ndarray]): A preallocated array to write the embedding into,
+                                    letting callers reuse one buffer across requests.
+                                    Must match the model's embedding shape.
 
     Returns:
-        Optional[np.ndarray]: A NumPy array representing the embedding of the input text.
+        Optional[np.ndarray]: A float32 NumPy array representing the embedding of the input text
+                              (`out` itself when given).
                               Returns `None` if the embedding model is not loaded or
                               if an error occurs during the encoding process.
     """
@@ -165,25 +283,41 @@ def get_query_embedding(text: str) -> Optional[np.ndarray]:
                 logger.error("Failed to load embedding model for get_query_embedding.")
                 return None
         # Encode the text
-        embedding = _model.encode(text, convert_to_numpy=True)
+        if EMBED_BATCHING_ENABLED:
+            embedding = _encode_batched(text)
+        else:
+            embedding = _model.encode(text, convert_to_numpy=True)
+        # Callers score against float32 matrices; keep queries float32 so numpy
+        # never upcasts the matrix products to float64
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if out is not None:
+            np.copyto(out, embedding)
+            return out
         return embedding
     except Exception as e:
-        logger.error(f"Error getting query embedding for text '{text[:50]}...': {e}")
+        logger.error("Error getting query embedding for text '%s...': %s", text[:50], e)
         return None
 
 
-def find_best_match(user_query: str) -> (Optional[str], float):
+def find_best_match(
+    user_query: str, query_embedding: Optional[np.ndarray] = None
+) -> (Optional[str], float):
     """
     Finds the best category match for a user query and its similarity score.
 
     This function attempts to initialize the retriever if its components
     (_model, _vectors, _categories) are not already loaded. It then generates
-    an embedding for the `user_query`. This query embedding is compared against
+    an embedding for the `user_query`, unless the caller already has one. This
+    query embedding is compared against
     all pre-computed category embeddings using cosine similarity. The category
     with the highest similarity score is returned.
 
     Args:
         user_query (str): The user's query string.
+        query_embedding (Optional[np.ndarray]): A precomputed embedding of
+                                                `user_query` (normalized or not).
+                                                When given, the query is not
+                                                encoded again.
 
     Returns:
         tuple[Optional[str], float]: A tuple containing:
@@ -210,22 +344,30 @@ def find_best_match(user_query: str) -> (Optional[str], float):
         ("family suv", 0.92) # Illustrative output
     """
     try:
-        if _model is None or _vectors is None or not _categories:
+        if _model is None or _unit_vectors is None or not _categories:
             logger.warning(
                 "Retriever not fully initialized. Attempting initialization."
             )
             initialize_retriever()
-            if _model is None or _vectors is None or not _categories:
+            if _model is None or _unit_vectors is None or not _categories:
                 logger.error("Cannot find best match: Retriever components missing.")
                 return None, 0.0
 
-        query_embedding = get_query_embedding(user_query)
+        if query_embedding is None:
+            query_embedding = get_query_embedding(user_query)
         if query_embedding is None:
             logger.error("Failed to get embedding for query in find_best_match.")
             return None, 0.0
 
-        similarities = [cosine_sim(query_embedding, vec) for vec in _vectors]
-        if not similarities:
+        # Category rows are unit length, so normalizing the query once turns every
+        # cosine similarity into one row of a single matrix-vector product
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = math.sqrt(float(np.vdot(query_vector, query_vector)))
+        if query_norm == 0:
+            similarities = np.zeros(len(_unit_vectors), dtype=np.float32)
+        else:
+            similarities = _unit_vectors @ (query_vector / query_norm)
+        if similarities.size == 0:
             logger.error(
                 "No similarities computed, _vectors might be empty or invalid."
             )
@@ -240,5 +382,7 @@ def find_best_match(user_query: str) -> (Optional[str], float):
         return _categories[best_match_idx], score
 
     except Exception as e:
-        logger.error(f"Error finding best match for query '{user_query[:50]}...': {e}")
+        logger.error(
+            "Error finding best match for query '%s...': %s", user_query[:50], e
+        )
         return None, 0.0
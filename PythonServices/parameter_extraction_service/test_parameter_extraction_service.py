@@ -1,10 +1,38 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
 import pytest
+from flask.json.provider import DefaultJSONProvider
 
 # Adjust the import path if your structure is different
+import parameter_extraction_service
 from parameter_extraction_service import (
+    VALID_FUEL_TYPES,
+    VALID_MANUFACTURERS,
+    VALID_VEHICLE_TYPES,
+    build_enhanced_system_prompt,
+    build_label_matrix,
+    classify_intent_zero_shot,
     create_default_parameters,
+    extract_with_models_hedged,
+    extraction_cache_get,
+    extraction_cache_put,
+    find_terms,
+    get_normalized_query_embedding,
+    initialize_app_components,
+    is_car_related,
+    merge_with_default_parameters,
     process_parameters,
+    read_completion_stream,
+    run_extraction_coalesced,
     run_llm_with_history,
+    semantic_cache_lookup,
+    semantic_cache_signature,
+    semantic_cache_store,
+    to_unit_vector,
 )
 
 # --- Mocking Setup ---
@@ -16,13 +44,34 @@ class MockLLMResponse:
     def __init__(self, output_dict):
         self.output_dict = output_dict
 
-    def get_response(self, model, system_prompt, user_query):
+    def get_response(self, model, system_prompt, user_query, timeout=None):
         """Returns the predefined dictionary simulating LLM output"""
         # You could add logic here to return different dicts based on input if needed
         print(f"MockLLM: Returning predefined output for model {model}")
         return self.output_dict
 
 
+class FakeStreamResponse:
+    """Simulates a streamed OpenRouter response yielding SSE lines"""
+
+    def __init__(self, deltas):
+        self.lines = [b": OPENROUTER PROCESSING", b""]
+        for delta in deltas:
+            chunk = {"choices": [{"delta": {"content": delta}}]}
+            self.lines.append(b"data: " + json.dumps(chunk).encode())
+        self.lines.append(b"data: [DONE]")
+        self.lines_read = 0
+        self.closed = False
+
+    def iter_lines(self):
+        for line in self.lines:
+            self.lines_read += 1
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
 # --- Test Cases ---
 
 
@@ -284,3 +333,495 @@ def test_process_parameters_invalid_types():
 
     result = process_parameters(input_params)
     assert result == expected_output
+
+
+def test_process_parameters_canonicalizes_casing():
+    """Tests process_parameters accepts any casing and returns canonical values"""
+    input_params = {
+        "preferredMakes": ["bmw", "TOYOTA"],
+        "preferredFuelTypes": ["hybrid"],
+        "preferredVehicleTypes": ["suv", "HOT HATCH"],
+        "intent": "new_query",
+    }
+
+    result = process_parameters(input_params)
+    assert result["preferredMakes"] == ["BMW", "Toyota"]
+    assert result["preferredFuelTypes"] == ["Hybrid"]
+    assert result["preferredVehicleTypes"] == ["SUV", "hot hatch"]
+
+
+def test_create_default_parameters_returns_independent_lists():
+    """Tests that mutating one default dict does not leak into the next"""
+    first = create_default_parameters()
+    first["preferredMakes"].append("BMW")
+    first["clarificationNeededFor"].append("budget")
+
+    second = create_default_parameters()
+    assert second["preferredMakes"] == []
+    assert second["clarificationNeededFor"] == []
+
+
+def test_merge_with_default_parameters_matches_create_then_update():
+    """Tests that merging fills the same defaults as create_default_parameters + update"""
+    params = {"minPrice": 5000.0, "preferredMakes": ["BMW"], "intent": "refine_criteria"}
+    expected = create_default_parameters()
+    expected.update(params)
+
+    merged = merge_with_default_parameters(params)
+    assert merged == expected
+    merged["preferredFuelTypes"].append("Diesel")
+    assert create_default_parameters()["preferredFuelTypes"] == []
+
+
+def test_extraction_cache_expires_entries_after_ttl(monkeypatch):
+    """Tests that extraction cache entries are served until their TTL elapses"""
+    now = [1000.0]
+    monkeypatch.setattr("parameter_extraction_service.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("parameter_extraction_service.EXTRACTION_CACHE_TTL_SECONDS", 60.0)
+
+    extraction_cache_put("ttl-test-key", {"minPrice": 5000.0})
+    assert extraction_cache_get("ttl-test-key") == {"minPrice": 5000.0}
+
+    now[0] += 61.0
+    assert extraction_cache_get("ttl-test-key") is None
+
+
+def test_semantic_cache_returns_copy_for_similar_query():
+    """Tests that near-identical embeddings hit the semantic cache"""
+    stored = create_default_parameters(intent="new_query")
+    stored["preferredMakes"] = ["Toyota"]
+    signature = semantic_cache_signature("a reliable toyota")
+    base = to_unit_vector(np.array([1.0, 2.0, 3.0, 4.0]))
+    semantic_cache_store(base, signature, stored)
+
+    near = to_unit_vector(np.array([1.0, 2.0, 3.0, 4.05]))
+    hit = semantic_cache_lookup(near, signature)
+    assert hit == stored
+    hit["preferredMakes"].append("BMW")
+    assert semantic_cache_lookup(near, signature)["preferredMakes"] == ["Toyota"]
+
+    far = to_unit_vector(np.array([4.0, -3.0, 2.0, -1.0]))
+    assert semantic_cache_lookup(far, signature) is None
+
+
+@pytest.mark.parametrize(
+    "stored_query, query",
+    [
+        ("something cheap under 30k", "something cheap under 20k"),
+        ("a bmw 2018 or newer", "a bmw 2020 or newer"),
+        ("a reliable toyota", "a reliable honda"),
+        ("a diesel family car", "no diesel family car"),
+        ("something cheap under 20k", "something cheap over 20k"),
+        ("automatic under 20000", "manual under 20000"),
+        ("from before 2018", "from after 2018"),
+    ],
+)
+def test_semantic_cache_misses_when_numbers_or_terms_differ(stored_query, query):
+    """Tests that a similar embedding does not hit an entry for different numbers, qualifiers or makes"""
+    unit = to_unit_vector(np.array([-2.0, 5.0, 1.0, 3.0]))
+    semantic_cache_store(unit, semantic_cache_signature(stored_query), {"intent": "new_query"})
+    assert semantic_cache_lookup(unit, semantic_cache_signature(query)) is None
+
+
+def test_run_llm_with_history_caches_repeat_queries(monkeypatch):
+    """Tests that a repeated query is served from the extraction cache"""
+    calls = []
+
+    def fake_extract(model, system_prompt, user_query, timeout=None):
+        calls.append(user_query)
+        return {"intent": "new_query", "preferredMakes": ["Kia"], "maxPrice": 15000}
+
+    monkeypatch.setattr(
+        "parameter_extraction_service.try_extract_with_model", fake_extract
+    )
+
+    query = "A Kia under 15000 for the cache test"
+    first = run_llm_with_history(query, [], force_model="fast")
+    first["preferredMakes"].append("BMW")  # Callers may mutate their copy
+    second = run_llm_with_history("  " + query.upper() + " ", [], force_model="fast")
+    assert len(calls) == 1
+    assert second["preferredMakes"] == ["Kia"]
+
+    run_llm_with_history(query, [], force_model="fast", bypass_cache=True)
+    assert len(calls) == 2
+
+
+def test_run_llm_with_history_returns_off_topic_reply_without_merging(monkeypatch):
+    """Tests that an off-topic reply skips the term scans and context merging"""
+
+    def fake_extract(model, system_prompt, user_query, timeout=None):
+        return {"isOffTopic": True, "offTopicResponse": "I can only help with cars."}
+
+    def fail_find_terms(*args):
+        raise AssertionError("find_terms should not run for off-topic replies")
+
+    monkeypatch.setattr(
+        "parameter_extraction_service.try_extract_with_model", fake_extract
+    )
+    monkeypatch.setattr("parameter_extraction_service.find_terms", fail_find_terms)
+
+    result = run_llm_with_history(
+        "tell me a joke about the weather",
+        [],
+        force_model="fast",
+        confirmed_context={"confirmedMakes": ["BMW"]},
+    )
+    assert result["isOffTopic"] is True
+    assert result["offTopicResponse"] == "I can only help with cars."
+    assert result["preferredMakes"] == []
+
+
+def test_extract_parameters_skips_classification_for_specific_keywords(monkeypatch):
+    """Tests that a query naming a known make goes to the LLM without being embedded"""
+
+    embedded = []
+
+    def fake_embedding(text):
+        embedded.append(text)
+        return None
+
+    def fake_extract(model, system_prompt, user_query, timeout=None):
+        return {"intent": "refine_criteria", "preferredMakes": ["Kia"]}
+
+    monkeypatch.setattr(
+        "parameter_extraction_service.get_normalized_query_embedding", fake_embedding
+    )
+    monkeypatch.setattr(
+        "parameter_extraction_service.try_extract_with_model", fake_extract
+    )
+
+    response = parameter_extraction_service.app.test_client().post(
+        "/extract_parameters",
+        json={
+            "query": "what about a kia instead",
+            "conversationHistory": [{"user": "I want a car", "ai": "Any make in mind?"}],
+        },
+    )
+    assert response.status_code == 200
+    assert response.get_json()["preferredMakes"] == ["Kia"]
+    assert embedded == []
+
+
+def test_extract_parameters_reports_clarify_intent_for_llm_results(monkeypatch):
+    """Tests that the SPECIFIC_SEARCH LLM branch reports the 'clarify' intent"""
+
+    def fake_extract(model, system_prompt, user_query, timeout=None):
+        return {"intent": "new_query", "preferredMakes": ["Mazda"], "clarificationNeeded": True}
+
+    monkeypatch.setattr(
+        "parameter_extraction_service.try_extract_with_model", fake_extract
+    )
+
+    response = parameter_extraction_service.app.test_client().post(
+        "/extract_parameters", json={"query": "a mazda for the school run"}
+    )
+    body = response.get_json()
+    assert body["intent"] == "clarify"
+    assert body["preferredMakes"] == ["Mazda"]
+
+
+def test_extract_parameters_sends_clarify_follow_ups_to_clarify_model(monkeypatch):
+    """Tests that an answer to the assistant's question skips the fast model"""
+    models = []
+
+    def fake_extract(model, system_prompt, user_query, timeout=None):
+        models.append(model)
+        return {"intent": "refine_criteria", "maxPrice": 15000.0}
+
+    monkeypatch.setattr(
+        "parameter_extraction_service.try_extract_with_model", fake_extract
+    )
+
+    response = parameter_extraction_service.app.test_client().post(
+        "/extract_parameters",
+        json={
+            "query": "about 15k for the hatchback",
+            "conversationHistory": [{"user": "I want a hatchback", "ai": "What's your budget?"}],
+            "lastQuestionAsked": "What's your budget?",
+            "forceModel": "clarify",
+        },
+    )
+    assert response.get_json()["intent"] == "clarify"
+    assert models == [parameter_extraction_service.CLARIFY_MODEL]
+
+
+def test_extract_with_models_hedged_returns_first_valid_result(monkeypatch):
+    """Tests that hedged extraction skips failed models and returns a valid result"""
+    results = {"model-a": None, "model-b": {"intent": "new_query"}, "model-c": {"no": "intent"}}
+
+    def fake_extract(model, system_prompt, user_query, timeout=None, cancel_event=None):
+        return results[model]
+
+    monkeypatch.setattr("parameter_extraction_service.try_extract_with_model", fake_extract)
+    assert extract_with_models_hedged(("model-a", "model-b", "model-c"), "prompt", "query") == {
+        "intent": "new_query"
+    }
+    assert extract_with_models_hedged(("model-a", "model-c"), "prompt", "query") is None
+
+
+def test_extract_with_models_hedged_cancels_losing_call(monkeypatch):
+    """Tests that the slower hedged call is told to close its stream once one wins"""
+    loser_cancelled = threading.Event()
+
+    def fake_extract(model, system_prompt, user_query, timeout=None, cancel_event=None):
+        if model == "fast":
+            return {"intent": "new_query"}
+        if cancel_event.wait(5):
+            loser_cancelled.set()
+        return None
+
+    monkeypatch.setattr("parameter_extraction_service.try_extract_with_model", fake_extract)
+    assert extract_with_models_hedged(("slow", "fast"), "prompt", "query") == {"intent": "new_query"}
+    assert loser_cancelled.wait(5)
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    response = FakeStreamResponse(['{"intent": "new_query"}'])
+    assert read_completion_stream(response, cancel_event=cancel_event) is None
+    assert response.closed
+
+
+def test_run_extraction_coalesced_shares_in_flight_call(caplog):
+    """Tests that concurrent identical extractions share a single upstream call"""
+    calls = []
+    release = threading.Event()
+
+    def slow_extract(model, system_prompt, user_query, timeout=None):
+        calls.append(model)
+        release.wait(5)
+        return {"intent": "new_query", "preferredMakes": ["BMW"]}
+
+    results = []
+
+    def run():
+        results.append(run_extraction_coalesced(slow_extract, "m", "prompt", "query"))
+
+    caplog.set_level("INFO", logger="parameter_extraction_service")
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    threads[0].start()
+    while not calls:
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    while sum("already in flight" in record.message for record in caplog.records) < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"intent": "new_query", "preferredMakes": ["BMW"]}] * 3
+
+
+def test_classify_intent_uses_normalized_label_matrix(monkeypatch):
+    """Tests that intent scores match cosine similarity against each label"""
+    label_embeddings = {
+        "SPECIFIC_SEARCH": np.array([3.0, 0.0, 0.0]),
+        "VAGUE_INQUIRY": np.array([0.0, 0.5, 0.0]),
+    }
+    names, matrix = build_label_matrix(label_embeddings)
+    assert names == ("SPECIFIC_SEARCH", "VAGUE_INQUIRY")
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+
+    monkeypatch.setattr(parameter_extraction_service, "PRECOMPUTED_LABEL_EMBEDDINGS", label_embeddings)
+    monkeypatch.setattr(parameter_extraction_service, "LABEL_NAMES", names)
+    monkeypatch.setattr(parameter_extraction_service, "LABEL_MATRIX", matrix)
+
+    assert classify_intent_zero_shot(np.array([10.0, 1.0, 0.0])) == "SPECIFIC_SEARCH"
+    assert classify_intent_zero_shot(np.array([0.1, 2.0, 0.0])) == "VAGUE_INQUIRY"
+    # Below threshold: the best label wins unless every score is very low
+    assert classify_intent_zero_shot(np.array([1.0, 0.2, 1.5])) == "SPECIFIC_SEARCH"
+    assert classify_intent_zero_shot(np.array([0.5, 0.4, 5.0])) == "VAGUE_INQUIRY"
+
+
+def test_build_enhanced_system_prompt_is_memoized():
+    """Tests that identical prompt inputs reuse the cached prompt string"""
+    history = [{"user": "I want an SUV", "ai": "What budget?"}]
+    args = ("under 30k", history, "SUV", VALID_MANUFACTURERS, VALID_FUEL_TYPES, VALID_VEHICLE_TYPES)
+    first = build_enhanced_system_prompt(*args, {"confirmedMakes": ["BMW"]})
+    second = build_enhanced_system_prompt(*args, {"confirmedMakes": ["BMW"]})
+    other = build_enhanced_system_prompt(*args, {"confirmedMakes": ["Audi"]})
+    assert second is first
+    assert "Preferred Makes: BMW" in first
+    assert "Preferred Makes: Audi" in other
+
+
+def test_build_label_matrix_pins_float32():
+    """Tests that float64 label embeddings are stacked into a contiguous float32 matrix"""
+    names, matrix = build_label_matrix(
+        {"A": np.array([3.0, 4.0], dtype=np.float64), "B": np.array([0.0, 2.0], dtype=np.float64)}
+    )
+    assert names == ("A", "B")
+    assert matrix.dtype == np.float32
+    assert matrix.flags["C_CONTIGUOUS"]
+    assert np.allclose(matrix, [[0.6, 0.8], [0.0, 1.0]])
+
+
+def test_read_completion_stream_stops_after_complete_json():
+    """Tests that streaming stops once a full JSON object has arrived"""
+    response = FakeStreamResponse(
+        ['Sure! {"intent": "new_', 'query", "offTopicResponse": "a } in {text"', "}", " Hope", " this helps."]
+    )
+    text = read_completion_stream(response)
+    assert text == 'Sure! {"intent": "new_query", "offTopicResponse": "a } in {text"}'
+    assert response.closed
+    assert response.lines_read < len(response.lines)
+
+
+def test_read_completion_stream_ignores_escaped_quotes():
+    """Tests that escaped quotes and braces inside strings do not end the JSON early"""
+    response = FakeStreamResponse(['{"offTopicResponse": "say \\', '"}\\"", ', '"intent": "x"}', " trailing"])
+    text = read_completion_stream(response)
+    assert json.loads(text) == {"offTopicResponse": 'say "}"', "intent": "x"}
+    assert response.lines_read < len(response.lines)
+
+
+def test_read_completion_stream_closes_stream_after_deadline():
+    """Tests that a stream still trickling tokens is abandoned at the deadline"""
+
+    class SlowStreamResponse(FakeStreamResponse):
+        def iter_lines(self):
+            for line in super().iter_lines():
+                time.sleep(0.02)
+                yield line
+
+    response = SlowStreamResponse(['{"intent": "new_query", "x": "'] + ["a"] * 200 + ['"}'])
+    start = time.monotonic()
+    assert read_completion_stream(response, deadline=start + 0.1) is None
+    assert time.monotonic() - start < 1.0
+    assert response.closed
+    assert response.lines_read < len(response.lines)
+
+
+def test_normalized_query_embedding_is_cached_by_text(monkeypatch):
+    """Tests that a repeated query, up to case and spacing, reuses its cached embedding"""
+    calls = []
+
+    def fake_embedding(text, out=None):
+        calls.append(text)
+        embedding = np.array([3.0, 4.0], dtype=np.float32)
+        if out is not None:
+            np.copyto(out, embedding)
+            return out
+        return embedding
+
+    monkeypatch.setattr("parameter_extraction_service.get_query_embedding", fake_embedding)
+
+    first = get_normalized_query_embedding("embedding cache test query").copy()
+    second = get_normalized_query_embedding("  Embedding cache\ttest QUERY ")
+    assert len(calls) == 1
+    assert np.allclose(first, [0.6, 0.8])
+    assert np.allclose(second, first)
+
+
+def test_label_embeddings_are_loaded_from_disk_cache(monkeypatch, tmp_path):
+    """Tests that a second start loads intent label embeddings instead of recomputing them"""
+    calls = []
+
+    def fake_embedding(text, out=None):
+        calls.append(text)
+        return np.array([float(len(calls)), 1.0], dtype=np.float32)
+
+    monkeypatch.setattr("parameter_extraction_service.get_query_embedding", fake_embedding)
+    monkeypatch.setattr("parameter_extraction_service.LABEL_EMBEDDINGS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("parameter_extraction_service.PRECOMPUTED_LABEL_EMBEDDINGS", {})
+    monkeypatch.setattr("parameter_extraction_service.LABEL_NAMES", ())
+    monkeypatch.setattr("parameter_extraction_service.LABEL_MATRIX", None)
+
+    initialize_app_components()
+    first = parameter_extraction_service.LABEL_MATRIX.copy()
+    assert len(calls) == len(parameter_extraction_service.INTENT_LABELS)
+
+    monkeypatch.setattr("parameter_extraction_service.LABEL_MATRIX", None)
+    initialize_app_components()
+    assert len(calls) == len(parameter_extraction_service.INTENT_LABELS)
+    assert np.allclose(parameter_extraction_service.LABEL_MATRIX, first)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("I want to buy a Toyota SUV", True),
+        ("bmw", True),
+        ("looking for something with 200 bhp", True),
+        ("Hi", False),
+        ("hello there friend", False),
+        ("what is the capital of France", False),
+    ],
+)
+def test_is_car_related_matches_without_automaton(monkeypatch, query, expected):
+    """Tests that the keyword automaton and the plain substring fallback agree"""
+    assert is_car_related.__wrapped__(query) is expected
+    monkeypatch.setattr("parameter_extraction_service.CAR_KEYWORD_AUTOMATON", None)
+    assert is_car_related.__wrapped__(query) is expected
+
+
+@pytest.mark.parametrize(
+    "query, expected_positive, expected_negated",
+    [
+        ("i like honda, but not toyota or ford.", {"Honda"}, {"Toyota", "Ford"}),
+        ("anything except bmw or audi, maybe a kia", {"Kia"}, {"BMW", "Audi"}),
+        ("no toyota. a toyota is fine", set(), {"Toyota"}),
+    ],
+)
+def test_find_terms_splits_positive_and_negated_mentions(
+    monkeypatch, query, expected_positive, expected_negated
+):
+    """Tests that find_terms gives the same split with and without the automata"""
+    assert find_terms(query, VALID_MANUFACTURERS) == (expected_positive, expected_negated)
+    monkeypatch.setattr("parameter_extraction_service.ahocorasick", None)
+    monkeypatch.setattr("parameter_extraction_service.NEGATION_TRIGGER_AUTOMATON", None)
+    assert find_terms(query, VALID_MANUFACTURERS) == (expected_positive, expected_negated)
+
+
+def test_json_responses_match_default_provider():
+    """Tests that the orjson provider returns the same JSON as Flask's default provider"""
+    app = parameter_extraction_service.app
+    payload = {"b": 1, "a": [1.5, None], "make": "Škoda"}
+    with app.app_context():
+        body = app.json.response(payload).get_data()
+        default_body = DefaultJSONProvider(app).response(payload).get_data()
+        for args, kwargs in [((), {}), ((1, "a"), {}), ((), {"b": 2, "a": 1})]:
+            assert json.loads(app.json.response(*args, **kwargs).get_data()) == json.loads(
+                DefaultJSONProvider(app).response(*args, **kwargs).get_data()
+            )
+    assert json.loads(body) == json.loads(default_body)
+    assert list(json.loads(body)) == list(json.loads(default_body))
+    response = app.test_client().post("/extract_parameters", json={})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "No query provided"}
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_embed_batcher_serves_forked_child(monkeypatch):
+    """Tests that a child forked after the batcher started gets a working batcher"""
+    retriever = pytest.importorskip("retriever.retriever")
+
+    class FakeModel:
+        def encode(self, texts, batch_size=None, convert_to_numpy=True):
+            return np.ones((len(texts), 4), dtype=np.float32)
+
+    monkeypatch.setattr(retriever, "_model", FakeModel())
+    monkeypatch.setattr(retriever, "EMBED_BATCH_TIMEOUT_SECONDS", 5.0)
+    # Start the worker thread in this (parent) process, like a preloaded master
+    assert retriever._encode_batched("warm up").shape == (4,)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = retriever._encode_batched("in child").shape == (4,)
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+
+    deadline = time.monotonic() + 15
+    while True:
+        done_pid, status = os.waitpid(pid, os.WNOHANG)
+        if done_pid:
+            break
+        if time.monotonic() > deadline:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            pytest.fail("forked child hung waiting for the embedding batcher")
+        time.sleep(0.05)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0